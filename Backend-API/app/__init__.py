@@ -6,6 +6,13 @@ IALab Suite API Package
 __version__ = "2.0.0"
 __author__ = "Borja Otero Ferreira"
 
-from .app import create_app
+__all__ = ['create_app']
 
-__all__ = ['create_app']
\ No newline at end of file
+
+def __getattr__(name):
+    # create_app se importa bajo demanda: importar app.core.* o app.utils.* (p. ej. desde
+    # los tests) no carga Flask, Socket.IO ni el resto de la aplicación
+    if name == 'create_app':
+        from .app import create_app
+        return create_app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
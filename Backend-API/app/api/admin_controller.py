@@ -0,0 +1,44 @@
+"""
+@Author: Borja Otero Ferreira
+Admin Controller - Endpoints de administración (profiler de peticiones lentas)
+"""
+from flask import Blueprint, jsonify, request
+from app.utils.profiler import profiler
+from app.utils.logger import logger
+
+admin_controller = Blueprint('admin_controller', __name__)
+
+
+@admin_controller.route('/api/admin/profiling', methods=['GET'])
+def get_profiling():
+    """Estado del profiler de muestreo y último perfil guardado"""
+    return jsonify({
+        'success': True,
+        'profiling': profiler.get_stats()
+    })
+
+
+@admin_controller.route('/api/admin/profiling', methods=['POST'])
+def set_profiling():
+    """
+    Activa o desactiva el profiler en caliente
+    Body JSON: {"enabled": true, "threshold_seconds": 5, "interval_ms": 10, "format": "speedscope"}
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        stats = profiler.configure(
+            enabled=data.get('enabled'),
+            threshold_seconds=data.get('threshold_seconds'),
+            interval_ms=data.get('interval_ms'),
+            output_format=data.get('format')
+        )
+    except (TypeError, ValueError) as e:
+        logger.warning(f"Configuración de profiling no válida: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    return jsonify({
+        'success': True,
+        'profiling': stats
+    })
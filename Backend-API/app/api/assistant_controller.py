@@ -8,6 +8,7 @@ from app.api.base_controller import BaseController
 from app.services.assistant_service import assistant_service
 from app.models.data_models import UserInput, ApiResponse
 from app.utils.logger import logger
+from app.utils.socket_instance import conversation_room
 
 class AssistantController(BaseController):
     """Controller for assistant-related endpoints"""
@@ -36,12 +37,23 @@ class AssistantController(BaseController):
             user_input = UserInput(
                 content=content,
                 tools=tools,
-                rag=rag
+                rag=rag,
+                session_id=data.get('session_id') or data.get('sid') or request.headers.get('X-Socket-Id'),
+                priority=self._parse_priority(data.get('priority')),
+                # El cliente indica su sid de Socket.IO para recibir el stream
+                sid=data.get('sid') or request.headers.get('X-Socket-Id'),
+                room=conversation_room(data['conversation_id']) if data.get('conversation_id') else None,
+                conversation_id=data.get('conversation_id'),
+                version=self._parse_version(data.get('version'))
             )
             
-            logger.info(f"Usuario dijo: {content}")
+            logger.info(f"Usuario dijo: {content if not isinstance(content, list) else content[-1:]}")
             result = assistant_service.process_user_input(user_input, self.socketio)
             
+            # Server-side conversation: the client needs the new version (or the conflict)
+            if user_input.conversation_id:
+                return self._create_response(result, 409 if (result.data or {}).get('conflict') else 200)
+            
             # Return the EXACT format the frontend expects
             return 'Response finished! 📩'
             
@@ -50,17 +62,78 @@ class AssistantController(BaseController):
             return f'Error: {str(e)}', 500
     
     
+    def get_queue_status(self):
+        """Get inference queue status (depth, wait times)"""
+        try:
+            return jsonify({'success': True, 'data': assistant_service.get_queue_stats()})
+        except Exception as e:
+            return self._handle_error(e, "Error getting queue status")
+    
+    def get_sessions(self):
+        """Get the active assistant sessions"""
+        try:
+            return jsonify({'success': True, 'data': assistant_service.get_sessions()})
+        except Exception as e:
+            return self._handle_error(e, "Error getting sessions")
+    
+    def get_kv_cache_stats(self):
+        """Get prompt-prefix KV cache statistics"""
+        try:
+            return jsonify({'success': True, 'data': assistant_service.get_kv_cache_stats()})
+        except Exception as e:
+            return self._handle_error(e, "Error getting KV cache stats")
+    
+    def _parse_priority(self, value) -> int:
+        """Parse scheduler priority from request data (default 10)"""
+        try:
+            return int(value) if value is not None else 10
+        except (TypeError, ValueError):
+            return 10
+    
+    def _parse_version(self, value):
+        """Parse the conversation version sent by the client (None if missing)"""
+        try:
+            return int(value) if value is not None else None
+        except (TypeError, ValueError):
+            return None
+    
+    def get_conversation(self, conversation_id):
+        """Get the server-side history and version of a conversation"""
+        try:
+            conversation = assistant_service.get_conversation(conversation_id)
+            if conversation is None:
+                return jsonify({'success': False, 'error': f'Conversation {conversation_id} not found'}), 404
+            return jsonify({'success': True, 'data': conversation})
+        except Exception as e:
+            return self._handle_error(e, "Error getting conversation")
+    
+    def delete_conversation(self, conversation_id):
+        """Forget a server-side conversation"""
+        try:
+            if not assistant_service.delete_conversation(conversation_id):
+                return jsonify({'success': False, 'error': f'Conversation {conversation_id} not found'}), 404
+            return jsonify({'success': True})
+        except Exception as e:
+            return self._handle_error(e, "Error deleting conversation")
+    
     def stop_response(self):
-        """Stop the current response generation"""
+        """Stop the response of one session (HTTP clients; Socket.IO clients use the socket event)"""
         try:
-            result = assistant_service.stop_response()
+            data = request.get_json(silent=True) or request.form or {}
+            sid = data.get('sid') or request.headers.get('X-Socket-Id')
+            session_id = data.get('session_id') or sid
+            if not session_id:
+                return jsonify({"status": "error", "message": "Missing required field: session_id"}), 400
+            result = assistant_service.stop_response(session_id)
             
-            # Emit stop signal via WebSocket if available
+            # Emit stop signal via WebSocket if available (only to the stopped client)
             if self.socketio and result.success:
-                self.socketio.emit('response_stopped', {
+                payload = {
                     'message': 'Response stopped by user',
+                    'session_id': session_id,
                     'timestamp': time.time()
-                }, namespace='/test')
+                }
+                self.socketio.emit('response_stopped', payload, namespace='/test', to=sid or session_id)
             
             # Return the EXACT format the frontend expects
             return {"status": "success", "message": "Response stopped successfully"}
@@ -84,14 +157,73 @@ class AssistantController(BaseController):
             user_input = UserInput(
                 content=content,
                 tools=tools,
-                rag=rag
+                rag=rag,
+                # La sesión de un socket es su sid: el cliente no puede elegir la de otro
+                session_id=request.sid,
+                priority=self._parse_priority(data.get('priority')),
+                sid=request.sid,
+                room=self._join_conversation(data.get('conversation_id')),
+                conversation_id=data.get('conversation_id'),
+                version=self._parse_version(data.get('version'))
             )
             
             result = assistant_service.process_user_input(user_input, self.socketio)
-            return {'success': result.success, 'message': result.message}
+            return {'success': result.success, 'message': result.message, 'data': result.data,
+                    'error': result.error}
             
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    def handle_socket_stop_response(self):
+        """Stop the responses of the calling socket (bound to request.sid, not to the payload)"""
+        result = assistant_service.stop_socket_response(request.sid)
+        if result.success and self.socketio:
+            self.socketio.emit('response_stopped', {
+                'message': 'Response stopped by user',
+                'session_id': request.sid,
+                'timestamp': time.time()
+            }, namespace='/test', to=request.sid)
+        return {'success': result.success, 'message': result.message, 'data': result.data,
+                'error': result.error}
+
+    def handle_resume(self, data):
+        """Resume a stream after a reconnection: {request_id, last_seq}"""
+        data = data or {}
+        request_id = data.get('request_id')
+        if not request_id:
+            return {'success': False, 'error': 'Missing request_id'}
+        try:
+            last_seq = int(data.get('last_seq', -1))
+        except (TypeError, ValueError):
+            return {'success': False, 'error': 'Invalid last_seq'}
+        result = assistant_service.resume_stream(request_id, last_seq, request.sid, self.socketio)
+        return {'success': result.success, 'message': result.message, 'data': result.data,
+                'error': result.error}
+    
+    def handle_join_conversation(self, data):
+        """Join this client to a conversation room so it receives that conversation's streams"""
+        conversation_id = (data or {}).get('conversation_id')
+        if not conversation_id:
+            return {'success': False, 'error': 'Missing conversation_id'}
+        return {'success': True, 'room': self._join_conversation(conversation_id)}
+    
+    def handle_leave_conversation(self, data):
+        """Leave a conversation room"""
+        from flask_socketio import leave_room
+        conversation_id = (data or {}).get('conversation_id')
+        if not conversation_id:
+            return {'success': False, 'error': 'Missing conversation_id'}
+        leave_room(conversation_room(conversation_id), namespace='/test')
+        return {'success': True}
+    
+    def _join_conversation(self, conversation_id):
+        """Join the current socket client to the conversation room (socket context only)"""
+        if not conversation_id:
+            return None
+        from flask_socketio import join_room
+        room = conversation_room(conversation_id)
+        join_room(room, namespace='/test')
+        return room
+
 # Global assistant controller instance
 assistant_controller = AssistantController()
@@ -0,0 +1,14 @@
+"""
+@Author: Borja Otero Ferreira
+Metrics Controller - Métricas de inferencia, RAG y herramientas en formato Prometheus
+"""
+from flask import Blueprint, Response
+from app.utils import metrics
+
+metrics_controller = Blueprint('metrics_controller', __name__)
+
+
+@metrics_controller.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Todas las métricas registradas (formato de texto de Prometheus)"""
+    return Response(metrics.registry.render(), mimetype=metrics.CONTENT_TYPE)
@@ -8,16 +8,44 @@ from app.services.model_service import model_service
 from app.services.assistant_service import assistant_service
 from app.models.data_models import ModelConfig, ApiResponse
 from app.utils.logger import logger
+from app.core.speculative import DRAFT_MODES
+from app.core.memory_planner import KV_CACHE_TYPES
+from app.config.settings import Config
 
 class ModelController(BaseController):
     """Controller for model-related endpoints"""
     
     def get_models_and_formats(self):
-        """Get available models and chat formats"""
+        """
+        Get available models and chat formats
+        
+        Query params (optional): offset, limit, q, architecture, quantization,
+        max_ram_mb, refresh=true
+        """
         try:
-            data = model_service.get_models_and_formats()
+            try:
+                offset = int(request.args.get('offset', 0))
+                limit = int(request.args['limit']) if request.args.get('limit') else None
+                max_ram_mb = int(request.args.get('max_ram_mb', 0) or 0)
+            except ValueError:
+                return jsonify({'error': 'offset, limit and max_ram_mb must be integers'}), 400
+            
+            if request.args.get('refresh', '').lower() == 'true':
+                model_service.refresh_models()
+            
+            data = model_service.get_models_and_formats(
+                offset=offset,
+                limit=limit,
+                search=request.args.get('q', ''),
+                architecture=request.args.get('architecture', ''),
+                quantization=request.args.get('quantization', ''),
+                max_ram_bytes=max_ram_mb * 1024 ** 2
+            )
             return jsonify({
                 'models': data.get('models', []),
+                'total': data.get('total', 0),
+                'offset': data.get('offset', 0),
+                'limit': data.get('limit'),
                 'formats': data.get('formats', [])
             })
             
@@ -37,6 +65,13 @@ class ModelController(BaseController):
             system_message = request.form.get('system_message', '')
             temperature = request.form.get('temperature', '')
             context_size = request.form.get('context', '')
+            run_async = request.form.get('async', '').lower() == 'true'
+            draft_mode = request.form.get('draft_mode', 'none') or 'none'
+            draft_model_path = request.form.get('draft_model_path') or None
+            draft_num_pred_tokens = request.form.get('draft_num_pred_tokens', '')
+            autotune = request.form.get('autotune') or None
+            kv_type = request.form.get('kv_type') or None
+            flash_attn = request.form.get('flash_attn', '')
             
             if not model_path:
                 return "Missing model_path parameter", 400
@@ -45,16 +80,52 @@ class ModelController(BaseController):
             if not model_service.validate_model_path(model_path):
                 return "Invalid model path or file does not exist", 400
             
+            if draft_mode not in DRAFT_MODES:
+                return f"Invalid draft_mode: {draft_mode}", 400
+            if draft_mode == 'draft_model' and not (
+                    draft_model_path and model_service.validate_model_path(draft_model_path)):
+                return "draft_mode 'draft_model' requires a valid draft_model_path", 400
+            if autotune not in (None, 'off', 'auto', 'retune'):
+                return f"Invalid autotune mode: {autotune}", 400
+            if kv_type is not None and kv_type not in KV_CACHE_TYPES:
+                return f"Invalid kv_type: {kv_type}", 400
+            
             # Parse parameters with defaults
             config = ModelConfig(
                 path=model_path,
                 temperature=float(temperature) if temperature else 0.81,
                 gpu_layers=int(gpu_layers) if gpu_layers else -1,
                 context_size=int(context_size) if context_size else 2048,
-                system_message=system_message
+                system_message=system_message,
+                draft_mode=draft_mode,
+                draft_model_path=draft_model_path,
+                draft_num_pred_tokens=int(draft_num_pred_tokens) if draft_num_pred_tokens else None,
+                autotune=autotune,
+                kv_type=kv_type,
+                flash_attn=flash_attn.lower() == 'true' if flash_attn else None
             )
             
-            result = assistant_service.load_model(config)
+            # Rechazar antes de cargar si el modelo no cabe en RAM con este contexto
+            if Config.MEMORY_PLANNER_ENFORCE:
+                try:
+                    plan = assistant_service.plan_model_load(config)
+                except (OSError, ValueError) as e:
+                    plan = None
+                    logger.warning(f"Memory plan unavailable for {model_path}: {e}")
+                if plan is not None and not plan.fits:
+                    return jsonify({
+                        'success': False,
+                        'error': f"Not enough memory for context {config.context_size}; "
+                                 f"largest safe context is {plan.max_safe_ctx}",
+                        'plan': plan.to_dict()
+                    }), 400
+            
+            result = assistant_service.load_model(config, wait=not run_async)
+            
+            if run_async:
+                if result.success:
+                    return jsonify({'success': True, 'data': result.data}), 202
+                return jsonify({'success': False, 'error': result.error}), 500
             
             if result.success:
                 # Return the EXACT format the frontend expects
@@ -74,6 +145,60 @@ class ModelController(BaseController):
             logger.error(f"Error loading model: {e}")
             return f"Error loading model: {str(e)}", 500
     
+    def get_load_plan(self):
+        """Estimate the memory of a load and the largest safe context before loading"""
+        try:
+            model_path = request.args.get('model_path')
+            if not model_path or not model_service.validate_model_path(model_path):
+                return jsonify({'success': False, 'error': 'Invalid model path or file does not exist'}), 400
+            kv_type = request.args.get('kv_type') or None
+            if kv_type is not None and kv_type not in KV_CACHE_TYPES:
+                return jsonify({'success': False, 'error': f'Invalid kv_type: {kv_type}'}), 400
+            flash_attn = request.args.get('flash_attn', '')
+            draft_mode = request.args.get('draft_mode', 'none') or 'none'
+            draft_model_path = request.args.get('draft_model_path') or None
+            if draft_mode == 'draft_model' and not (
+                    draft_model_path and model_service.validate_model_path(draft_model_path)):
+                return jsonify({'success': False,
+                                'error': "draft_mode 'draft_model' requires a valid draft_model_path"}), 400
+            
+            config = ModelConfig(
+                path=model_path,
+                gpu_layers=int(request.args.get('gpu_layers') or -1),
+                context_size=int(request.args.get('context') or 2048),
+                draft_mode=draft_mode,
+                draft_model_path=draft_model_path,
+                kv_type=kv_type,
+                flash_attn=flash_attn.lower() == 'true' if flash_attn else None
+            )
+            plan = assistant_service.plan_model_load(config)
+            return jsonify({'success': True, 'data': plan.to_dict()})
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        except Exception as e:
+            logger.error(f"Error planning model load: {e}")
+            return jsonify({'success': False, 'error': str(e)}), 500
+    
+    def get_load_status(self):
+        """Get the state of a model load job (or the recent jobs)"""
+        try:
+            job_id = request.args.get('job_id')
+            status = assistant_service.get_load_status(job_id)
+            if status is None:
+                return jsonify({'success': False, 'error': f'Load job {job_id} not found'}), 404
+            return jsonify({'success': True, 'data': status})
+        except Exception as e:
+            logger.error(f"Error getting load status: {e}")
+            return jsonify({'success': False, 'error': str(e)}), 500
+    
+    def get_resident_models(self):
+        """Get models resident in the pool with their memory usage"""
+        try:
+            return jsonify({'success': True, 'data': assistant_service.get_resident_models()})
+        except Exception as e:
+            logger.error(f"Error getting resident models: {e}")
+            return jsonify({'success': False, 'error': str(e)}), 500
+    
     def unload_model(self):
         """Unload the current model"""
         try:
@@ -0,0 +1,63 @@
+"""
+@Author: Borja Otero Ferreira
+OpenAI Controller - API compatible con OpenAI (/v1/chat/completions y /v1/models)
+Permite usar generadores de carga y clientes estándar contra el mismo motor que la interfaz web
+"""
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from app.config.settings import Config
+from app.services.openai_service import OpenAIError, openai_service
+from app.utils.logger import logger
+
+openai_controller = Blueprint('openai_controller', __name__)
+
+
+def _error_response(error: OpenAIError):
+    return jsonify(error.to_dict()), error.status
+
+
+def _check_api_key():
+    """Con OPENAI_API_KEY configurada se exige 'Authorization: Bearer <clave>'"""
+    if not Config.OPENAI_API_KEY:
+        return None
+    header = request.headers.get('Authorization', '')
+    if header != f'Bearer {Config.OPENAI_API_KEY}':
+        return _error_response(OpenAIError("Invalid API key", 401, 'authentication_error'))
+    return None
+
+
+@openai_controller.route('/v1/models', methods=['GET'])
+def list_models():
+    """Modelos disponibles (índice de modelos GGUF)"""
+    denied = _check_api_key()
+    if denied:
+        return denied
+    try:
+        return jsonify(openai_service.list_models())
+    except Exception as e:
+        logger.error(f"Error listando modelos (OpenAI API): {e}")
+        return _error_response(OpenAIError(str(e), 500, 'server_error'))
+
+
+@openai_controller.route('/v1/chat/completions', methods=['POST'])
+def chat_completions():
+    """Chat completion; con stream=true la respuesta se envía como Server-Sent Events"""
+    denied = _check_api_key()
+    if denied:
+        return denied
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return _error_response(OpenAIError("Request body must be a JSON object"))
+    try:
+        if body.get('stream'):
+            events = openai_service.stream_chat_completion(body)
+            return Response(
+                stream_with_context(events),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+        return jsonify(openai_service.create_chat_completion(body))
+    except OpenAIError as e:
+        return _error_response(e)
+    except Exception as e:
+        logger.error(f"Error en chat completion (OpenAI API): {e}")
+        return _error_response(OpenAIError(str(e), 500, 'server_error'))
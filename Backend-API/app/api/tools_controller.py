@@ -6,16 +6,16 @@ Tools Controller - Maneja las API relacionadas con herramientas
 from flask import request, jsonify
 from app.utils.logger import logger
 from app.core.tools_manager import tools_manager
-import json
 import traceback  # Importar aquí para evitar ImportError más adelante
-from enum import Enum
 # Importar el proveedor de instancias socketio
 from app.utils import socket_instance
+from app.utils import serialization
 
 
 def make_json_serializable(obj):
     """
     Convierte objetos no serializables a JSON en formatos compatibles
+    (enums a su valor y objetos a sus atributos públicos)
     
     Args:
         obj: El objeto a convertir
@@ -23,19 +23,7 @@ def make_json_serializable(obj):
     Returns:
         Un objeto serializable a JSON
     """
-    if isinstance(obj, dict):
-        return {k: make_json_serializable(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [make_json_serializable(item) for item in obj]
-    elif isinstance(obj, Enum):
-        # Convertir enums a su valor string
-        return obj.value
-    elif hasattr(obj, '__dict__'):
-        # Convertir objetos personalizados a diccionarios
-        return {k: make_json_serializable(v) for k, v in obj.__dict__.items() 
-                if not k.startswith('_')}
-    else:
-        return obj
+    return serialization.to_jsonable(obj)
 
 
 class ToolsController:
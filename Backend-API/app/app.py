@@ -5,7 +5,7 @@ Main application factory for IALab Suite API
 import os
 import signal
 import time
-from flask import Flask
+from flask import Flask, request
 from flask_socketio import SocketIO
 from app.config.settings import get_config
 from app.utils.logger import logger
@@ -15,9 +15,15 @@ from app.api.assistant_controller import assistant_controller
 from app.api.static_controller import static_controller
 from app.api.tools_controller import tools_controller
 from app.api.agent_controller import agent_controller
+from app.api.openai_controller import openai_controller
+from app.api.metrics_controller import metrics_controller
+from app.api.admin_controller import admin_controller
 from app.services.assistant_service import assistant_service
+from app.core.stream_emitter import stream_settings
 # Importar el proveedor de instancias socketio
 from app.utils import socket_instance
+from app.utils import serialization
+from app.utils import blocking
 
 def create_app(config_name=None):
     """Application factory pattern"""
@@ -54,13 +60,21 @@ def create_app(config_name=None):
     # Configure app
     app.config.from_object(config)
     
+    # JSON de jsonify/request.get_json con la capa de serialización (orjson)
+    app.json = serialization.FastJSONProvider(app)
+    
     # Create SocketIO
     socketio = SocketIO(
         app, 
         async_mode=config.SOCKETIO_ASYNC_MODE,
         cors_allowed_origins=config.SOCKETIO_CORS_ALLOWED_ORIGINS,
-        max_size=config.SOCKETIO_MAX_SIZE
+        max_size=config.SOCKETIO_MAX_SIZE,
+        **serialization.socketio_options(config.SOCKETIO_SERIALIZER)
     )
+    logger.info(f"Serialización: {serialization.get_backend()} (Socket.IO: {config.SOCKETIO_SERIALIZER})")
+    
+    # gevent/eventlet: inferencia, RAG y herramientas en hilos nativos, emits pasados al loop
+    blocking.configure(socketio, config.SOCKETIO_ASYNC_MODE, config.BLOCKING_POOL_SIZE)
     
     # Almacenar la instancia socketio en el proveedor global
     socket_instance.set_socketio(socketio)
@@ -92,6 +106,9 @@ def _register_routes(app):
     app.route('/api/models-and-formats', methods=['GET'])(model_controller.get_models_and_formats)
     app.route('/load_model', methods=['POST'])(model_controller.load_model)
     app.route('/unload_model', methods=['POST'])(model_controller.unload_model)
+    app.route('/api/models/resident', methods=['GET'])(model_controller.get_resident_models)
+    app.route('/api/models/load-status', methods=['GET'])(model_controller.get_load_status)
+    app.route('/api/models/plan', methods=['GET'])(model_controller.get_load_plan)
     
     # API routes - Chat
     app.route('/actualizar_historial', methods=['POST'])(chat_controller.save_chat)
@@ -101,6 +118,11 @@ def _register_routes(app):
     # API routes - Assistant
     app.route('/user_input', methods=['POST'])(assistant_controller.handle_user_input)
     app.route('/stop_response', methods=['POST'])(assistant_controller.stop_response)
+    app.route('/api/queue/status', methods=['GET'])(assistant_controller.get_queue_status)
+    app.route('/api/cache/stats', methods=['GET'])(assistant_controller.get_kv_cache_stats)
+    app.route('/api/sessions', methods=['GET'])(assistant_controller.get_sessions)
+    app.route('/api/conversations/<conversation_id>', methods=['GET'])(assistant_controller.get_conversation)
+    app.route('/api/conversations/<conversation_id>', methods=['DELETE'])(assistant_controller.delete_conversation)
     
     # API routes - Tools
     app.route('/api/tools/available', methods=['GET'])(tools_controller.get_available_tools)
@@ -110,6 +132,15 @@ def _register_routes(app):
     
     # Register Blueprints - Agents
     app.register_blueprint(agent_controller)
+    
+    # Register Blueprints - OpenAI-compatible API
+    app.register_blueprint(openai_controller)
+    
+    # Register Blueprints - Prometheus metrics
+    app.register_blueprint(metrics_controller)
+    
+    # Register Blueprints - Admin (profiling)
+    app.register_blueprint(admin_controller)
 
 
 def _register_socket_events(socketio):
@@ -126,6 +157,16 @@ def _register_socket_events(socketio):
             logger.error(f"Error handling socket user input: {e}")
             return {'success': False, 'error': str(e)}
     
+    @socketio.on('join_conversation', namespace='/test')
+    def handle_join_conversation(data):
+        """Receive the streams of a conversation (e.g. from several tabs)"""
+        return assistant_controller.handle_join_conversation(data)
+    
+    @socketio.on('leave_conversation', namespace='/test')
+    def handle_leave_conversation(data):
+        """Stop receiving the streams of a conversation"""
+        return assistant_controller.handle_leave_conversation(data)
+    
     @socketio.on('connect', namespace='/test')
     def handle_connect():
         """Handle client connection"""
@@ -150,6 +191,32 @@ def _register_socket_events(socketio):
     def handle_disconnect():
         """Handle client disconnection"""
         logger.info("Client disconnected from WebSocket")
+        stream_settings.remove(request.sid)
+        # Sin cliente no tiene sentido seguir generando su respuesta (salvo que reconecte y la reanude)
+        assistant_service.handle_disconnect(request.sid)
+    
+    @socketio.on('stop_response', namespace='/test')
+    def handle_stop_response(data=None):
+        """Stop the responses of this client (its session is its sid)"""
+        return assistant_controller.handle_socket_stop_response()
+    
+    @socketio.on('resume', namespace='/test')
+    def handle_resume(data):
+        """Replay the frames of a stream missed during a reconnection"""
+        return assistant_controller.handle_resume(data)
+    
+    @socketio.on('stream_settings', namespace='/test')
+    def handle_stream_settings(data):
+        """Set the token streaming cadence (flush_ms / flush_bytes) for this client"""
+        try:
+            data = data or {}
+            settings = stream_settings.set(request.sid, data.get('flush_ms'), data.get('flush_bytes'))
+            # Las respuestas se generan por session_id: aplicar también a la sesión indicada
+            if data.get('session_id'):
+                stream_settings.set(data['session_id'], data.get('flush_ms'), data.get('flush_bytes'))
+            return {'success': True, 'settings': settings}
+        except (TypeError, ValueError) as e:
+            return {'success': False, 'error': f'Invalid stream settings: {e}'}
     
     @socketio.on('request_tools_registry', namespace='/test')
     def handle_request_tools_registry(data=None):
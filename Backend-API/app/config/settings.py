@@ -13,9 +13,11 @@ class Config:
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     
     # SocketIO Configuration
-    SOCKETIO_ASYNC_MODE = 'threading'
+    SOCKETIO_ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE', 'threading')
     SOCKETIO_CORS_ALLOWED_ORIGINS = "*"
     SOCKETIO_MAX_SIZE = 1024 * 1024  # 1MB
+    # Hilos nativos para llamadas bloqueantes cuando el servidor corre sobre gevent/eventlet
+    BLOCKING_POOL_SIZE = int(os.environ.get('BLOCKING_POOL_SIZE', 16))
     
     # Model Configuration
     DEFAULT_MODEL_PATH = "Z:/Modelos LM Studio/lmstudio-community/gemma-3-12b-it-GGUF/gemma-3-12b-it-Q4_K_M.gguf"
@@ -28,6 +30,7 @@ class Config:
     CHATS_DIR = 'chats'
     LOGS_DIR = 'logs'
     DOCUMENTS_DIR = 'documents'
+    CACHE_DIR = 'cache'
     
     # Logging Configuration
     LOG_LEVEL = 'INFO'
@@ -37,6 +40,101 @@ class Config:
     DEFAULT_TEMPERATURE = 0.81
     DEFAULT_GPU_LAYERS = -1
     DEFAULT_CONTEXT_SIZE = 2048
+    
+    # Presupuesto de contexto (historial ajustado a n_ctx menos la reserva de respuesta)
+    CONTEXT_TRIM_POLICY = os.environ.get('CONTEXT_TRIM_POLICY', 'drop')  # drop | truncate
+    CONTEXT_RESPONSE_RESERVE_TOKENS = int(os.environ.get('CONTEXT_RESPONSE_RESERVE_TOKENS', 1024))
+    CONTEXT_MIN_RESPONSE_TOKENS = 256
+    CONTEXT_TRUNCATE_KEEP_TOKENS = 256
+    CONTEXT_MESSAGE_OVERHEAD_TOKENS = 8
+    CONTEXT_IMAGE_TOKENS = 768
+    
+    # Motor de batching continuo para chats sin herramientas ni RAG (contexto y KV propios)
+    BATCH_ENGINE_ENABLED = os.environ.get('BATCH_ENGINE_ENABLED', 'false').lower() == 'true'
+    BATCH_ENGINE_SLOTS = int(os.environ.get('BATCH_ENGINE_SLOTS', 4))
+    BATCH_ENGINE_SLOT_CTX = int(os.environ.get('BATCH_ENGINE_SLOT_CTX', 0))  # 0 = n_ctx del modelo
+    BATCH_ENGINE_N_BATCH = int(os.environ.get('BATCH_ENGINE_N_BATCH', 512))
+    
+    # Proceso worker dueño de los modelos (IPC por Pipe); se reinicia si muere
+    INFERENCE_WORKER_ENABLED = os.environ.get('INFERENCE_WORKER_ENABLED', 'false').lower() == 'true'
+    # Procesos worker (pesos compartidos por mmap; cada uno con sus núcleos, contexto y caché KV)
+    INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', 1))
+    INFERENCE_WORKER_PIN_CPUS = os.environ.get('INFERENCE_WORKER_PIN_CPUS', 'true').lower() == 'true'
+    INFERENCE_WORKER_START_TIMEOUT_SECONDS = int(os.environ.get('INFERENCE_WORKER_START_TIMEOUT_SECONDS', 60))
+    INFERENCE_WORKER_MAX_BACKOFF_SECONDS = int(os.environ.get('INFERENCE_WORKER_MAX_BACKOFF_SECONDS', 30))
+    
+    # Caché KV y planificador de memoria de las cargas
+    DEFAULT_KV_CACHE_TYPE = os.environ.get('DEFAULT_KV_CACHE_TYPE', 'f16')  # f16 | q8_0 | q4_0
+    DEFAULT_FLASH_ATTN = os.environ.get('DEFAULT_FLASH_ATTN', 'false').lower() == 'true'
+    MEMORY_PLANNER_ENFORCE = os.environ.get('MEMORY_PLANNER_ENFORCE', 'true').lower() == 'true'
+    MEMORY_PLANNER_HEADROOM_MB = int(os.environ.get('MEMORY_PLANNER_HEADROOM_MB', 1024))
+    
+    # Streams reanudables: frames guardados por petición y tiempo que se conservan
+    STREAM_BUFFER_FRAMES = int(os.environ.get('STREAM_BUFFER_FRAMES', 4096))
+    STREAM_BUFFER_TTL_SECONDS = int(os.environ.get('STREAM_BUFFER_TTL_SECONDS', 300))
+    STREAM_BUFFER_MAX_AGE_SECONDS = int(os.environ.get('STREAM_BUFFER_MAX_AGE_SECONDS', 3600))
+    # Margen para reconectar antes de cancelar la respuesta de un cliente desconectado
+    STREAM_RESUME_GRACE_SECONDS = int(os.environ.get('STREAM_RESUME_GRACE_SECONDS', 30))
+    
+    # API compatible con OpenAI (/v1): clave opcional, espera máxima y prioridad en la cola
+    OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY', '')
+    OPENAI_REQUEST_TIMEOUT_SECONDS = int(os.environ.get('OPENAI_REQUEST_TIMEOUT_SECONDS', 600))
+    OPENAI_DEFAULT_PRIORITY = int(os.environ.get('OPENAI_DEFAULT_PRIORITY', 10))
+    
+    # Serialización de Socket.IO: 'json' (orjson si está instalado) o 'msgpack' (frames
+    # binarios; el cliente debe usar socket.io-msgpack-parser)
+    SOCKETIO_SERIALIZER = os.environ.get('SOCKETIO_SERIALIZER', 'json').lower()
+    
+    # Sesiones de asistente (flags, parada e historial por usuario)
+    SESSION_IDLE_TTL_SECONDS = int(os.environ.get('SESSION_IDLE_TTL_SECONDS', 3600))
+    
+    # Conversaciones guardadas en el servidor (el cliente envía solo el mensaje nuevo)
+    CONVERSATION_MAX_COUNT = int(os.environ.get('CONVERSATION_MAX_COUNT', 1000))
+    CONVERSATION_IDLE_TTL_SECONDS = int(os.environ.get('CONVERSATION_IDLE_TTL_SECONDS', 86400))
+    
+    # Trazas por petición (spans en JSONL; opcionalmente emitidas al cliente como 'trace_span')
+    TRACING_ENABLED = os.environ.get('TRACING_ENABLED', 'false').lower() == 'true'
+    TRACE_FILE = os.path.join(LOGS_DIR, 'traces.jsonl')
+    TRACE_MAX_MB = int(os.environ.get('TRACE_MAX_MB', 50))
+    TRACE_EMIT_TO_CLIENT = os.environ.get('TRACE_EMIT_TO_CLIENT', 'false').lower() == 'true'
+    
+    # Profiler de muestreo: guarda en logs/profiles/ las peticiones que superan el umbral
+    PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', 'false').lower() == 'true'
+    PROFILER_THRESHOLD_SECONDS = float(os.environ.get('PROFILER_THRESHOLD_SECONDS', 10))
+    PROFILER_INTERVAL_MS = float(os.environ.get('PROFILER_INTERVAL_MS', 10))
+    PROFILER_FORMAT = os.environ.get('PROFILER_FORMAT', 'speedscope')  # speedscope | collapsed
+    PROFILER_MAX_FILES = int(os.environ.get('PROFILER_MAX_FILES', 200))
+    PROFILES_DIR = os.path.join(LOGS_DIR, 'profiles')
+    
+    # Envío agrupado de tokens por socket (cada cliente puede fijar su cadencia)
+    STREAM_FLUSH_MS = float(os.environ.get('STREAM_FLUSH_MS', 30))
+    STREAM_FLUSH_BYTES = int(os.environ.get('STREAM_FLUSH_BYTES', 256))
+    
+    # Índice persistente de modelos GGUF (cabeceras leídas una sola vez por fichero)
+    MODEL_INDEX_PATH = os.path.join(CACHE_DIR, 'model_index.json')
+    MODEL_INDEX_REFRESH_SECONDS = int(os.environ.get('MODEL_INDEX_REFRESH_SECONDS', 60))
+    
+    # Autotune de hilos/batch de CPU por modelo (off | auto | retune)
+    AUTOTUNE_MODE = os.environ.get('AUTOTUNE_MODE', 'off')
+    AUTOTUNE_PROFILES_PATH = os.path.join(CACHE_DIR, 'autotune_profiles.json')
+    AUTOTUNE_BATCH_SIZES = (256, 512, 1024)
+    AUTOTUNE_PROMPT_TOKENS = 256
+    AUTOTUNE_GENERATION_TOKENS = 24
+    AUTOTUNE_EXTRA_THREADS = [int(t) for t in os.environ.get('AUTOTUNE_EXTRA_THREADS', '').split(',') if t.strip()]
+    
+    # Prompt-prefix KV cache (reutilización del estado entre turnos)
+    KV_CACHE_ENABLED = os.environ.get('KV_CACHE_ENABLED', 'true').lower() == 'true'
+    KV_CACHE_CAPACITY_MB = int(os.environ.get('KV_CACHE_CAPACITY_MB', 2048))
+    
+    # Snapshots KV en disco junto a los chats guardados (opcional)
+    KV_SNAPSHOTS_ENABLED = os.environ.get('KV_SNAPSHOTS_ENABLED', 'false').lower() == 'true'
+    KV_SNAPSHOTS_DIR = os.path.join(CHATS_DIR, 'kv')
+    KV_SNAPSHOTS_MAX_MB = int(os.environ.get('KV_SNAPSHOTS_MAX_MB', 8192))
+    
+    # Pool de modelos residentes (0 = presupuesto automático según la RAM física)
+    MODEL_POOL_MAX_RESIDENT = int(os.environ.get('MODEL_POOL_MAX_RESIDENT', 2))
+    MODEL_POOL_RAM_BUDGET_MB = int(os.environ.get('MODEL_POOL_RAM_BUDGET_MB', 0))
+    MODEL_POOL_RAM_FRACTION = float(os.environ.get('MODEL_POOL_RAM_FRACTION', 0.75))
 
 class DevelopmentConfig(Config):
     """Development configuration"""
@@ -46,7 +144,7 @@ class DevelopmentConfig(Config):
 class ProductionConfig(Config):
     """Production configuration"""
     DEBUG = False
-    SOCKETIO_ASYNC_MODE = 'gevent'
+    SOCKETIO_ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE', 'gevent')
     SOCKETIO_CORS_ALLOWED_ORIGINS = "*"  # Configure specific origins in production
     SECRET_KEY = os.environ.get('SECRET_KEY')
     
@@ -3,8 +3,65 @@ Core modules for IALab Suite
 Contiene los componentes principales: Assistant, Cortex, RAG y SocketResponseHandler
 """
 
-from .assistant import Assistant
-from .rag import Retriever
-from .socket_handler import SocketResponseHandler
+import importlib
 
-__all__ = ['Assistant', 'Cortex', 'Retriever', 'SocketResponseHandler']
+# Nombre exportado -> submódulo que lo define. Se importan bajo demanda para que los
+# módulos ligeros (scheduler, métricas...) no arrastren llama_cpp, langchain y Flask
+# (model_pool, memory_planner... coinciden con su submódulo: una vez importado, el paquete
+# devuelve el submódulo; la instancia se importa desde él, como hace todo el código)
+_EXPORTS = {
+    'Assistant': 'assistant',
+    'Retriever': 'rag',
+    'SocketResponseHandler': 'socket_handler',
+    'InferenceScheduler': 'scheduler',
+    'inference_scheduler': 'scheduler',
+    'PrefixKVCache': 'kv_cache',
+    'prefix_kv_cache': 'kv_cache',
+    'ModelPool': 'model_pool',
+    'model_pool': 'model_pool',
+    'ModelLoadManager': 'model_loader',
+    'model_load_manager': 'model_loader',
+    'ContextBudgeter': 'context_budget',
+    'context_budgeter': 'context_budget',
+    'GenerationMeter': 'speculative',
+    'build_draft_model': 'speculative',
+    'ContinuousBatchEngine': 'batch_engine',
+    'batch_engine_manager': 'batch_engine',
+    'CPUAutotuner': 'autotune',
+    'cpu_autotuner': 'autotune',
+    'MemoryPlanner': 'memory_planner',
+    'memory_planner': 'memory_planner',
+    'StreamEmitter': 'stream_emitter',
+    'stream_settings': 'stream_emitter',
+    'AssistantSession': 'session',
+    'SessionManager': 'session',
+    'session_manager': 'session',
+    'CancellationToken': 'cancellation',
+    'RequestCancelled': 'cancellation',
+    'ConversationStore': 'conversation_store',
+    'ConversationVersionError': 'conversation_store',
+    'conversation_store': 'conversation_store',
+    'InferenceWorkerSupervisor': 'inference_worker',
+    'RemoteModel': 'inference_worker',
+    'inference_worker': 'inference_worker',
+}
+
+__all__ = ['Assistant', 'Cortex', 'Retriever', 'SocketResponseHandler',
+           'InferenceScheduler', 'inference_scheduler', 'PrefixKVCache', 'prefix_kv_cache',
+           'ModelPool', 'model_pool', 'ModelLoadManager', 'model_load_manager',
+           'ContextBudgeter', 'context_budgeter',
+           'GenerationMeter', 'build_draft_model',
+           'ContinuousBatchEngine', 'batch_engine_manager',
+           'CPUAutotuner', 'cpu_autotuner', 'MemoryPlanner', 'memory_planner',
+           'StreamEmitter', 'stream_settings',
+           'AssistantSession', 'SessionManager', 'session_manager',
+           'CancellationToken', 'RequestCancelled',
+           'ConversationStore', 'ConversationVersionError', 'conversation_store',
+           'InferenceWorkerSupervisor', 'RemoteModel', 'inference_worker']
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(f'.{module}', __name__), name)
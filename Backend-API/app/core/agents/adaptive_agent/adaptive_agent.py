@@ -16,6 +16,8 @@ except ImportError:
     pass
 
 from app.utils.logger import logger
+from app.utils import metrics
+from app.utils.tracing import tracer
 from dotenv import load_dotenv
 
 # Importar módulos del agente
@@ -115,7 +117,9 @@ class AdaptiveAgent:
         try:
             # Paso 1: Analizar la tarea del usuario
             self._safe_emit_status("🧠 Analizando la tarea solicitada...", 'info')
-            task_analysis = self.task_analyzer.analyze_user_task(self.original_prompt)
+            with metrics.agent_phase_seconds.labels('adaptive', 'analyze').time(), \
+                    tracer.span('agent.analyze', agent='adaptive'):
+                task_analysis = self.task_analyzer.analyze_user_task(self.original_prompt)
             
             if not task_analysis:
                 self._safe_emit_status("⚠️ No se pudo analizar la tarea. Generando respuesta directa...")
@@ -123,11 +127,13 @@ class AdaptiveAgent:
             
             # Paso 2: Ejecutar planificación adaptativa (el planificador ya envía la respuesta por streaming)
             self._safe_emit_status("🎯 Iniciando planificación", 'info')
-            execution_results = self.adaptive_planner.run_adaptive_plan(
-                task_analysis, 
-                self.original_prompt, 
-                self._safe_emit_status
-            )
+            with metrics.agent_phase_seconds.labels('adaptive', 'plan').time(), \
+                    tracer.span('agent.plan', agent='adaptive'):
+                execution_results = self.adaptive_planner.run_adaptive_plan(
+                    task_analysis, 
+                    self.original_prompt, 
+                    self._safe_emit_status
+                )
             # Paso 3: Emitir la señal de finalización tras el streaming
             from app.core.socket_handler import SocketResponseHandler
             SocketResponseHandler.emit_finalization_signal(self.socket)
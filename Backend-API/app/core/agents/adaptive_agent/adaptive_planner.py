@@ -11,6 +11,7 @@ from typing import Dict, Any, Optional, List
 from ..models import TaskPlan, TaskStep, TaskStatus
 from ..utils import clean_error_message, safe_emit_tool_result
 from app.utils.logger import logger
+from app.utils.tracing import llm_stream
 
 
 class AdaptiveTaskPlanner:
@@ -247,7 +248,7 @@ Como un experto reflexivo, analiza profundamente la situación, considera el con
             
             # Obtener reflexión del modelo 
             reflection_response = ""
-            for chunk in self.model.create_chat_completion(messages=reflection_prompt, max_tokens=1200, stream=True, temperature=0.7):
+            for chunk in llm_stream(self.model, reflection_prompt, 'llm.reflection', max_tokens=1200, temperature=0.7):
                 if 'content' in chunk['choices'][0]['delta']:
                     reflection_response += chunk['choices'][0]['delta']['content']
             
@@ -364,7 +365,7 @@ Diseña el próximo paso MÁS ESTRATÉGICO e INTELIGENTE."""
             
             # Obtener respuesta del modelo 
             step_response = ""
-            for chunk in self.model.create_chat_completion(messages=step_prompt, max_tokens=700, stream=True, temperature=0.3):
+            for chunk in llm_stream(self.model, step_prompt, 'llm.decision', max_tokens=700, temperature=0.3):
                 if 'content' in chunk['choices'][0]['delta']:
                     step_response += chunk['choices'][0]['delta']['content']
             
@@ -899,8 +900,7 @@ ESTILO DE RESPUESTA:
             response , _ = SocketResponseHandler.stream_chat_completion(
                 self.model,
                 final_response_prompt,
-                self.socket,
-                max_tokens=8192
+                self.socket
             )
             # Mostrar la respuesta final limpia (solo para logs)
             emit_status_func("\n" + "="*50, 'info')
@@ -11,6 +11,7 @@ from typing import Dict, Any, Optional, List, Tuple
 from ..models import TaskPlan, TaskStep, TaskStatus
 from ..utils import clean_error_message, safe_emit_tool_result
 from app.utils.logger import logger
+from app.utils.tracing import llm_stream, tracer
 from app.core.socket_handler import SocketResponseHandler
 
 class OptimizedAdaptiveTaskPlanner:
@@ -284,7 +285,7 @@ SITUACIÓN ACTUAL:
                 }
             ]
             
-            response = self._get_model_response(action_prompt, max_tokens=400)
+            response = self._get_model_response(action_prompt, max_tokens=400, span_name='llm.decision')
             SocketResponseHandler.emit_console_output(self.socket, response, 'pensamiento')
             
             action = self._parse_json_response(response)
@@ -342,7 +343,7 @@ QUERIES YA USADAS:
 Genera una query alternativa concisa y específica que no haya sido usada."""
                 }
             ]
-            response = self._get_model_response(alternative_prompt, max_tokens=200)
+            response = self._get_model_response(alternative_prompt, max_tokens=200, span_name='llm.alternative_query')
             return self._parse_json_response(response)
         except Exception as e:
             logger.error(f"Error generando query alternativa: {e}")
@@ -523,7 +524,7 @@ MÉTRICAS:
                 }
             ]
             
-            response = self._get_model_response(reflection_prompt, max_tokens=300)
+            response = self._get_model_response(reflection_prompt, max_tokens=300, span_name='llm.reflection')
             SocketResponseHandler.emit_console_output(self.socket, response, 'pensamiento')
             reflection = self._parse_json_response(response)
             
@@ -613,20 +614,25 @@ MÉTRICAS:
         
         return " | ".join(context_parts)
     
-    def _get_model_response(self, messages: List[Dict], max_tokens: int = 8192) -> str:
+    def _get_model_response(self, messages: List[Dict], max_tokens: Optional[int] = None,
+                            span_name: str = 'llm') -> str:
         """Obtiene respuesta del modelo con streaming."""
         response = ""
         try:
+            if max_tokens is None:
+                from app.core.context_budget import context_budgeter
+                max_tokens = context_budgeter.response_budget(self.model, messages)
             # Añadir '/no_think' al final del último mensaje del usuario
             if messages and messages[-1]['role'] == 'user':
                 messages = messages.copy()
                 messages[-1] = messages[-1].copy()
                 messages[-1]['content'] = f"{messages[-1]['content'].rstrip()} /no_think"
 
-            for chunk in self.model.create_chat_completion(
-                messages=messages, 
+            for chunk in llm_stream(
+                self.model,
+                messages, 
+                span_name,
                 max_tokens=max_tokens, 
-                stream=True, 
                 temperature=0.1
             ):
                 if 'content' in chunk['choices'][0]['delta']:
@@ -691,6 +697,11 @@ MÉTRICAS:
     
     def _execute_step(self, step: TaskStep, emit_status_func):
         """Ejecuta un paso individual"""
+        with tracer.span('plan.step', step=step.id, tool=step.tool_name) as span:
+            self._run_step(step)
+            span.set_attribute('status', step.status.value)
+    
+    def _run_step(self, step: TaskStep):
         try:
             step.status = TaskStatus.IN_PROGRESS
             
@@ -781,7 +792,6 @@ MÉTRICAS:
                 model=self.model,
                 messages=final_prompt,
                 socket=self.socket,
-                max_tokens=8192,
                 user_tokens=total_user_tokens,
                 process_line_breaks=True,
                 response_queue=response_queue,
@@ -6,6 +6,7 @@ import json
 import re
 from typing import Dict, Any, Optional, List
 from app.utils.logger import logger
+from app.utils.tracing import llm_stream
 
 
 class TaskAnalyzer:
@@ -34,7 +35,7 @@ class TaskAnalyzer:
             
             # Obtener análisis del modelo
             analysis_response = ""
-            for chunk in self.model.create_chat_completion(messages=analysis_prompt, max_tokens=800, stream=True):
+            for chunk in llm_stream(self.model, analysis_prompt, 'llm.task_analysis', max_tokens=800):
                 if 'content' in chunk['choices'][0]['delta']:
                     analysis_response += chunk['choices'][0]['delta']['content']
             
@@ -8,6 +8,7 @@ import datetime
 from typing import Dict, Any, Optional, List
 from ..models import TaskPlan, TaskStep, TaskStatus
 from app.utils.logger import logger
+from app.utils.tracing import llm_stream
 
 
 class TaskPlanner:
@@ -26,7 +27,7 @@ class TaskPlanner:
             
             # Obtener plan del modelo
             plan_response = ""
-            for chunk in self.model.create_chat_completion(messages=planning_prompt, max_tokens=1200, stream=True):
+            for chunk in llm_stream(self.model, planning_prompt, 'llm.planning', max_tokens=1200):
                 if 'content' in chunk['choices'][0]['delta']:
                     plan_response += chunk['choices'][0]['delta']['content']
             
@@ -7,6 +7,7 @@ from dataclasses import dataclass
 from enum import Enum
 import inspect
 from app.utils.logger import logger
+from app.utils.tracing import tracer
 
 
 class AgentType(Enum):
@@ -127,8 +128,9 @@ class AgentRegistry:
             raise ValueError(f"Agente '{agent_name}' no está activo")
         
         try:
-            # Crear instancia del agente
-            agent_instance = agent_info.agent_class(*args, **kwargs)
+            # Crear instancia del agente (los agentes procesan la petición al construirse)
+            with tracer.span('agent', agent=agent_name):
+                agent_instance = agent_info.agent_class(*args, **kwargs)
             logger.info(f"Instancia del agente '{agent_name}' creada exitosamente")
             return agent_instance
         except Exception as e:
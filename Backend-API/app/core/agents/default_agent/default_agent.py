@@ -16,6 +16,8 @@ except ImportError:
     pass
 
 from app.utils.logger import logger
+from app.utils import metrics
+from app.utils.tracing import tracer
 from dotenv import load_dotenv
 
 # Importar módulos del agente default
@@ -134,7 +136,9 @@ class DefaultAgent:
             
             # Paso 1: Determinar herramientas necesarias
             safe_emit_status(self.socket, "🧠 Analizando necesidades de herramientas...")
-            herramientas_necesarias = self.need_analyzer.determinar_herramientas_necesarias(self.original_prompt)
+            with metrics.agent_phase_seconds.labels('default', 'analyze').time(), \
+                    tracer.span('agent.analyze', agent='default'):
+                herramientas_necesarias = self.need_analyzer.determinar_herramientas_necesarias(self.original_prompt)
             self.output_console = f' {herramientas_necesarias}'
             
             # Enviar pensamiento al frontend
@@ -142,9 +146,11 @@ class DefaultAgent:
             
             # Paso 2: Procesar herramientas necesarias (detección iterativa y ejecución)
             safe_emit_status(self.socket, "🔧 Procesando herramientas detectadas...")
-            processed_response, resultados_herramientas = self.tool_executor.process_tool_needs(
-                herramientas_necesarias, self.model
-            )
+            with metrics.agent_phase_seconds.labels('default', 'tools').time(), \
+                    tracer.span('agent.tools', agent='default'):
+                processed_response, resultados_herramientas = self.tool_executor.process_tool_needs(
+                    herramientas_necesarias, self.model
+                )
             
             # Paso 3: Generar respuesta final
             safe_emit_status(self.socket, "📝 Generando respuesta final...")
@@ -153,7 +159,9 @@ class DefaultAgent:
             execution_results = self._convert_results_to_execution_format(resultados_herramientas)
             
             # Generar respuesta final usando el ResponseGenerator estándar
-            final_response = self.response_generator.generar_respuesta_final(resultados_herramientas, self._safe_emit_status)
+            with metrics.agent_phase_seconds.labels('default', 'respond').time(), \
+                    tracer.span('agent.respond', agent='default'):
+                final_response = self.response_generator.generar_respuesta_final(resultados_herramientas, self._safe_emit_status)
             
             # Paso 4: Mostrar estadísticas del proceso
             self._display_processing_stats(resultados_herramientas)
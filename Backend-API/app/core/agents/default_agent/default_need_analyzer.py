@@ -3,11 +3,12 @@
 Default Need Analyzer - Analizador de necesidades de herramientas para el agente default
 Migrado desde la lógica de determinación de herramientas de Cortex con formato JSON
 """
-import copy
 from typing import Any, List, Dict
 from colorama import Fore, Style
 
 from app.utils.logger import logger
+from app.utils.tracing import llm_stream
+from app.core.conversation_store import replace_message
 from .config import DefaultAgentConfig
 
 
@@ -76,13 +77,12 @@ Debes contestar solo con el JSON de las funciones que usarias sin texto antes ni
             # Construir el prompt completo
             instrucciones_herramientas = base_instructions + tool_instructions + additional_instructions
             
-            # Crear una copia del prompt original y modificar el mensaje del sistema
+            # Sustituir el mensaje del sistema sin copiar el historial (copy-on-write)
             if isinstance(prompt_original, list):
-                prompt_herramientas = copy.deepcopy(prompt_original)
-                if prompt_herramientas and prompt_herramientas[0]['role'] == 'system':
-                    prompt_herramientas[0]['content'] = instrucciones_herramientas
+                if prompt_original and prompt_original[0]['role'] == 'system':
+                    prompt_herramientas = replace_message(prompt_original, 0, content=instrucciones_herramientas)
                 else:
-                    prompt_herramientas.insert(0, {"role": "system", "content": instrucciones_herramientas})
+                    prompt_herramientas = [{"role": "system", "content": instrucciones_herramientas}] + list(prompt_original)
             else:
                 prompt_herramientas = [
                     {"role": "system", "content": instrucciones_herramientas},
@@ -91,7 +91,7 @@ Debes contestar solo con el JSON de las funciones que usarias sin texto antes ni
             
             # Generar respuesta 
             response_content = ""
-            for chunk in self.model.create_chat_completion(messages=prompt_herramientas, max_tokens=200, stream=True):
+            for chunk in llm_stream(self.model, prompt_herramientas, 'llm.need_analysis', max_tokens=200):
                 if 'choices' in chunk and len(chunk['choices']) > 0:
                     delta = chunk['choices'][0].get('delta', {})
                     if 'content' in delta:
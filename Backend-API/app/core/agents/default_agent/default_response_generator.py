@@ -65,7 +65,6 @@ class DefaultResponseGenerator:
                 model=self.model,
                 messages=final_prompt,
                 socket=self.socket,
-                max_tokens=8192,
                 user_tokens=total_user_tokens,
                 process_line_breaks=True,
                 response_queue=self.response_queue,
@@ -159,7 +158,6 @@ class DefaultResponseGenerator:
                 model=self.model,
                 messages=messages,
                 socket=self.socket,
-                max_tokens=8192,
                 user_tokens=total_user_tokens,
                 process_line_breaks=True,
                 response_queue=self.response_queue,
@@ -9,6 +9,7 @@ from typing import List, Tuple, Any, Set, Dict
 from colorama import Fore, Style
 
 from app.utils.logger import logger
+from app.utils.tracing import llm_stream
 from .config import DefaultAgentConfig
 from ..utils import safe_emit_status
 
@@ -340,8 +341,10 @@ class DefaultToolExecutor:
             decision_prompt = self._crear_prompt_decision(resultados_herramientas)
             
             # Generar respuesta del modelo 
+            from app.core.context_budget import context_budgeter
             response_content = ""
-            for chunk in model.create_chat_completion(messages=decision_prompt, max_tokens=8192, stream=True):
+            max_tokens = context_budgeter.response_budget(model, decision_prompt)
+            for chunk in llm_stream(model, decision_prompt, 'llm.tool_decision', max_tokens=max_tokens):
                 if 'choices' in chunk and len(chunk['choices']) > 0:
                     delta = chunk['choices'][0].get('delta', {})
                     if 'content' in delta:
@@ -4,13 +4,28 @@ Assistant - Core component for LLM interaction and orchestration
 Migración completa desde Assistant.py manteniendo el flujo original
 """
 import copy
+import os
 import platform
 import time
 import gc
 from typing import Optional, Any, List, Dict
 from colorama import Fore, Style
-from llama_cpp import Llama as Model
 from app.utils.logger import logger
+from app.utils import metrics
+from app.utils.tracing import tracer
+from app.utils.profiler import profiler
+from app.core.scheduler import inference_scheduler
+from app.core.kv_cache import prefix_kv_cache
+from app.core.kv_snapshots import kv_snapshot_store
+from app.core.model_pool import model_pool
+from app.core.context_budget import context_budgeter
+from app.core.batch_engine import batch_engine_manager
+from app.core.inference_worker import inference_worker, build_model
+from app.core.memory_planner import check_load, kv_cache_options
+from app.core.stream_emitter import StreamEmitter, stream_settings
+from app.core.session import AssistantSession, session_manager
+from app.core.cancellation import abort_on
+from app.config.settings import Config
 
 
 class Assistant:
@@ -26,8 +41,7 @@ class Assistant:
         self.max_context_tokens = 20000
         self.max_assistant_tokens = 8192
         self.gpu_layers = -1
-        self.is_processing = False
-        self.stop_emit = False
+        # Valores por defecto de las sesiones nuevas; cada sesión tiene los suyos
         self.tools = False
         self.rag = False
         
@@ -50,8 +64,117 @@ Si no sabes la respuesta a una pregunta, no compartas información falsa y no te
         logger.info("Assistant initialized")
     
     def load_model(self, model_path: str, new_temperature: float, n_gpu_layer: int, 
-                   new_system_message: str, context: int, max_response_tokens: int):
+                   new_system_message: str, context: int, max_response_tokens: int,
+                   draft_mode: str = 'none', draft_model_path: Optional[str] = None,
+                   draft_num_pred_tokens: Optional[int] = None, autotune: Optional[str] = None,
+                   kv_type: Optional[str] = None, flash_attn: Optional[bool] = None):
         """Carga un modelo específico con configuración personalizada"""
+        # La temperatura se fija antes de construir el modelo (se usa en su configuración)
+        self.temperature = new_temperature if isinstance(new_temperature, float) else self.temperature
+        model = self.create_model(model_path, n_gpu_layer, context, draft_mode=draft_mode,
+                                  draft_model_path=draft_model_path,
+                                  draft_num_pred_tokens=draft_num_pred_tokens,
+                                  autotune=autotune, kv_type=kv_type, flash_attn=flash_attn,
+                                  temperature=self.temperature)
+        self.activate_model(model, model_path, new_temperature, n_gpu_layer,
+                            new_system_message, context, max_response_tokens)
+
+    def create_model(self, model_path: str, n_gpu_layer: int, context: int,
+                     draft_mode: str = 'none', draft_model_path: Optional[str] = None,
+                     draft_num_pred_tokens: Optional[int] = None, autotune: Optional[str] = None,
+                     kv_type: Optional[str] = None, flash_attn: Optional[bool] = None,
+                     temperature: Optional[float] = None):
+        """
+        Construye (o recupera del pool) una instancia del modelo sin activarla,
+        de modo que el modelo actual puede seguir respondiendo mientras tanto
+        
+        draft_mode activa la decodificación especulativa ('prompt_lookup' o 'draft_model')
+        autotune: 'off', 'auto' (usa el perfil guardado o lo calcula) o 'retune' (por defecto Config.AUTOTUNE_MODE)
+        kv_type/flash_attn: tipo de la caché KV ('f16', 'q8_0', 'q4_0') y flash attention
+        temperature: temperatura del modelo nuevo (por defecto la actual); no cambia la del activo
+        
+        Raises:
+            MemoryError: Si el planificador estima que la carga no cabe en RAM
+        """
+        autotune = autotune or Config.AUTOTUNE_MODE
+        kv_type = kv_type or Config.DEFAULT_KV_CACHE_TYPE
+        flash_attn = Config.DEFAULT_FLASH_ATTN if flash_attn is None else flash_attn
+        kv_options = kv_cache_options(kv_type, flash_attn)
+        gpu_layers = int(n_gpu_layer) if isinstance(n_gpu_layer, int) else self.gpu_layers
+        n_ctx = context if isinstance(context, int) else self.max_context_tokens
+        draft_mode = draft_mode or 'none'
+        temperature = temperature if isinstance(temperature, float) else self.temperature
+        variant = self.pool_variant(draft_mode, draft_num_pred_tokens, draft_model_path, kv_type, flash_attn)
+        extra_bytes = 0
+        if draft_mode == 'draft_model' and draft_model_path and os.path.exists(draft_model_path):
+            extra_bytes = os.path.getsize(draft_model_path)
+        
+        # Planificar la memoria antes de cargar (si ya está residente no hace falta)
+        plan = None
+        if model_pool.get(model_path, n_ctx, gpu_layers, variant) is None:
+            batch_slots, batch_slot_ctx = batch_engine_manager.planned_slots()
+            plan = check_load(model_path, n_ctx, kv_type=kv_type, flash_attn=flash_attn,
+                              gpu_layers=gpu_layers, extra_bytes=extra_bytes,
+                              reclaimable_bytes=model_pool.reclaimable_bytes(),
+                              replicas=inference_worker.size if Config.INFERENCE_WORKER_ENABLED else 1,
+                              batch_slots=batch_slots, batch_slot_ctx=batch_slot_ctx)
+        
+        spec = {
+            'model_path': model_path,
+            'model_kwargs': dict(verbose=True, n_gpu_layers=gpu_layers, n_ctx=n_ctx, **self.device_options,
+                                 temp=temperature, use_mmap=True, **kv_options),
+            'draft': {
+                'mode': draft_mode,
+                'num_pred_tokens': draft_num_pred_tokens,
+                'model_path': draft_model_path,
+                'kwargs': dict(verbose=False, n_gpu_layers=gpu_layers, n_ctx=n_ctx, **self.device_options,
+                               use_mmap=True),
+            },
+            'autotune': autotune,
+        }
+        
+        def loader():
+            started = time.perf_counter()
+            try:
+                # Con el worker de inferencia activo el modelo vive en otro proceso (RemoteModel)
+                if Config.INFERENCE_WORKER_ENABLED:
+                    model = inference_worker.load_model(spec)
+                else:
+                    model = build_model(spec)
+            except Exception:
+                metrics.model_loads.labels('error').inc()
+                raise
+            metrics.model_loads.labels('loaded').inc()
+            metrics.model_load_seconds.observe(time.perf_counter() - started)
+            return model
+        
+        # El pool conserva los modelos ya cargados: solo se construye si no está residente
+        return model_pool.acquire(
+            model_path,
+            n_ctx,
+            gpu_layers,
+            loader=loader,
+            activate=False,
+            variant=variant,
+            extra_bytes=extra_bytes,
+            # El pool cuenta también el contexto del motor de batching de este modelo
+            kv_bytes=plan.kv_bytes + plan.batch_kv_bytes if plan and plan.kv_bytes else None
+        )
+
+    @staticmethod
+    def pool_variant(draft_mode: str, draft_num_pred_tokens: Optional[int], draft_model_path: Optional[str],
+                     kv_type: str, flash_attn: bool) -> str:
+        """Opciones de carga que distinguen instancias del mismo modelo en el pool"""
+        variant = ''
+        if draft_mode and draft_mode != 'none':
+            variant = f"{draft_mode}:{draft_num_pred_tokens or ''}:{draft_model_path or ''}"
+        if kv_type != 'f16' or flash_attn:
+            variant += f"|kv={kv_type}{':fa' if flash_attn else ''}"
+        return variant
+
+    def activate_model(self, model, model_path: str, new_temperature: float, n_gpu_layer: int,
+                       new_system_message: str, context: int, max_response_tokens: int):
+        """Sustituye el modelo activo y su configuración de una sola vez"""
         # Validar y establecer parámetros
         self.model_path = model_path
         self.temperature = new_temperature if isinstance(new_temperature, float) else self.temperature
@@ -59,24 +182,19 @@ Si no sabes la respuesta a una pregunta, no compartas información falsa y no te
         self.max_context_tokens = context if isinstance(context, int) else self.max_context_tokens
         self.max_assistant_tokens = max_response_tokens if isinstance(max_response_tokens, int) else self.max_assistant_tokens
         self.default_system_message = new_system_message if new_system_message else self.default_system_message
-      
-        if self.model is not None:
-            self.unload_model()
-
-        self.model = Model(
-            model_path=self.model_path,
-            verbose=True,
-            n_gpu_layers=self.gpu_layers,
-            n_ctx=self.max_context_tokens,
-            **self.device_options,
-            temp=self.temperature,
-            use_mmap=True,
-        )
-        self.stop_emit = False
+        
+        if self.model is not None and self.model is not model:
+            batch_engine_manager.release(self.model)
+        self.model = model
+        model_pool.activate(model)
         logger.info(f"Modelo {model_path} cargado con éxito")
 
     def unload_model(self):
         """Descargar modelo y liberar memoria"""
+        if self.model is not None:
+            prefix_kv_cache.mark_dirty(self.model)
+            batch_engine_manager.release(self.model)
+            model_pool.release(self.model)
         self.model = None
         # Liberar memoria
         gc.collect()
@@ -101,132 +219,273 @@ Si no sabes la respuesta a una pregunta, no compartas información falsa y no te
         logger.info(f"RAG configured: {rag}")
         print(f"🔧 DEBUG: RAG set to {rag}")
 
-    def add_user_input(self, user_input, socket):
-        """Procesar entrada del usuario - acepta string o lista"""
-        if not self.is_processing:
-            if self.model is None:
-                # Importar aquí para evitar dependencia circular
-                from app.core.socket_handler import SocketResponseHandler
-                SocketResponseHandler.emit_error_response(
-                    socket, 
-                    'Error: No hay un modelo cargado. Por favor, carga un modelo primero.'
-                )
-                return
-            
-            # Convertir user_input a formato lista si es necesario (como en legacy)
-            if isinstance(user_input, str):
-                # Si es string, crear un mensaje de usuario simple
-                processed_input = [{"role": "user", "content": user_input}]
-            elif isinstance(user_input, list):
-                # Si ya es lista, usar directamente
-                processed_input = user_input
-            else:
-                logger.error(f"Tipo de user_input no soportado: {type(user_input)}")
-                return
-                
-            logger.info(f"DEBUG: Procesando user_input de tipo {type(user_input)}")
-            print(f"🔥 DEBUG: Procesando user_input de tipo {type(user_input)}")
+    def add_user_input(self, user_input, socket, session_id: str = 'default', priority: int = 10,
+                       wait: bool = True, session: Optional[AssistantSession] = None,
+                       generation: Optional[Dict[str, Any]] = None):
+        """
+        Procesar entrada del usuario - acepta string o lista
+        
+        La petición se encola en el scheduler de inferencia en lugar de descartarse
+        cuando el modelo está ocupado. Por defecto espera a que termine el stream.
+        Los flags de herramientas/RAG y la parada son los de la sesión indicada.
+        generation: opciones de muestreo del cliente (max_tokens, temperature, top_p, stop)
+        """
+        if self.model is None:
+            # Importar aquí para evitar dependencia circular
+            from app.core.socket_handler import SocketResponseHandler
+            SocketResponseHandler.emit_error_response(
+                socket, 
+                'Error: No hay un modelo cargado. Por favor, carga un modelo primero.'
+            )
+            return None
+        
+        # Convertir user_input a formato lista si es necesario (como en legacy)
+        if isinstance(user_input, str):
+            # Si es string, crear un mensaje de usuario simple
+            processed_input = [{"role": "user", "content": user_input}]
+        elif isinstance(user_input, list):
+            # Si ya es lista, usar directamente
+            processed_input = user_input
+        else:
+            logger.error(f"Tipo de user_input no soportado: {type(user_input)}")
+            return None
             
-            self.emit_assistant_response_stream(processed_input, socket)
+        logger.info(f"DEBUG: Procesando user_input de tipo {type(user_input)}")
+        
+        if session is None:
+            session = session_manager.get_or_create(session_id, self)
+            session.configure(tools=self.tools, rag=self.rag)
+        session_id = session.session_id
+        # Capturar los flags actuales: el job se ejecuta más tarde en el worker
+        tools, rag = session.tools, session.rag
+        cancel_token = session.begin_request(processed_input)
+        
+        # Los chats simples se atienden en paralelo en el motor de batching
+        # Con el modelo en el worker de inferencia no hay motor de batching en este proceso
+        if not tools and not rag and batch_engine_manager.enabled and not getattr(self.model, 'remote', False):
+            return self._submit_batched(processed_input, socket, session, wait, generation or {})
+        
+        def job():
+            from app.core.tools_manager import tools_manager
+            request = inference_scheduler.thread_request
+            with tracer.start_trace('chat', request_id=getattr(socket, 'request_id', None), socket=socket,
+                                    session_id=session_id, tools=tools, rag=rag,
+                                    queue_wait_seconds=round(request.wait_time, 4) if request else None), \
+                    profiler.profile('chat', trace_id=getattr(socket, 'request_id', None)), \
+                    stream_settings.bind(session_id), tools_manager.session_override(tools), \
+                    abort_on(self.model, cancel_token):
+                self.emit_assistant_response_stream(processed_input, socket, session=session, tools=tools, rag=rag,
+                                                    generation=generation)
+        
+        request = inference_scheduler.submit(job, session_id=session_id, priority=priority, socket=socket,
+                                             cancel_token=cancel_token,
+                                             request_id=getattr(socket, 'request_id', None))
+        if wait:
+            request.wait()
+        return request
       
-    def emit_assistant_response_stream(self, user_input: List[Dict], socket):
+    def _submit_batched(self, user_input: List[Dict], socket, session: AssistantSession, wait: bool,
+                        generation: Dict[str, Any]):
+        """Envía un chat simple al motor de batching continuo en lugar de a la cola serie"""
+        from app.core.socket_handler import SocketResponseHandler
+        
+        slot_ctx = Config.BATCH_ENGINE_SLOT_CTX or self.model.n_ctx()
+        budget = context_budgeter.fit(self.model, user_input, self.max_assistant_tokens, n_ctx=slot_ctx)
+        total_user_tokens = context_budgeter.count_text(self.model, str(budget.messages[-1]["content"]))
+        SocketResponseHandler.emit_streaming_response(
+            socket,
+            '',
+            user_tokens=total_user_tokens,
+            finished=False
+        )
+        emitter = StreamEmitter(socket, client_id=session.session_id)
+        
+        def on_token(text):
+            emitter.write(text)
+        
+        def on_done(sequence):
+            emitter.close()
+            stats = sequence.stats
+            outcome = 'error' if sequence.error else 'cancelled' if session.stop_emit else 'completed'
+            metrics.record_generation(stats, outcome, stats.get('queue_seconds'))
+            if sequence.error:
+                SocketResponseHandler.emit_error_response(socket, f"Error: {sequence.error}")
+            SocketResponseHandler.emit_finalization_signal(
+                socket,
+                total_user_tokens,
+                sequence.generated,
+                stats=stats
+            )
+        
+        sequence = batch_engine_manager.submit_chat(
+            self.model,
+            budget.messages,
+            max_tokens=self._max_tokens(budget.max_tokens, generation),
+            on_token=on_token,
+            on_done=on_done,
+            temperature=generation.get('temperature', self.temperature),
+            top_p=generation.get('top_p', 0.95),
+            stop=generation.get('stop'),
+            should_stop=lambda: session.stop_emit,
+            session_id=session.session_id,
+            request_id=getattr(socket, 'request_id', None)
+        )
+        if wait:
+            sequence.wait()
+        return sequence
+    
+    def emit_assistant_response_stream(self, user_input: List[Dict], socket,
+                                       session: Optional[AssistantSession] = None,
+                                       tools: Optional[bool] = None, rag: Optional[bool] = None,
+                                       generation: Optional[Dict[str, Any]] = None):
         """
         Obtiene la respuesta del asistente
 
         Parámetros:
         - user_input: Lista de mensajes del chat
         - socket: Conexión para enviar el stream
+        - session: Sesión que hizo la petición (flags y parada propios)
+        - tools/rag: Flags capturados al encolar (por defecto los de la sesión)
+        - generation: Opciones de muestreo del cliente (max_tokens, temperature, top_p, stop)
         """
         # Importar aquí para evitar dependencia circular
         from app.core.socket_handler import SocketResponseHandler
         from app.core.agents.agent_registry import agent_registry
         from app.core.rag import Retriever
         
-        logger.info(f"DEBUG: emit_assistant_response_stream INICIADO (tools={self.tools}, rag={self.rag})")
+        if session is None:
+            session = session_manager.get_or_create('default', self)
+        tools = session.tools if tools is None else tools
+        rag = session.rag if rag is None else rag
+        logger.info(f"DEBUG: emit_assistant_response_stream INICIADO (sesión={session.session_id}, tools={tools}, rag={rag})")
 
-        if not self.is_processing:
-            self.stop_emit = False
-            self.is_processing = True
-            response = ""
-            tokensInput = str(user_input[-1]["content"]).encode()  # Convertir a bytes
-            logger.debug(f"Tokens input: {tokensInput}")
-            tokens = self.model.tokenize(tokensInput)  
-            total_user_tokens = len(tokens)  # Contar los tokens de la entrada del usuario
-            total_assistant_tokens = 0  # Inicializar el contador de tokens del asistente
-            user_input_o = user_input           
-            max_assistant_tokens = self.max_assistant_tokens
+        # El scheduler garantiza que solo hay una petición en curso
+        session.is_processing = True
+        response = ""
+        total_user_tokens = 0  # Tokens de la entrada del usuario
+        total_assistant_tokens = 0  # Inicializar el contador de tokens del asistente
+        generation = generation or {}
+        
+        try:
+            # Ajustar el historial al contexto: conserva sistema y último turno, recorta los más antiguos
+            # (dentro del try: si falla la tokenización el cliente recibe el error y la sesión se libera)
+            with tracer.span('context_budget') as span:
+                budget = context_budgeter.fit(self.model, user_input, self.max_assistant_tokens)
+                span.set_attributes(**budget.to_dict())
+            user_input = budget.messages
+            total_user_tokens = context_budgeter.count_text(self.model, str(user_input[-1]["content"]))
+            user_input_o = user_input
+            max_assistant_tokens = self._max_tokens(budget.max_tokens, generation)
             
             # Enviar tokens del usuario al inicio del stream
-            if not self.tools and not self.rag:
+            if not tools and not rag:
                 SocketResponseHandler.emit_streaming_response(
                     socket,
                     '',  # Sin contenido aún
                     user_tokens=total_user_tokens,  # Solo tokens del usuario
                     finished=False
                 )
+            
+            # Si hay herramientas, usar el sistema de agentes
+            if tools:
+                logger.info("Using tools with agent system")
+                # Los agentes evalúan sus propios prompts: el estado KV deja de ser reutilizable
+                prefix_kv_cache.mark_dirty(self.model)
                 
-            try:
-                # Si hay herramientas, usar el sistema de agentes
-                if self.tools:
-                    logger.info("Using tools with agent system")
-                    
-                    # Usar el agente actual del registro (seleccionado por el usuario)
-                    selected_agent = agent_registry.get_current_agent()
-                    logger.info(f"Usando agente seleccionado: {selected_agent}")
-                    
-                    # Crear y ejecutar el agente
-                    agent_instance = agent_registry.create_agent(
-                        selected_agent,
-                        user_input_o, 
-                        prompt=user_input, 
-                        response="", 
-                        model=self.model, 
-                        socket=socket, 
-                        assistant=self
-                    )
-                    
-                    return 
+                # Usar el agente actual del registro (seleccionado por el usuario)
+                selected_agent = agent_registry.get_current_agent()
+                logger.info(f"Usando agente seleccionado: {selected_agent}")
                 
-                # Si RAG está habilitado, ir directamente al retriever sin respuesta normal
-                if self.rag: 
-                    logger.info("Using RAG retriever")
-                    print("🔍 Iniciando RAG retriever (RAG exclusivamente - sin respuesta del modelo base)...")
-                    # Nos aseguramos de que este sea el único flujo de respuesta cuando RAG está activo
-                    Retriever(self.model, user_input, socket)
-                    return  # Salir temprano, Retriever se encarga de todo
-                  
-                # Solo procesar normalmente si no hay herramientas ni RAG
-                response, total_assistant_tokens = SocketResponseHandler.stream_chat_completion(
-                    model=self.model,
-                    messages=user_input,
-                    socket=socket,
-                    max_tokens=max_assistant_tokens,
-                    user_tokens=total_user_tokens,
-                    process_line_breaks=False,
-                    response_queue=None,
-                    link_remover_func=None,
-                    stop_condition=lambda: self.stop_emit  # Condición de parada
+                # Crear y ejecutar el agente
+                agent_instance = agent_registry.create_agent(
+                    selected_agent,
+                    user_input_o, 
+                    prompt=user_input, 
+                    response="", 
+                    model=self.model, 
+                    socket=socket, 
+                    assistant=session  # Los agentes consultan stop_emit de la sesión
                 )
                 
-                # Enviar la señal de finalización para respuesta normal
+                return 
+            
+            # Si RAG está habilitado, ir directamente al retriever sin respuesta normal
+            if rag: 
+                logger.info("Using RAG retriever")
+                prefix_kv_cache.mark_dirty(self.model)
+                print("🔍 Iniciando RAG retriever (RAG exclusivamente - sin respuesta del modelo base)...")
+                # Nos aseguramos de que este sea el único flujo de respuesta cuando RAG está activo
+                Retriever(self.model, user_input, socket)
+                return  # Salir temprano, Retriever se encarga de todo
+              
+            # Solo procesar normalmente si no hay herramientas ni RAG
+            # (un RemoteModel gestiona la caché KV dentro del worker de inferencia)
+            local_kv = Config.KV_CACHE_ENABLED and not getattr(self.model, 'remote', False)
+            if local_kv:
+                if Config.KV_SNAPSHOTS_ENABLED:
+                    kv_snapshot_store.prefetch(self.model, user_input)
+                reused = prefix_kv_cache.restore(self.model, user_input)
+                logger.debug(f"KV cache: {reused} mensajes del historial reutilizados")
+            
+            response, total_assistant_tokens = SocketResponseHandler.stream_chat_completion(
+                model=self.model,
+                messages=user_input,
+                socket=socket,
+                max_tokens=max_assistant_tokens,
+                user_tokens=total_user_tokens,
+                process_line_breaks=False,
+                response_queue=None,
+                link_remover_func=None,
+                stop_condition=lambda: session.stop_emit,  # Condición de parada de esta sesión
+                # La temperatura de carga es la de por defecto, como en el camino por lotes
+                sampling={'temperature': self.temperature,
+                          **{key: generation[key] for key in ('temperature', 'top_p', 'stop') if key in generation}},
+                prompt_tokens=budget.prompt_tokens
+            )
+            
+            if local_kv and response and not session.stop_emit:
+                prefix_kv_cache.store(
+                    self.model,
+                    list(user_input) + [{"role": "assistant", "content": response}]
+                )
+            
+            # Enviar la señal de finalización para respuesta normal
+            SocketResponseHandler.emit_finalization_signal(
+                socket,
+                total_user_tokens,
+                total_assistant_tokens
+            )
+                
+        except Exception as e:
+            if session.stop_emit:
+                # Parada del usuario: abort de llama.cpp o herramienta/RAG interrumpidos
+                logger.info(f"Respuesta de la sesión {session.session_id} cancelada: {e}")
+                prefix_kv_cache.mark_dirty(self.model)
                 SocketResponseHandler.emit_finalization_signal(
                     socket,
                     total_user_tokens,
                     total_assistant_tokens
                 )
-                    
-            except Exception as e:
+            else:
                 logger.error(f"Error in assistant response stream: {e}")
                 SocketResponseHandler.emit_error_response(socket, f"Error: {str(e)}")
-            finally:          
-                self.is_processing = False
-                # Liberar memoria
-                gc.collect()
+        finally:          
+            session.is_processing = False
+            # Liberar memoria
+            gc.collect()
+    
+    @staticmethod
+    def _max_tokens(budget_tokens: int, generation: Dict[str, Any]) -> int:
+        """Límite de respuesta: el del cliente sin pasar del hueco que deja el contexto"""
+        requested = generation.get('max_tokens')
+        return min(budget_tokens, requested) if requested else budget_tokens
     
-    def stop_response(self):
-        """Detener la respuesta actual """
-        self.stop_emit = True
-        logger.info("Stop signal activada")
+    def stop_response(self, session_id: str):
+        """Detener la respuesta de una sesión (nunca las de otros usuarios)"""
+        if not session_id:
+            raise ValueError("Se necesita el id de la sesión a detener")
+        session_manager.stop(session_id)
+        logger.info(f"Stop signal activada (sesión={session_id})")
         # Emitir señal de finalización inmediata
         try:
             # Si tenemos un socket activo, emitir señal de parada
@@ -0,0 +1,268 @@
+"""
+@Author: Borja Otero Ferreira
+Autotune - Ajuste automático de hilos y tamaño de batch de CPU por modelo GGUF
+Ejecuta un micro-benchmark de evaluación de prompt y generación en la primera carga
+y guarda el mejor perfil por hash del fichero para las cargas siguientes
+"""
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from app.config.settings import Config
+from app.utils.logger import logger
+
+# Estrategias NUMA de ggml (ggml_numa_strategy)
+NUMA_DISABLED = 0
+NUMA_DISTRIBUTE = 1
+NUMA_ISOLATE = 2
+
+BENCHMARK_TEXT = (
+    "En un lugar de la Mancha, de cuyo nombre no quiero acordarme, no ha mucho tiempo "
+    "que vivía un hidalgo de los de lanza en astillero, adarga antigua, rocín flaco y galgo corredor. "
+)
+
+
+def model_fingerprint(model_path: str, sample_bytes: int = 1024 * 1024) -> str:
+    """
+    Hash del fichero del modelo a partir de su tamaño y del principio y final del fichero
+    (hashear varios GB completos en cada carga costaría más que el propio benchmark)
+    """
+    size = os.path.getsize(model_path)
+    digest = hashlib.sha256(str(size).encode('utf-8'))
+    with open(model_path, 'rb') as f:
+        digest.update(f.read(sample_bytes))
+        if size > sample_bytes * 2:
+            f.seek(-sample_bytes, os.SEEK_END)
+            digest.update(f.read(sample_bytes))
+    return digest.hexdigest()
+
+
+def cpu_topology() -> Dict[str, Any]:
+    """Núcleos físicos, lógicos y nodos NUMA del host"""
+    logical = os.cpu_count() or 1
+    physical = logical
+    try:
+        import psutil
+        physical = psutil.cpu_count(logical=False) or logical
+    except ImportError:
+        pass
+
+    nodes = []
+    for path in sorted(glob.glob('/sys/devices/system/node/node[0-9]*/cpulist')):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                nodes.append(len(_parse_cpulist(f.read().strip())))
+        except OSError:
+            continue
+    return {
+        'physical_cores': physical,
+        'logical_cores': logical,
+        'numa_nodes': len(nodes) or 1,
+        'cores_per_node': nodes or [logical],
+    }
+
+
+def _parse_cpulist(cpulist: str) -> List[int]:
+    """Convierte '0-3,8-11' en la lista de CPUs"""
+    cpus = []
+    for part in cpulist.split(','):
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-')
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+class CPUAutotuner:
+    """
+    Barrido de n_threads (generación), n_threads_batch y n_batch (evaluación del prompt).
+
+    Los hilos se cambian en caliente con llama_set_n_threads y el tamaño de batch se
+    barre troceando la evaluación del prompt, de modo que el modelo solo se carga una vez.
+    """
+
+    def __init__(self, profiles_path: str):
+        self.profiles_path = profiles_path
+        self._lock = threading.Lock()
+        self._profiles: Optional[Dict[str, Any]] = None
+
+    # ------------------------------------------------------------------
+    # Perfiles
+    # ------------------------------------------------------------------
+    def get_profile(self, model_path: str) -> Optional[Dict[str, Any]]:
+        """Perfil guardado para este fichero de modelo"""
+        try:
+            fingerprint = model_fingerprint(model_path)
+        except OSError:
+            return None
+        return self._load().get(fingerprint)
+
+    def load_options(self, profile: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Parámetros para el constructor de Llama: los del perfil si existe o, si no,
+        los necesarios para poder hacer el barrido (n_batch máximo)
+        """
+        topology = cpu_topology()
+        if profile:
+            options = {key: profile[key] for key in ('n_threads', 'n_threads_batch', 'n_batch', 'n_ubatch')}
+        else:
+            options = {
+                'n_threads': topology['physical_cores'],
+                'n_threads_batch': topology['physical_cores'],
+                'n_batch': max(Config.AUTOTUNE_BATCH_SIZES),
+                'n_ubatch': min(max(Config.AUTOTUNE_BATCH_SIZES), 512),
+            }
+        if topology['numa_nodes'] > 1:
+            options['numa'] = (profile or {}).get('numa', NUMA_DISTRIBUTE)
+        return options
+
+    def _load(self) -> Dict[str, Any]:
+        with self._lock:
+            if self._profiles is None:
+                try:
+                    with open(self.profiles_path, 'r', encoding='utf-8') as f:
+                        self._profiles = json.load(f)
+                except (OSError, ValueError):
+                    self._profiles = {}
+            return self._profiles
+
+    def _save(self, fingerprint: str, profile: Dict[str, Any]):
+        profiles = self._load()
+        with self._lock:
+            profiles[fingerprint] = profile
+            os.makedirs(os.path.dirname(self.profiles_path) or '.', exist_ok=True)
+            tmp_path = self.profiles_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(profiles, f, indent=4)
+            os.replace(tmp_path, self.profiles_path)
+
+    # ------------------------------------------------------------------
+    # Benchmark
+    # ------------------------------------------------------------------
+    def tune(self, llama: Any, model_path: str) -> Dict[str, Any]:
+        """
+        Ejecuta el barrido sobre un modelo recién cargado, aplica el mejor perfil y lo guarda
+
+        Returns:
+            dict: Perfil elegido con los resultados del barrido
+        """
+        import llama_cpp
+
+        topology = cpu_topology()
+        loaded_batch = getattr(llama, 'n_batch', max(Config.AUTOTUNE_BATCH_SIZES))
+        prompt = self._benchmark_tokens(llama, Config.AUTOTUNE_PROMPT_TOKENS)
+        start = time.time()
+        logger.info(f"Autotune: barrido para {os.path.basename(model_path)} "
+                    f"(CPU {topology['physical_cores']}/{topology['logical_cores']}, "
+                    f"{topology['numa_nodes']} nodos NUMA)")
+
+        results = {'generation': [], 'prompt': [], 'batch': []}
+        candidates = self._thread_candidates(topology)
+
+        # 1. Hilos de generación (un token por llamada)
+        for threads in candidates:
+            self._set_threads(llama_cpp, llama, threads, threads)
+            tps = self._measure_generation(llama, prompt[:16], Config.AUTOTUNE_GENERATION_TOKENS)
+            results['generation'].append({'n_threads': threads, 'tokens_per_second': round(tps, 2)})
+        best_threads = max(results['generation'], key=lambda r: r['tokens_per_second'])['n_threads']
+
+        # 2. Hilos de evaluación del prompt
+        for threads in candidates:
+            self._set_threads(llama_cpp, llama, best_threads, threads)
+            tps = self._measure_prompt(llama, prompt, loaded_batch)
+            results['prompt'].append({'n_threads_batch': threads, 'tokens_per_second': round(tps, 2)})
+        best_threads_batch = max(results['prompt'], key=lambda r: r['tokens_per_second'])['n_threads_batch']
+
+        # 3. Tamaño de batch con los mejores hilos
+        self._set_threads(llama_cpp, llama, best_threads, best_threads_batch)
+        for n_batch in sorted(b for b in Config.AUTOTUNE_BATCH_SIZES if b <= loaded_batch):
+            tps = self._measure_prompt(llama, prompt, n_batch)
+            results['batch'].append({'n_batch': n_batch, 'tokens_per_second': round(tps, 2)})
+        best_batch = max(results['batch'], key=lambda r: r['tokens_per_second'])['n_batch'] \
+            if results['batch'] else loaded_batch
+        llama.n_batch = best_batch
+        llama.reset()
+
+        numa = NUMA_DISABLED
+        if topology['numa_nodes'] > 1:
+            # Si basta con los núcleos de un nodo, mantener los hilos en su memoria local
+            numa = NUMA_ISOLATE if max(best_threads, best_threads_batch) <= min(topology['cores_per_node']) \
+                else NUMA_DISTRIBUTE
+
+        profile = {
+            'model_path': model_path,
+            'n_threads': best_threads,
+            'n_threads_batch': best_threads_batch,
+            'n_batch': best_batch,
+            'n_ubatch': min(best_batch, 512),
+            'numa': numa,
+            'topology': topology,
+            'results': results,
+            'tuned_seconds': round(time.time() - start, 2),
+            'created': time.time(),
+        }
+        self._save(model_fingerprint(model_path), profile)
+        logger.info(f"Autotune: n_threads={best_threads}, n_threads_batch={best_threads_batch}, "
+                    f"n_batch={best_batch} ({profile['tuned_seconds']}s)")
+        return profile
+
+    @staticmethod
+    def _thread_candidates(topology: Dict[str, Any]) -> List[int]:
+        physical = topology['physical_cores']
+        candidates = {
+            physical,
+            max(physical // 2, 1),
+            max(physical - 1, 1),
+            topology['logical_cores'],
+            min(topology['cores_per_node']),
+        }
+        candidates.update(Config.AUTOTUNE_EXTRA_THREADS)
+        return sorted(c for c in candidates if 0 < c <= topology['logical_cores'])
+
+    @staticmethod
+    def _set_threads(llama_cpp, llama: Any, n_threads: int, n_threads_batch: int):
+        llama_cpp.llama_set_n_threads(llama.ctx, n_threads, n_threads_batch)
+        params = getattr(llama, 'context_params', None)
+        if params is not None:
+            params.n_threads = n_threads
+            if hasattr(params, 'n_threads_batch'):
+                params.n_threads_batch = n_threads_batch
+        llama.n_threads = n_threads
+
+    @staticmethod
+    def _benchmark_tokens(llama: Any, count: int) -> List[int]:
+        tokens: List[int] = []
+        while len(tokens) < count:
+            tokens.extend(llama.tokenize(BENCHMARK_TEXT.encode('utf-8'), add_bos=not tokens))
+        return tokens[:count]
+
+    @staticmethod
+    def _measure_prompt(llama: Any, tokens: List[int], n_batch: int) -> float:
+        llama.reset()
+        llama.n_batch = n_batch
+        start = time.perf_counter()
+        llama.eval(tokens)
+        elapsed = time.perf_counter() - start
+        return len(tokens) / elapsed if elapsed > 0 else 0.0
+
+    @staticmethod
+    def _measure_generation(llama: Any, prefix: List[int], count: int) -> float:
+        llama.reset()
+        llama.eval(prefix)
+        token = prefix[-1]
+        start = time.perf_counter()
+        for _ in range(count):
+            llama.eval([token])
+        elapsed = time.perf_counter() - start
+        return count / elapsed if elapsed > 0 else 0.0
+
+
+# Instancia global del autotuner
+cpu_autotuner = CPUAutotuner(Config.AUTOTUNE_PROFILES_PATH)
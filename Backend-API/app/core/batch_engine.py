@@ -0,0 +1,549 @@
+"""
+@Author: Borja Otero Ferreira
+Batch Engine - Batching continuo de varias sesiones sobre un mismo modelo
+Usa la API multi-secuencia de llama.cpp: cada sesión ocupa un slot (seq_id) del KV
+y en cada paso se decodifica un token de todas las secuencias activas a la vez
+"""
+import codecs
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.config.settings import Config
+from app.utils import blocking
+from app.utils.logger import logger
+
+try:
+    import numpy as np
+    import llama_cpp
+    BATCH_ENGINE_AVAILABLE = hasattr(llama_cpp, 'llama_batch_init')
+except ImportError:
+    np = None
+    llama_cpp = None
+    BATCH_ENGINE_AVAILABLE = False
+
+
+class BatchSequence:
+    """Una conversación en curso dentro del motor"""
+
+    def __init__(self, prompt_tokens: List[int], max_tokens: int, on_token: Callable[[str], None],
+                 on_done: Optional[Callable[['BatchSequence'], None]] = None,
+                 stop: Optional[List[str]] = None, temperature: float = 0.8, top_k: int = 40,
+                 top_p: float = 0.95, should_stop: Optional[Callable[[], bool]] = None,
+                 session_id: str = 'default', request_id: Optional[str] = None):
+        self.request_id = request_id or uuid.uuid4().hex
+        self.session_id = session_id
+        self.prompt_tokens = prompt_tokens
+        self.max_tokens = max_tokens
+        self.on_token = on_token
+        self.on_done = on_done
+        self.stop = [s for s in (stop or []) if s]
+        self.temperature = temperature
+        self.top_k = top_k
+        self.top_p = top_p
+        self.should_stop = should_stop
+
+        self.slot: Optional[int] = None
+        self.tokens: List[int] = list(prompt_tokens)  # Prompt + tokens generados
+        self.pending: List[int] = []                  # Tokens aún no evaluados
+        self.n_past = 0
+        self.generated = 0
+        self.text = ''
+        self.emitted = 0                              # Caracteres de text ya enviados
+        self.finish_reason: Optional[str] = None
+        self.error: Optional[str] = None
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+        self.enqueued_at = time.time()
+        self.started_at: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.done = threading.Event()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return blocking.wait_event(self.done, timeout)
+
+    @property
+    def wait_time(self) -> float:
+        end = self.started_at or time.time()
+        return end - self.enqueued_at
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        end = self.finished_at or time.time()
+        decode_start = self.first_token_at or end
+        decode_seconds = end - decode_start
+        return {
+            'generated_tokens': self.generated,
+            'prompt_tokens': len(self.prompt_tokens),
+            'total_seconds': round(end - (self.started_at or end), 3),
+            'time_to_first_token': round(decode_start - (self.started_at or decode_start), 3),
+            'tokens_per_second': round((self.generated - 1) / decode_seconds, 2)
+            if self.generated > 1 and decode_seconds > 0 else 0.0,
+            'queue_seconds': round(self.wait_time, 3),
+            'finish_reason': self.finish_reason,
+            'batched': True,
+        }
+
+
+class ContinuousBatchEngine:
+    """
+    Motor de batching continuo sobre una instancia Llama.
+
+    Crea un contexto llama.cpp propio (los pesos se comparten con la instancia) con
+    n_slots secuencias. Un único hilo construye en cada paso un batch con el siguiente
+    token de cada secuencia en decodificación más trozos del prompt de las secuencias
+    nuevas, llama a llama_decode una sola vez y muestrea cada secuencia por separado.
+    """
+
+    def __init__(self, llama: Any, n_slots: int = 4, slot_ctx: int = 0, n_batch: int = 512):
+        if not BATCH_ENGINE_AVAILABLE:
+            raise RuntimeError("llama-cpp-python no expone la API de batch de llama.cpp")
+        self.llama = llama
+        self.n_slots = max(1, n_slots)
+        self.slot_ctx = slot_ctx or llama.n_ctx()
+        self.n_batch = max(n_batch, self.n_slots)
+        self.n_vocab = llama.n_vocab()
+
+        self._ctx = self._create_context()
+        self._batch = llama_cpp.llama_batch_init(self.n_batch, 0, 1)
+        self._slot_tokens: List[List[int]] = [[] for _ in range(self.n_slots)]
+        self._active: Dict[int, BatchSequence] = {}
+        self._waiting: "deque[BatchSequence]" = deque()
+        self._cond = threading.Condition()
+        self._closing = False
+        self._rng = np.random.default_rng()
+        self._eos = {llama.token_eos()}
+
+        self.steps = 0
+        self.tokens_decoded = 0
+        self.completed = 0
+        self.started_at = time.time()
+
+        self._thread = threading.Thread(target=self._run, name='batch-engine', daemon=True)
+        self._thread.start()
+        logger.info(f"Batch engine: {self.n_slots} slots de {self.slot_ctx} tokens, n_batch={self.n_batch}")
+
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+    def submit(self, sequence: BatchSequence) -> BatchSequence:
+        """
+        Añade una secuencia; entra en el siguiente paso en que haya un slot libre.
+
+        El prompt ya viene ajustado al slot por el ContextBudgeter: si aun así no cabe no
+        se recorta (se perderían BOS, la cabecera de la plantilla y el system prompt), la
+        secuencia termina con error.
+        """
+        if len(sequence.prompt_tokens) >= self.slot_ctx - 1:
+            message = (f"El prompt ({len(sequence.prompt_tokens)} tokens) no cabe en un slot "
+                       f"de {self.slot_ctx} tokens")
+            logger.error(f"Batch engine: {message}")
+            self._finish(sequence, 'error', error=message)
+            return sequence
+        with self._cond:
+            if self._closing:
+                raise RuntimeError("El motor de batching se está cerrando")
+            self._waiting.append(sequence)
+            self._cond.notify()
+        return sequence
+
+    def shutdown(self):
+        """Deja de admitir secuencias; el contexto se libera al terminar las activas"""
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+
+    @property
+    def closing(self) -> bool:
+        return self._closing
+
+    @property
+    def alive(self) -> bool:
+        """El hilo del motor sigue en marcha y admite secuencias"""
+        return not self._closing and self._thread.is_alive()
+
+    def get_stats(self) -> Dict[str, Any]:
+        elapsed = time.time() - self.started_at
+        return {
+            'slots': self.n_slots,
+            'slot_ctx': self.slot_ctx,
+            'active': len(self._active),
+            'waiting': len(self._waiting),
+            'steps': self.steps,
+            'tokens_decoded': self.tokens_decoded,
+            'completed': self.completed,
+            'avg_batch_tokens': round(self.tokens_decoded / self.steps, 2) if self.steps else 0.0,
+            'tokens_per_second': round(self.tokens_decoded / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+
+    # ------------------------------------------------------------------
+    # Bucle del motor
+    # ------------------------------------------------------------------
+    def _run(self):
+        try:
+            while True:
+                with self._cond:
+                    while not self._waiting and not self._active and not self._closing:
+                        self._cond.wait()
+                    if self._closing and not self._waiting and not self._active:
+                        break
+                    self._admit()
+                self._step()
+        except Exception as e:
+            logger.error(f"Batch engine: error en el bucle principal: {e}")
+            # El motor queda inservible: no admite más secuencias y nadie espera para siempre
+            with self._cond:
+                self._closing = True
+                waiting = list(self._waiting)
+                self._waiting.clear()
+            for sequence in list(self._active.values()) + waiting:
+                self._finish(sequence, 'error', error=str(e))
+        finally:
+            self._free()
+
+    def _admit(self):
+        """Asigna slots libres a las secuencias en espera (llamar con el lock)"""
+        free = [slot for slot in range(self.n_slots) if slot not in self._active]
+        while self._waiting and free:
+            sequence = self._waiting.popleft()
+            # Elegir el slot cuyo KV comparte el prefijo más largo con el prompt
+            slot, common = max(
+                ((s, self._common_prefix(self._slot_tokens[s], sequence.prompt_tokens)) for s in free),
+                key=lambda item: item[1]
+            )
+            free.remove(slot)
+            common = min(common, len(sequence.prompt_tokens) - 1)
+            self._kv_seq_rm(slot, common, -1)
+            sequence.slot = slot
+            sequence.n_past = common
+            sequence.pending = sequence.prompt_tokens[common:]
+            sequence.started_at = time.time()
+            self._active[slot] = sequence
+            logger.debug(f"Batch engine: secuencia {sequence.request_id} en slot {slot} "
+                         f"({common} tokens de prefijo reutilizados)")
+
+    def _step(self):
+        """Un llama_decode con tokens de todas las secuencias activas"""
+        for sequence in list(self._active.values()):
+            if sequence.should_stop and sequence.should_stop():
+                self._finish(sequence, 'cancelled')
+
+        batch = self._batch
+        batch.n_tokens = 0
+        logits_index: Dict[int, int] = {}
+        evaluated: Dict[int, int] = {}
+
+        # Primero las secuencias en decodificación (un token cada una), después los prompts
+        ordered = sorted(self._active.values(), key=lambda s: len(s.pending))
+        for sequence in ordered:
+            room = self.n_batch - batch.n_tokens
+            if room <= 0:
+                break
+            chunk = sequence.pending[:room]
+            for offset, token in enumerate(chunk):
+                index = batch.n_tokens
+                is_last = offset == len(sequence.pending) - 1
+                batch.token[index] = token
+                batch.pos[index] = sequence.n_past + offset
+                batch.n_seq_id[index] = 1
+                batch.seq_id[index][0] = sequence.slot
+                batch.logits[index] = is_last
+                if is_last:
+                    logits_index[sequence.slot] = index
+                batch.n_tokens += 1
+            evaluated[sequence.slot] = len(chunk)
+
+        if batch.n_tokens == 0:
+            return
+
+        result = llama_cpp.llama_decode(self._ctx, batch)
+        self.steps += 1
+        self.tokens_decoded += batch.n_tokens
+        if result != 0:
+            logger.error(f"Batch engine: llama_decode devolvió {result}")
+            for slot in evaluated:
+                self._finish(self._active[slot], 'error', error=f'llama_decode={result}')
+            return
+
+        for slot, count in evaluated.items():
+            sequence = self._active[slot]
+            sequence.n_past += count
+            sequence.pending = sequence.pending[count:]
+            if slot in logits_index:
+                self._sample_and_emit(sequence, logits_index[slot])
+
+    def _sample_and_emit(self, sequence: BatchSequence, index: int):
+        pointer = llama_cpp.llama_get_logits_ith(self._ctx, index)
+        logits = np.ctypeslib.as_array(pointer, shape=(self.n_vocab,)).copy()
+        token = self._sample(logits, sequence)
+
+        if token in self._eos or self._is_eog(token):
+            self._flush(sequence, final=True)
+            self._finish(sequence, 'stop')
+            return
+
+        sequence.generated += 1
+        if sequence.first_token_at is None:
+            sequence.first_token_at = time.time()
+        sequence.tokens.append(token)
+        sequence.pending = [token]
+        sequence.text += sequence._decoder.decode(self.llama.detokenize([token]))
+
+        stop_at = self._find_stop(sequence)
+        if stop_at is not None:
+            sequence.text = sequence.text[:stop_at]
+            self._flush(sequence, final=True)
+            self._finish(sequence, 'stop')
+            return
+        self._flush(sequence)
+
+        if sequence.generated >= sequence.max_tokens or sequence.n_past + 1 >= self.slot_ctx:
+            self._flush(sequence, final=True)
+            self._finish(sequence, 'length')
+
+    def _sample(self, logits, sequence: BatchSequence) -> int:
+        """Muestreo temperatura + top-k + top-p"""
+        if sequence.temperature <= 0:
+            return int(np.argmax(logits))
+        top_k = min(sequence.top_k or self.n_vocab, self.n_vocab)
+        candidates = np.argpartition(logits, -top_k)[-top_k:]
+        values = logits[candidates] / sequence.temperature
+        values -= values.max()
+        probs = np.exp(values)
+        probs /= probs.sum()
+        order = np.argsort(-probs)
+        candidates, probs = candidates[order], probs[order]
+        if sequence.top_p < 1.0:
+            cutoff = int(np.searchsorted(np.cumsum(probs), sequence.top_p)) + 1
+            candidates, probs = candidates[:cutoff], probs[:cutoff] / probs[:cutoff].sum()
+        return int(self._rng.choice(candidates, p=probs))
+
+    def _find_stop(self, sequence: BatchSequence) -> Optional[int]:
+        for stop in sequence.stop:
+            position = sequence.text.find(stop, max(sequence.emitted - len(stop), 0))
+            if position != -1:
+                return position
+        return None
+
+    def _flush(self, sequence: BatchSequence, final: bool = False):
+        """Envía el texto nuevo, reteniendo lo que podría ser el inicio de un stop"""
+        holdback = 0 if final else max((len(s) - 1 for s in sequence.stop), default=0)
+        end = max(len(sequence.text) - holdback, sequence.emitted)
+        if end > sequence.emitted:
+            chunk = sequence.text[sequence.emitted:end]
+            sequence.emitted = end
+            try:
+                sequence.on_token(chunk)
+            except Exception as e:
+                logger.debug(f"Batch engine: error enviando token: {e}")
+
+    def _finish(self, sequence: BatchSequence, reason: str, error: Optional[str] = None):
+        if sequence.slot in self._active:
+            del self._active[sequence.slot]
+            # Lo que queda en el KV del slot sirve como prefijo para el siguiente turno
+            self._slot_tokens[sequence.slot] = sequence.tokens[:sequence.n_past]
+        sequence.finish_reason = reason
+        sequence.error = error
+        sequence.finished_at = time.time()
+        self.completed += 1
+        if sequence.on_done:
+            try:
+                sequence.on_done(sequence)
+            except Exception as e:
+                logger.debug(f"Batch engine: error en on_done: {e}")
+        sequence.done.set()
+
+    # ------------------------------------------------------------------
+    # Contexto llama.cpp
+    # ------------------------------------------------------------------
+    def _create_context(self):
+        params = llama_cpp.llama_context_default_params()
+        params.n_ctx = self.slot_ctx * self.n_slots
+        params.n_batch = self.n_batch
+        if hasattr(params, 'n_ubatch'):
+            params.n_ubatch = min(self.n_batch, 512)
+        if hasattr(params, 'n_seq_max'):
+            params.n_seq_max = self.n_slots
+        source = getattr(self.llama, 'context_params', None)
+        for name in ('n_threads', 'n_threads_batch', 'type_k', 'type_v', 'flash_attn'):
+            if source is not None and hasattr(params, name) and hasattr(source, name):
+                setattr(params, name, getattr(source, name))
+        create = getattr(llama_cpp, 'llama_init_from_model', None) or llama_cpp.llama_new_context_with_model
+        ctx = create(self.llama.model, params)
+        if not ctx:
+            raise RuntimeError("No se pudo crear el contexto del motor de batching")
+        return ctx
+
+    def _kv_seq_rm(self, slot: int, p0: int, p1: int):
+        if hasattr(llama_cpp, 'llama_memory_seq_rm'):
+            llama_cpp.llama_memory_seq_rm(llama_cpp.llama_get_memory(self._ctx), slot, p0, p1)
+        elif hasattr(llama_cpp, 'llama_kv_self_seq_rm'):
+            llama_cpp.llama_kv_self_seq_rm(self._ctx, slot, p0, p1)
+        else:
+            llama_cpp.llama_kv_cache_seq_rm(self._ctx, slot, p0, p1)
+
+    def _is_eog(self, token: int) -> bool:
+        is_eog = getattr(llama_cpp, 'llama_token_is_eog', None)
+        if is_eog is None:
+            return False
+        try:
+            vocab = llama_cpp.llama_model_get_vocab(self.llama.model) \
+                if hasattr(llama_cpp, 'llama_model_get_vocab') else self.llama.model
+            return bool(is_eog(vocab, token))
+        except Exception:
+            return False
+
+    def _free(self):
+        if self._batch is not None:
+            llama_cpp.llama_batch_free(self._batch)
+            self._batch = None
+        if self._ctx is not None:
+            llama_cpp.llama_free(self._ctx)
+            self._ctx = None
+        logger.info("Batch engine: contexto liberado")
+
+    @staticmethod
+    def _common_prefix(a: List[int], b: List[int]) -> int:
+        count = 0
+        for x, y in zip(a, b):
+            if x != y:
+                break
+            count += 1
+        return count
+
+
+class ChatPromptFormatter:
+    """Renderiza mensajes con la plantilla de chat del GGUF (o ChatML si no la tiene)"""
+
+    def __init__(self, llama: Any):
+        self.llama = llama
+        self._formatter = None
+        template = (getattr(llama, 'metadata', None) or {}).get('tokenizer.chat_template')
+        if template:
+            try:
+                from llama_cpp.llama_chat_format import Jinja2ChatFormatter
+                self._formatter = Jinja2ChatFormatter(
+                    template=template,
+                    eos_token=self._token_text(llama.token_eos()),
+                    bos_token=self._token_text(llama.token_bos()),
+                )
+            except Exception as e:
+                logger.warning(f"Batch engine: plantilla de chat no utilizable, se usa ChatML: {e}")
+
+    def format(self, messages: List[Dict]) -> Dict[str, Any]:
+        """Devuelve {'tokens', 'stop'} para una lista de mensajes"""
+        if self._formatter is not None:
+            result = self._formatter(messages=messages)
+            add_bos = not getattr(result, 'added_special', False)
+            stop = result.stop if isinstance(result.stop, list) else [result.stop] if result.stop else []
+            prompt = result.prompt
+        else:
+            prompt = ''.join(
+                f"<|im_start|>{m.get('role', 'user')}\n{self._text(m.get('content'))}<|im_end|>\n"
+                for m in messages
+            ) + "<|im_start|>assistant\n"
+            add_bos, stop = True, ['<|im_end|>']
+        tokens = self.llama.tokenize(prompt.encode('utf-8'), add_bos=add_bos, special=True)
+        return {'tokens': tokens, 'stop': stop}
+
+    def _token_text(self, token: int) -> str:
+        if token is None or token < 0:
+            return ''
+        internal = getattr(self.llama, '_model', None)
+        if internal is not None and hasattr(internal, 'token_get_text'):
+            return internal.token_get_text(token)
+        return self.llama.detokenize([token]).decode('utf-8', errors='ignore')
+
+    @staticmethod
+    def _text(content: Any) -> str:
+        if isinstance(content, dict):
+            return str(content.get('text', ''))
+        return '' if content is None else str(content)
+
+
+class BatchEngineManager:
+    """Mantiene un motor por modelo activo y lo recrea cuando cambia el modelo"""
+
+    def __init__(self):
+        self._engine: Optional[ContinuousBatchEngine] = None
+        self._formatter: Optional[ChatPromptFormatter] = None
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return Config.BATCH_ENGINE_ENABLED and BATCH_ENGINE_AVAILABLE
+
+    @staticmethod
+    def planned_slots() -> Tuple[int, int]:
+        """
+        (slots, tokens por slot; 0 = n_ctx del modelo) del contexto extra que reservará el
+        motor, para el planificador de memoria. (0, 0) si no se va a crear: desactivado o con
+        los modelos en el worker de inferencia.
+        """
+        if not (Config.BATCH_ENGINE_ENABLED and BATCH_ENGINE_AVAILABLE) or Config.INFERENCE_WORKER_ENABLED:
+            return 0, 0
+        return max(1, Config.BATCH_ENGINE_SLOTS), Config.BATCH_ENGINE_SLOT_CTX
+
+    def get(self, model: Any) -> Optional[ContinuousBatchEngine]:
+        """Motor para el modelo dado (lo crea bajo demanda)"""
+        if not self.enabled or model is None:
+            return None
+        with self._lock:
+            # Se recrea si cambia el modelo o si el motor anterior murió por un error
+            if self._model is not model or self._engine is None or not self._engine.alive:
+                if self._engine is not None:
+                    self._engine.shutdown()
+                slot_ctx = Config.BATCH_ENGINE_SLOT_CTX or model.n_ctx()
+                self._engine = ContinuousBatchEngine(
+                    model,
+                    n_slots=Config.BATCH_ENGINE_SLOTS,
+                    slot_ctx=slot_ctx,
+                    n_batch=Config.BATCH_ENGINE_N_BATCH
+                )
+                self._formatter = ChatPromptFormatter(model)
+                self._model = model
+            return self._engine
+
+    def submit_chat(self, model: Any, messages: List[Dict], max_tokens: int,
+                    on_token: Callable[[str], None], on_done: Callable[[BatchSequence], None],
+                    temperature: float = 0.8, should_stop: Optional[Callable[[], bool]] = None,
+                    session_id: str = 'default', request_id: Optional[str] = None,
+                    top_p: float = 0.95, stop: Optional[List[str]] = None) -> BatchSequence:
+        engine = self.get(model)
+        if engine is None:
+            raise RuntimeError("El motor de batching no está disponible")
+        prompt = self._formatter.format(messages)
+        sequence = BatchSequence(
+            prompt['tokens'],
+            max_tokens=max_tokens,
+            on_token=on_token,
+            on_done=on_done,
+            stop=prompt['stop'] + list(stop or []),
+            temperature=temperature,
+            top_p=top_p,
+            should_stop=should_stop,
+            session_id=session_id,
+            request_id=request_id
+        )
+        return engine.submit(sequence)
+
+    def release(self, model: Any):
+        """Cierra el motor si pertenece al modelo indicado"""
+        with self._lock:
+            if self._model is model and self._engine is not None:
+                self._engine.shutdown()
+                self._engine = None
+                self._formatter = None
+                self._model = None
+
+    def get_stats(self) -> Optional[Dict[str, Any]]:
+        engine = self._engine
+        return engine.get_stats() if engine is not None else None
+
+
+# Instancia global del gestor del motor de batching
+batch_engine_manager = BatchEngineManager()
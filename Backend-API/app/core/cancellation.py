@@ -0,0 +1,195 @@
+"""
+@Author: Borja Otero Ferreira
+Cancellation - Token de cancelación de una petición de inferencia
+El worker del scheduler asocia el token de la petición a su hilo; la generación de
+llama.cpp (abort callback entre batches de evaluación), las herramientas y el RAG lo
+consultan para liberar el motor en cuanto el usuario pulsa parar
+"""
+import threading
+import weakref
+from contextlib import contextmanager
+from typing import Any, Callable, Optional
+
+from app.utils.logger import logger
+from app.utils.profiler import profiler
+
+# Cada cuánto se comprueba el token mientras se espera a una tarea bloqueante
+POLL_INTERVAL = 0.05
+
+
+class RequestCancelled(Exception):
+    """La petición en curso se canceló"""
+
+
+class CancellationToken:
+    """Señal de parada de una petición; la consulta quien genera la respuesta"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason: Optional[str] = None
+
+    def cancel(self, reason: str = 'stopped'):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Espera a que se cancele (útil para esperas interrumpibles)"""
+        return self._event.wait(timeout)
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise RequestCancelled(self.reason or 'stopped')
+
+    def __bool__(self) -> bool:
+        return self.cancelled
+
+
+# ----------------------------------------------------------------------
+# Token del hilo actual
+# ----------------------------------------------------------------------
+_local = threading.local()
+
+
+@contextmanager
+def bind(token: Optional[CancellationToken]):
+    """Asocia el token de la petición al hilo que la atiende"""
+    previous = getattr(_local, 'token', None)
+    _local.token = token
+    try:
+        yield token
+    finally:
+        _local.token = previous
+
+
+def current_token() -> Optional[CancellationToken]:
+    return getattr(_local, 'token', None)
+
+
+def is_cancelled(token: Optional[CancellationToken] = None) -> bool:
+    token = token if token is not None else current_token()
+    return bool(token is not None and token.cancelled)
+
+
+def check_cancelled(token: Optional[CancellationToken] = None):
+    """Lanza RequestCancelled si la petición (la del hilo por defecto) se canceló"""
+    token = token if token is not None else current_token()
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+def run_cancellable(func: Callable[..., Any], args: tuple = (), kwargs: Optional[dict] = None,
+                    token: Optional[CancellationToken] = None, name: str = 'cancellable-task') -> Any:
+    """
+    Ejecuta una llamada bloqueante (p. ej. una petición HTTP de una herramienta) en un
+    hilo aparte y deja de esperarla en cuanto se cancela el token.
+
+    El hilo no se puede matar: termina por su cuenta y su resultado se descarta,
+    pero el worker de inferencia queda libre de inmediato.
+
+    Raises:
+        RequestCancelled: Si el token se cancela antes de que termine la llamada
+    """
+    kwargs = kwargs or {}
+    token = token if token is not None else current_token()
+    if token is None:
+        return func(*args, **kwargs)
+    token.raise_if_cancelled()
+
+    outcome = {}
+    finished = threading.Event()
+    # El hilo auxiliar cuenta en el perfil de la petición (si se está perfilando)
+    capture = profiler.current()
+
+    def target():
+        with bind(token), profiler.attach(capture):
+            try:
+                outcome['result'] = func(*args, **kwargs)
+            except BaseException as e:
+                outcome['error'] = e
+            finally:
+                finished.set()
+
+    threading.Thread(target=target, name=name, daemon=True).start()
+    while not finished.wait(POLL_INTERVAL):
+        if token.cancelled:
+            logger.info(f"Cancelación: se abandona '{name}' ({token.reason})")
+            raise RequestCancelled(token.reason or 'stopped')
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome.get('result')
+
+
+# ----------------------------------------------------------------------
+# Abort callback de llama.cpp
+# ----------------------------------------------------------------------
+class _AbortSlot:
+    """Token activo de un modelo; lo lee el abort callback desde los hilos de ggml"""
+
+    def __init__(self):
+        self.token: Optional[CancellationToken] = None
+        self.callback = None  # Referencia al callback ctypes para que no se libere
+
+
+_abort_slots: "weakref.WeakKeyDictionary[Any, _AbortSlot]" = weakref.WeakKeyDictionary()
+_abort_lock = threading.Lock()
+
+
+def _abort_slot(model: Any) -> Optional[_AbortSlot]:
+    """Instala (una vez por modelo) el abort callback de llama.cpp"""
+    with _abort_lock:
+        try:
+            if model in _abort_slots:
+                return _abort_slots[model]
+        except TypeError:
+            return None  # Objeto sin weakref (p. ej. un proxy): no se puede registrar
+        ctx = getattr(model, 'ctx', None) or getattr(getattr(model, '_ctx', None), 'ctx', None)
+        if getattr(model, 'remote', False) or ctx is None:
+            # RemoteModel: el worker de inferencia instala el callback sobre su propio contexto
+            # (la cancelación le llega por el Pipe); sin contexto llama.cpp no hay nada que instalar
+            _abort_slots[model] = None
+            return None
+        try:
+            import llama_cpp
+            slot = _AbortSlot()
+
+            def should_abort(_data) -> bool:
+                token = slot.token
+                return token is not None and token._event.is_set()
+
+            slot.callback = llama_cpp.ggml_abort_callback(should_abort)
+            llama_cpp.llama_set_abort_callback(ctx, slot.callback, None)
+        except (ImportError, AttributeError, TypeError) as e:
+            # llama-cpp-python < 0.3 sin abort callback: solo se corta entre tokens
+            logger.warning(f"Cancelación: abort callback no disponible ({e}); la parada no interrumpe "
+                           f"la evaluación del prompt (se necesita llama-cpp-python >= 0.3)")
+            slot = None
+        try:
+            _abort_slots[model] = slot
+        except TypeError:
+            pass
+        return slot
+
+
+@contextmanager
+def abort_on(model: Any, token: Optional[CancellationToken] = None):
+    """
+    Mientras dure el bloque, llama_decode sobre este modelo aborta entre batches de
+    evaluación si el token se cancela (también en mitad de un prompt largo).
+    llama-cpp-python lo recibe como RuntimeError desde eval().
+    """
+    token = token if token is not None else current_token()
+    slot = _abort_slot(model) if token is not None and model is not None else None
+    if slot is None:
+        yield
+        return
+    previous = slot.token
+    slot.token = token
+    try:
+        yield
+    finally:
+        slot.token = previous
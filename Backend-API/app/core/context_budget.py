@@ -0,0 +1,289 @@
+"""
+@Author: Borja Otero Ferreira
+Context Budget - Presupuesto de tokens de la conversación completa
+Tokeniza cada mensaje (con memo por hash de contenido), recorta el historial para
+respetar n_ctx menos la reserva de respuesta y calcula el max_tokens disponible
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from app.config.settings import Config
+from app.utils.logger import logger
+
+TRUNCATION_MARKER = '\n[…]\n'
+
+
+@dataclass
+class BudgetResult:
+    """Resultado de ajustar una conversación al contexto"""
+    messages: List[Dict]
+    prompt_tokens: int
+    max_tokens: int
+    n_ctx: int
+    dropped: int = 0
+    truncated: int = 0
+    message_tokens: List[int] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'prompt_tokens': self.prompt_tokens,
+            'max_tokens': self.max_tokens,
+            'n_ctx': self.n_ctx,
+            'dropped': self.dropped,
+            'truncated': self.truncated,
+        }
+
+
+class ContextBudgeter:
+    """
+    Ajusta la conversación al contexto del modelo.
+
+    Políticas:
+    - drop: elimina los turnos más antiguos completos (usuario + respuestas)
+    - truncate: primero recorta el contenido de los turnos antiguos y, si no basta, los elimina
+
+    El mensaje de sistema inicial y el último turno del usuario se conservan siempre.
+    """
+
+    def __init__(self, memo_size: int = 8192):
+        self._memo: "OrderedDict[str, int]" = OrderedDict()
+        self._memo_size = memo_size
+        self._lock = threading.Lock()
+        self.memo_hits = 0
+        self.memo_misses = 0
+
+    # ------------------------------------------------------------------
+    # Conteo de tokens
+    # ------------------------------------------------------------------
+    def count_text(self, model: Any, text: str) -> int:
+        """Tokens de un texto, memorizados por hash del contenido"""
+        if not text:
+            return 0
+        key = hashlib.sha1(f"{getattr(model, 'model_path', '')}\x00{text}".encode('utf-8')).hexdigest()
+        with self._lock:
+            count = self._memo.get(key)
+            if count is not None:
+                self._memo.move_to_end(key)
+                self.memo_hits += 1
+                return count
+        try:
+            count = len(model.tokenize(text.encode('utf-8'), add_bos=False))
+        except Exception:
+            count = len(text) // 4 + 1  # Aproximación si el tokenizador falla
+        with self._lock:
+            self.memo_misses += 1
+            self._memo[key] = count
+            while len(self._memo) > self._memo_size:
+                self._memo.popitem(last=False)
+        return count
+
+    def count_message(self, model: Any, message: Dict) -> int:
+        """Tokens de un mensaje, incluido el sobrecoste de la plantilla de chat"""
+        content = message.get('content', '') if isinstance(message, dict) else message
+        return self.count_text(model, self._content_text(content)) + \
+            self._image_tokens(content) + Config.CONTEXT_MESSAGE_OVERHEAD_TOKENS
+
+    def count_messages(self, model: Any, messages: List[Dict]) -> int:
+        return sum(self.count_message(model, message) for message in messages or [])
+
+    # ------------------------------------------------------------------
+    # Ajuste al contexto
+    # ------------------------------------------------------------------
+    def fit(self, model: Any, messages: List[Dict], max_response_tokens: Optional[int] = None,
+            policy: Optional[str] = None, n_ctx: Optional[int] = None) -> BudgetResult:
+        """
+        Ajusta los mensajes al contexto del modelo
+
+        Args:
+            model: Instancia Llama
+            messages: Conversación completa
+            max_response_tokens: Máximo de tokens de respuesta deseado (None = todo lo disponible)
+            policy: 'drop' o 'truncate' (por defecto Config.CONTEXT_TRIM_POLICY)
+            n_ctx: Contexto disponible si no es el del modelo (p. ej. un slot del motor por lotes)
+
+        Returns:
+            BudgetResult: Mensajes ajustados y max_tokens a usar
+        """
+        policy = policy or Config.CONTEXT_TRIM_POLICY
+        n_ctx = n_ctx or self._n_ctx(model)
+        messages = list(messages or [])
+        reserve = min(Config.CONTEXT_RESPONSE_RESERVE_TOKENS, n_ctx // 2)
+        if max_response_tokens:
+            reserve = min(reserve, max_response_tokens)
+        prompt_budget = n_ctx - reserve
+
+        tokens = [self.count_message(model, m) for m in messages]
+        total = sum(tokens)
+        dropped = truncated = 0
+
+        if total > prompt_budget and len(messages) > 1:
+            head = self._system_prefix_length(messages)
+            last = len(messages) - 1
+            turns = self._turns(messages, head, last)
+
+            if policy == 'truncate':
+                for start, end in turns:
+                    for index in range(start, end):
+                        if total <= prompt_budget:
+                            break
+                        saved = self._truncate_message(model, messages, tokens, index)
+                        if saved:
+                            total -= saved
+                            truncated += 1
+
+            remove = set()
+            for start, end in turns:
+                if total <= prompt_budget:
+                    break
+                for index in range(start, end):
+                    remove.add(index)
+                    total -= tokens[index]
+                dropped += end - start
+
+            if remove:
+                messages = [m for i, m in enumerate(messages) if i not in remove]
+                tokens = [t for i, t in enumerate(tokens) if i not in remove]
+
+            if total > prompt_budget:
+                # Solo quedan sistema y último turno: recortar el último mensaje por el principio
+                saved = self._truncate_message(model, messages, tokens, len(messages) - 1,
+                                               keep_tokens=max(prompt_budget - (total - tokens[-1])
+                                                               - Config.CONTEXT_MESSAGE_OVERHEAD_TOKENS * 2, 64),
+                                               keep_tail=True)
+                if saved:
+                    total -= saved
+                    truncated += 1
+
+            logger.info(f"Contexto ajustado: {dropped} mensajes eliminados, {truncated} recortados "
+                        f"({total}/{prompt_budget} tokens de prompt)")
+
+        available = max(n_ctx - total, Config.CONTEXT_MIN_RESPONSE_TOKENS)
+        max_tokens = min(available, max_response_tokens) if max_response_tokens else available
+        return BudgetResult(
+            messages=messages,
+            prompt_tokens=total,
+            max_tokens=max_tokens,
+            n_ctx=n_ctx,
+            dropped=dropped,
+            truncated=truncated,
+            message_tokens=tokens
+        )
+
+    def response_budget(self, model: Any, messages: List[Dict],
+                        max_response_tokens: Optional[int] = None) -> int:
+        """max_tokens disponible para responder a estos mensajes"""
+        n_ctx = self._n_ctx(model)
+        available = max(n_ctx - self.count_messages(model, messages), Config.CONTEXT_MIN_RESPONSE_TOKENS)
+        return min(available, max_response_tokens) if max_response_tokens else available
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'memo_entries': len(self._memo),
+            'memo_hits': self.memo_hits,
+            'memo_misses': self.memo_misses,
+        }
+
+    # ------------------------------------------------------------------
+    # Auxiliares
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _n_ctx(model: Any) -> int:
+        try:
+            return int(model.n_ctx())
+        except Exception:
+            return Config.DEFAULT_CONTEXT_SIZE
+
+    @staticmethod
+    def _system_prefix_length(messages: List[Dict]) -> int:
+        """Número de mensajes de sistema al principio de la conversación"""
+        count = 0
+        for message in messages[:-1]:
+            if isinstance(message, dict) and message.get('role') == 'system':
+                count += 1
+            else:
+                break
+        return count
+
+    @staticmethod
+    def _turns(messages: List[Dict], start: int, end: int) -> List[tuple]:
+        """
+        Agrupa los mensajes intermedios en turnos que empiezan en un mensaje de usuario,
+        para no romper la alternancia usuario/asistente que exigen algunas plantillas
+        """
+        turns = []
+        turn_start = start
+        for index in range(start + 1, end):
+            message = messages[index]
+            if isinstance(message, dict) and message.get('role') == 'user':
+                turns.append((turn_start, index))
+                turn_start = index
+        if turn_start < end:
+            turns.append((turn_start, end))
+        return turns
+
+    def _truncate_message(self, model: Any, messages: List[Dict], tokens: List[int], index: int,
+                          keep_tokens: Optional[int] = None, keep_tail: bool = False) -> int:
+        """
+        Recorta el contenido de un mensaje de texto conservando el principio y el final
+
+        Returns:
+            int: Tokens ahorrados (0 si no se recortó)
+        """
+        message = messages[index]
+        content = message.get('content') if isinstance(message, dict) else None
+        if not isinstance(content, str):
+            return 0
+        keep = keep_tokens or Config.CONTEXT_TRUNCATE_KEEP_TOKENS
+        try:
+            ids = model.tokenize(content.encode('utf-8'), add_bos=False)
+        except Exception:
+            return 0
+        if len(ids) <= keep:
+            return 0
+        if keep_tail:
+            head_ids, tail_ids = [], ids[-keep:]
+        else:
+            head_ids, tail_ids = ids[:keep * 2 // 3], ids[-(keep // 3):]
+
+        def detokenize(part):
+            return model.detokenize(part).decode('utf-8', errors='ignore') if part else ''
+
+        new_content = detokenize(head_ids) + TRUNCATION_MARKER + detokenize(tail_ids)
+        messages[index] = dict(message, content=new_content)
+        new_count = self.count_message(model, messages[index])
+        saved = tokens[index] - new_count
+        tokens[index] = new_count
+        return max(saved, 0)
+
+    @staticmethod
+    def _content_text(content: Any) -> str:
+        """Texto de un contenido que puede ser string, dict {text, image_base64} o lista multimodal"""
+        if isinstance(content, str):
+            return content
+        if isinstance(content, dict):
+            return str(content.get('text', ''))
+        if isinstance(content, list):
+            return '\n'.join(
+                str(part.get('text', '')) for part in content
+                if isinstance(part, dict) and part.get('type', 'text') == 'text'
+            )
+        return json.dumps(content, ensure_ascii=False, default=str) if content is not None else ''
+
+    @staticmethod
+    def _image_tokens(content: Any) -> int:
+        """Estimación fija de tokens por imagen adjunta"""
+        if isinstance(content, dict) and content.get('image_base64'):
+            return Config.CONTEXT_IMAGE_TOKENS
+        if isinstance(content, list):
+            return Config.CONTEXT_IMAGE_TOKENS * sum(
+                1 for part in content if isinstance(part, dict) and part.get('type') == 'image_url'
+            )
+        return 0
+
+
+# Instancia global del gestor de contexto
+context_budgeter = ContextBudgeter()
@@ -0,0 +1,235 @@
+"""
+@Author: Borja Otero Ferreira
+Conversation Store - Historial de conversaciones guardado en el servidor
+El cliente envía solo el mensaje nuevo y la versión de la conversación que conoce; el
+servidor añade el turno a su copia y la respuesta del asistente al terminar el stream.
+Los mensajes se comparten entre versiones (tuplas) y no se modifican: quien necesita
+cambiar uno lo sustituye en su propia lista (copy-on-write)
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config.settings import Config
+from app.utils.logger import logger
+
+# Campos de un mensaje que se conservan (el resto, p. ej. id o timestamp del frontend, sobra)
+MESSAGE_FIELDS = ('role', 'content', 'name')
+
+
+class ConversationVersionError(Exception):
+    """La versión enviada por el cliente no es la actual (o la conversación no existe)"""
+
+    def __init__(self, conversation_id: str, expected: Optional[int], current: Optional[int]):
+        self.conversation_id = conversation_id
+        self.expected = expected
+        self.current = current
+        if current is None:
+            message = f"Conversación {conversation_id} desconocida: envía el historial completo"
+        else:
+            message = (f"Conversación {conversation_id}: versión {expected} desactualizada "
+                       f"(actual {current})")
+        super().__init__(message)
+
+
+def compact_message(message: Any, role: str = 'user') -> Dict[str, Any]:
+    """Mensaje en la forma que se guarda: un str se toma como contenido del rol indicado"""
+    if isinstance(message, dict):
+        return {k: message[k] for k in MESSAGE_FIELDS if k in message}
+    return {'role': role, 'content': message}
+
+
+def replace_message(messages: List[Dict], index: int, **changes) -> List[Dict]:
+    """
+    Copia de la lista con un mensaje sustituido; el resto se comparte.
+    Sustituye a deepcopy cuando una fase (agente, /no_think...) cambia un mensaje.
+    """
+    result = list(messages)
+    result[index] = dict(result[index], **changes)
+    return result
+
+
+class Conversation:
+    """Historial de una conversación; cada cambio genera una versión nueva"""
+
+    def __init__(self, conversation_id: str):
+        self.conversation_id = conversation_id
+        self.messages: Tuple[Dict[str, Any], ...] = ()
+        self.version = 0
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.lock = threading.Lock()
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Lista nueva con los mensajes actuales (compartidos, no copiados)"""
+        return list(self.messages)
+
+    def _commit(self, messages: Tuple[Dict[str, Any], ...]) -> int:
+        self.messages = messages
+        self.version += 1
+        self.updated_at = time.time()
+        return self.version
+
+    def to_dict(self, include_messages: bool = False) -> Dict[str, Any]:
+        data = {
+            'conversation_id': self.conversation_id,
+            'version': self.version,
+            'messages_count': len(self.messages),
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+        }
+        if include_messages:
+            data['messages'] = self.snapshot()
+        return data
+
+
+class ConversationStore:
+    """
+    Conversaciones por id, con expiración por inactividad y límite de cantidad
+    (se descartan primero las menos usadas)
+    """
+
+    def __init__(self, max_conversations: int = 1000, idle_ttl_seconds: float = 86400.0):
+        self.max_conversations = max_conversations
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self._conversations: "OrderedDict[str, Conversation]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, conversation_id: str) -> Optional[Conversation]:
+        with self._lock:
+            conversation = self._conversations.get(conversation_id)
+            if conversation is not None:
+                self._conversations.move_to_end(conversation_id)
+            return conversation
+
+    def replace(self, conversation_id: str, messages: List[Any]) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Sustituye el historial completo (primer envío o resincronización del cliente)
+
+        Returns:
+            tuple: (mensajes, versión nueva)
+        """
+        conversation = self._get_or_create(conversation_id)
+        with conversation.lock:
+            version = conversation._commit(tuple(compact_message(m) for m in messages))
+            return conversation.snapshot(), version
+
+    def append_user(self, conversation_id: str, message: Any,
+                    expected_version: Optional[int]) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Añade el mensaje nuevo del usuario si el cliente conoce la versión actual
+
+        Returns:
+            tuple: (historial completo para el modelo, versión nueva)
+
+        Raises:
+            ConversationVersionError: Versión distinta o conversación desconocida (HTTP 409)
+        """
+        conversation = self.get(conversation_id)
+        if conversation is None:
+            raise ConversationVersionError(conversation_id, expected_version, None)
+        with conversation.lock:
+            if expected_version != conversation.version:
+                raise ConversationVersionError(conversation_id, expected_version, conversation.version)
+            version = conversation._commit(conversation.messages + (compact_message(message),))
+            return conversation.snapshot(), version
+
+    def append_assistant(self, conversation_id: str, content: str, base_version: int) -> Optional[int]:
+        """
+        Añade la respuesta del asistente al turno que la generó
+
+        Returns:
+            int: Versión nueva, o la actual si el historial cambió entretanto (se descarta)
+        """
+        conversation = self.get(conversation_id)
+        if conversation is None:
+            return None
+        with conversation.lock:
+            if conversation.version != base_version:
+                logger.info(f"Conversación {conversation_id}: respuesta descartada "
+                            f"(v{base_version} sustituida por v{conversation.version})")
+                return conversation.version
+            return conversation._commit(conversation.messages + ({'role': 'assistant', 'content': content},))
+
+    def remove(self, conversation_id: str) -> bool:
+        with self._lock:
+            return self._conversations.pop(conversation_id, None) is not None
+
+    def recorder(self, conversation_id: str, version: int, session: Any = None) -> 'TurnRecorder':
+        """Recorder que guarda la respuesta del turno recién añadido"""
+        return TurnRecorder(self, conversation_id, version, session)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            conversations = list(self._conversations.values())
+        return {
+            'conversations': len(conversations),
+            'messages': sum(len(c.messages) for c in conversations),
+            'max_conversations': self.max_conversations,
+            'idle_ttl_seconds': self.idle_ttl_seconds,
+        }
+
+    def _get_or_create(self, conversation_id: str) -> Conversation:
+        with self._lock:
+            self._expire()
+            conversation = self._conversations.get(conversation_id)
+            if conversation is None:
+                conversation = Conversation(conversation_id)
+                self._conversations[conversation_id] = conversation
+                logger.info(f"Conversación {conversation_id} creada ({len(self._conversations)} guardadas)")
+            self._conversations.move_to_end(conversation_id)
+            return conversation
+
+    def _expire(self):
+        """Descarta conversaciones inactivas y las menos usadas por encima del límite (con el lock)"""
+        if self.idle_ttl_seconds > 0:
+            limit = time.time() - self.idle_ttl_seconds
+            for conversation_id in [cid for cid, c in self._conversations.items() if c.updated_at < limit]:
+                del self._conversations[conversation_id]
+        while self.max_conversations > 0 and len(self._conversations) >= self.max_conversations:
+            self._conversations.popitem(last=False)
+
+
+class TurnRecorder:
+    """
+    Acumula el contenido de los frames assistant_response de un turno y, con el frame
+    final, guarda la respuesta en la conversación. El frame final sale con la versión
+    nueva para que el cliente envíe el siguiente turno sobre ella.
+    """
+
+    def __init__(self, store: ConversationStore, conversation_id: str, version: int, session: Any = None):
+        self.store = store
+        self.conversation_id = conversation_id
+        self.version = version
+        self.session = session
+        self._parts: List[str] = []
+        self._error = False
+        self._committed = False
+
+    def feed(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Procesa un frame y devuelve el que se debe emitir"""
+        if data.get('error'):
+            self._error = True
+        elif isinstance(data.get('content'), str) and data['content']:
+            self._parts.append(data['content'])
+        if not data.get('finished'):
+            return data
+        if not self._committed:
+            self._committed = True
+            self._commit()
+        return dict(data, conversation_id=self.conversation_id, conversation_version=self.version)
+
+    def _commit(self):
+        # Respuesta parada o con error: el cliente tampoco la guarda, el turno queda sin respuesta
+        stopped = self.session is not None and self.session.stop_emit
+        content = ''.join(self._parts)
+        if self._error or stopped or not content:
+            return
+        version = self.store.append_assistant(self.conversation_id, content, self.version)
+        if version is not None:
+            self.version = version
+
+
+# Instancia global de conversaciones
+conversation_store = ConversationStore(Config.CONVERSATION_MAX_COUNT, Config.CONVERSATION_IDLE_TTL_SECONDS)
@@ -0,0 +1,651 @@
+"""
+@Author: Borja Otero Ferreira
+Inference Worker - Proceso separado dueño de los modelos, conectado por un Pipe
+El proceso web (Flask, Socket.IO, agentes, herramientas) y la generación dejan de
+compartir GIL: el web usa un RemoteModel con la misma interfaz que Llama
+(create_chat_completion, tokenize, detokenize, n_ctx) y el worker genera y envía los
+chunks por el Pipe. Si el worker muere (p. ej. lo mata el OOM killer) el supervisor
+falla las peticiones en curso, lo vuelve a arrancar y recarga sus modelos.
+Con INFERENCE_WORKERS > 1 hay varios procesos, cada uno con su porción de núcleos, su
+contexto y su caché KV; los pesos (mmap del mismo GGUF) se comparten en la page cache.
+
+Protocolo (dicts por multiprocessing.Connection):
+    web -> worker: {'op': 'load'|'unload'|'chat'|'tokenize'|'detokenize'|'cancel'|'ping', 'id', ...}
+    worker -> web: {'id', 'type': 'result'|'chunk'|'end'|'error', 'data'|'error'}
+"""
+import atexit
+import gc
+import itertools
+import multiprocessing
+import multiprocessing.util
+import os
+import queue
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from app.config.settings import Config
+from app.core import cancellation
+from app.core.cancellation import CancellationToken, RequestCancelled
+from app.utils.logger import logger
+
+# Cada cuánto se comprueba la cancelación mientras se espera al worker
+POLL_INTERVAL = 0.05
+# Sesiones cuyo worker se recuerda (las menos recientes se olvidan)
+MAX_TRACKED_SESSIONS = 4096
+
+
+class WorkerCrashed(RuntimeError):
+    """El proceso de inferencia murió con la petición en curso"""
+
+
+def build_model(spec: Dict[str, Any]):
+    """
+    Construye una instancia Llama (con borrador y autotuning) a partir de su especificación;
+    se usa igual en el proceso web (sin worker) y dentro del worker
+
+    Args:
+        spec: {'model_path', 'model_kwargs', 'draft': {'mode', 'num_pred_tokens',
+            'model_path', 'kwargs'}, 'autotune'}
+    """
+    from llama_cpp import Llama
+    from app.core.speculative import build_draft_model, check_vocab
+    from app.core.autotune import cpu_autotuner
+
+    model_path = spec['model_path']
+    draft_spec = spec.get('draft') or {}
+    draft = build_draft_model(
+        draft_spec.get('mode') or 'none',
+        draft_spec.get('num_pred_tokens'),
+        draft_spec.get('model_path'),
+        lambda path: Llama(model_path=path, **draft_spec.get('kwargs', {}))
+    )
+    options = {'draft_model': draft} if draft is not None else {}
+    options.update(spec.get('model_kwargs') or {})
+    autotune = spec.get('autotune')
+    profile = None
+    if autotune in ('auto', 'retune'):
+        profile = cpu_autotuner.get_profile(model_path) if autotune == 'auto' else None
+        options.update(cpu_autotuner.load_options(profile))
+    model = Llama(model_path=model_path, **options)
+    check_vocab(model, draft)
+    if autotune in ('auto', 'retune') and profile is None:
+        cpu_autotuner.tune(model, model_path)
+    return model
+
+
+# ----------------------------------------------------------------------
+# Proceso worker
+# ----------------------------------------------------------------------
+def _worker_main(conn, cpus: Optional[List[int]] = None):
+    """Bucle del proceso worker: atiende las operaciones en orden, una a una"""
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        # Cada worker en su porción de núcleos (contiguos: en lo posible, del mismo socket)
+        os.sched_setaffinity(0, cpus)
+    models: Dict[str, Any] = {}
+    tokens: Dict[str, CancellationToken] = {}
+    inbox: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+    send_lock = threading.Lock()
+
+    def send(message: Dict[str, Any]):
+        with send_lock:
+            conn.send(message)
+
+    def reader():
+        # Hilo aparte: una cancelación llega aunque el bucle principal esté generando
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                inbox.put(None)  # El proceso web se ha ido
+                return
+            op = message.get('op')
+            if op == 'cancel':
+                token = tokens.get(message['id'])
+                if token is not None:
+                    token.cancel(message.get('reason') or 'stopped')
+            elif op == 'ping':
+                send({'id': message['id'], 'type': 'result',
+                      'data': {'pid': os.getpid(), 'models': list(models)}})
+            else:
+                tokens[message['id']] = CancellationToken()
+                inbox.put(message)
+
+    threading.Thread(target=reader, name='inference-worker-reader', daemon=True).start()
+    logger.info(f"Inference worker {os.getpid()} listo")
+    while True:
+        message = inbox.get()
+        if message is None:
+            break
+        request_id = message['id']
+        token = tokens.get(request_id)
+        try:
+            _handle(message, models, token, send)
+        except Exception as e:
+            cancelled = token is not None and token.cancelled
+            send({'id': request_id, 'type': 'error', 'error': str(e), 'cancelled': cancelled})
+        finally:
+            tokens.pop(request_id, None)
+
+
+def _handle(message: Dict[str, Any], models: Dict[str, Any], token: CancellationToken,
+            send: Callable[[Dict[str, Any]], None]):
+    op, request_id = message['op'], message['id']
+
+    def result(data: Any = None):
+        send({'id': request_id, 'type': 'result', 'data': data})
+
+    if op == 'load':
+        started = time.time()
+        spec = message['spec']
+        if message.get('n_threads'):
+            spec = dict(spec, model_kwargs=dict(spec.get('model_kwargs') or {}))
+            spec['model_kwargs'].setdefault('n_threads', message['n_threads'])
+        model = build_model(spec)
+        models[message['model_id']] = model
+        result({'n_ctx': model.n_ctx(), 'metadata': dict(getattr(model, 'metadata', None) or {}),
+                'load_seconds': time.time() - started})
+    elif op == 'unload':
+        model = models.pop(message['model_id'], None)
+        if model is not None:
+            from app.core.kv_cache import prefix_kv_cache
+            prefix_kv_cache.mark_dirty(model)
+            del model
+            gc.collect()
+        result()
+    elif op == 'tokenize':
+        model = _model(models, message)
+        result(list(model.tokenize(message['text'], add_bos=message.get('add_bos', True),
+                                   special=message.get('special', False))))
+    elif op == 'detokenize':
+        result(_model(models, message).detokenize(message['tokens']))
+    elif op == 'chat':
+        _chat(message, _model(models, message), token, send)
+    else:
+        raise ValueError(f"Operación desconocida: {op}")
+
+
+def _model(models: Dict[str, Any], message: Dict[str, Any]):
+    model = models.get(message['model_id'])
+    if model is None:
+        raise KeyError(f"Modelo {message['model_id']} no cargado en el worker")
+    return model
+
+
+def _chat(message: Dict[str, Any], model: Any, token: CancellationToken,
+          send: Callable[[Dict[str, Any]], None]):
+    """create_chat_completion dentro del worker, con la caché KV de prefijos del propio worker"""
+    from app.core.kv_cache import prefix_kv_cache
+    request_id = message['id']
+    messages = message['messages']
+    kwargs = message.get('kwargs') or {}
+    with cancellation.bind(token), cancellation.abort_on(model, token):
+        if Config.KV_CACHE_ENABLED:
+            prefix_kv_cache.restore(model, messages)
+        if not message.get('stream'):
+            response = model.create_chat_completion(messages=messages, **kwargs)
+            prefix_kv_cache.mark_dirty(model)
+            send({'id': request_id, 'type': 'result', 'data': response})
+            return
+        content = []
+        for chunk in model.create_chat_completion(messages=messages, stream=True, **kwargs):
+            if token.cancelled:
+                break
+            choices = chunk.get('choices') or [{}]
+            content.append((choices[0].get('delta') or {}).get('content') or '')
+            send({'id': request_id, 'type': 'chunk', 'data': chunk})
+        if Config.KV_CACHE_ENABLED and not token.cancelled and ''.join(content):
+            prefix_kv_cache.store(model, list(messages) + [{'role': 'assistant', 'content': ''.join(content)}])
+        else:
+            prefix_kv_cache.mark_dirty(model)
+    send({'id': request_id, 'type': 'end', 'cancelled': token.cancelled})
+
+
+# ----------------------------------------------------------------------
+# Lado web
+# ----------------------------------------------------------------------
+def partition_cpus(workers: int) -> List[Optional[List[int]]]:
+    """Reparte los núcleos disponibles en bloques contiguos, uno por worker"""
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    if workers <= 1 or len(cpus) < workers:
+        return [None] * max(workers, 1)
+    size, extra = divmod(len(cpus), workers)
+    slices, start = [], 0
+    for index in range(workers):
+        end = start + size + (1 if index < extra else 0)
+        slices.append(cpus[start:end])
+        start = end
+    return slices
+
+
+class RemoteModel:
+    """
+    Modelo cargado en los workers. Expone lo que el resto del código usa de Llama; cada
+    generación va al worker de la sesión y la cancelación de la petición del hilo
+    (scheduler) se reenvía a ese worker.
+    """
+
+    remote = True
+    draft_model = None
+
+    def __init__(self, supervisor: 'InferenceWorkerSupervisor', model_id: str, spec: Dict[str, Any],
+                 info: Dict[str, Any]):
+        self._supervisor = supervisor
+        self.model_id = model_id
+        self.model_path = spec['model_path']
+        self.metadata = info.get('metadata') or {}
+        self._n_ctx = info.get('n_ctx') or 0
+        self._closed = False
+
+    def n_ctx(self) -> int:
+        return self._n_ctx
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        return self._supervisor.call({'op': 'tokenize', 'model_id': self.model_id, 'text': text,
+                                      'add_bos': add_bos, 'special': special})
+
+    def detokenize(self, tokens: List[int]) -> bytes:
+        return self._supervisor.call({'op': 'detokenize', 'model_id': self.model_id, 'tokens': list(tokens)})
+
+    def create_chat_completion(self, messages: List[Dict[str, Any]], stream: bool = False, **kwargs):
+        from app.core.stream_emitter import stream_settings
+        request = {'op': 'chat', 'model_id': self.model_id, 'messages': list(messages),
+                   'stream': stream, 'kwargs': kwargs}
+        # La sesión del hilo (la fija el job del scheduler) decide el worker
+        session_id = stream_settings.current()
+        if stream:
+            return self._supervisor.stream(request, session_id)
+        return self._supervisor.call(request, session_id=session_id)
+
+    def close(self):
+        """Descarga el modelo de los workers"""
+        if not self._closed:
+            self._closed = True
+            self._supervisor.unload(self.model_id)
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __repr__(self):
+        return f"RemoteModel({os.path.basename(self.model_path)!r}, id={self.model_id})"
+
+
+class _WorkerProcess:
+    """
+    Un proceso worker: su Pipe, sus peticiones en curso y el hilo que lo vigila.
+
+    El hilo lee del Pipe y entrega cada mensaje a la cola de su petición; al detectar
+    la caída falla las peticiones pendientes, espera (backoff exponencial) y arranca
+    otro proceso recargando los modelos que siguen en uso.
+    """
+
+    def __init__(self, pool: 'InferenceWorkerSupervisor', index: int, cpus: Optional[List[int]]):
+        self.pool = pool
+        self.index = index
+        self.cpus = cpus
+        self.conn = None
+        self.process = None
+        self.pending: Dict[str, "queue.Queue[Dict[str, Any]]"] = {}
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        self.ready = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.ids = itertools.count()
+        self.requests = 0
+        self.crashes = 0
+        self.restarts = 0
+        self.started_at: Optional[float] = None
+
+    @property
+    def load(self) -> int:
+        """Peticiones en curso en este worker"""
+        return len(self.pending)
+
+    @property
+    def n_threads(self) -> Optional[int]:
+        return len(self.cpus) if self.cpus else None
+
+    def submit(self, request: Dict[str, Any]):
+        self.ensure_started()
+        if not self.ready.wait(self.pool.start_timeout):
+            raise WorkerCrashed(f"El proceso de inferencia {self.index} no está disponible")
+        request_id = f"{self.index}-{next(self.ids)}"
+        responses: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        with self.lock:
+            self.pending[request_id] = responses
+            self.requests += 1
+        self.send(dict(request, id=request_id))
+        return request_id, responses
+
+    def receive(self, request_id: str, responses: "queue.Queue[Dict[str, Any]]",
+                timeout: Optional[float]) -> Dict[str, Any]:
+        """Espera la siguiente respuesta reenviando la cancelación de la petición del hilo"""
+        token = cancellation.current_token()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        cancel_sent = False
+        while True:
+            if token is not None and token.cancelled and not cancel_sent:
+                self.send({'op': 'cancel', 'id': request_id, 'reason': token.reason})
+                cancel_sent = True
+            try:
+                message = responses.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if deadline is not None and time.monotonic() > deadline:
+                    self.abandon(request_id, 'timeout')
+                    raise TimeoutError(f"Inference worker {self.index}: sin respuesta para {request_id}")
+                continue
+            if message['type'] in ('result', 'end', 'error'):
+                with self.lock:
+                    self.pending.pop(request_id, None)
+            return message
+
+    def abandon(self, request_id: str, reason: str):
+        """Cancela en el worker una petición que ya no espera nadie"""
+        with self.lock:
+            waiting = self.pending.pop(request_id, None) is not None
+        if waiting:
+            try:
+                self.send({'op': 'cancel', 'id': request_id, 'reason': reason})
+            except WorkerCrashed:
+                pass
+
+    def send(self, message: Dict[str, Any]):
+        with self.send_lock:
+            if self.conn is None:
+                raise WorkerCrashed(f"El proceso de inferencia {self.index} no está disponible")
+            self.conn.send(message)
+
+    def ensure_started(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._supervise, name=f'inference-supervisor-{self.index}',
+                                               daemon=True)
+                self.thread.start()
+
+    def _supervise(self):
+        backoff = 1.0
+        while True:
+            started = time.time()
+            try:
+                self._spawn()
+                self._read_until_exit()
+            except (OSError, EOFError, WorkerCrashed) as e:
+                # El proceso murió (o no llegó a arrancar) mientras se le reenviaban los modelos:
+                # se trata como una caída más (reintento con espera y peticiones fallidas)
+                logger.error(f"Inference worker {self.index}: fallo durante el arranque: {e}")
+                self._close_process(terminate=True)
+            self.ready.clear()
+            if self.pool.closing:
+                return
+            exitcode = self.process.exitcode if self.process is not None else None
+            self.crashes += 1
+            logger.error(f"Inference worker {self.index} terminado (exit code {exitcode}): "
+                         f"se reinicia en {backoff:.0f}s")
+            self._fail_pending(f"El proceso de inferencia terminó (exit code {exitcode})")
+            # Caídas seguidas: esperar cada vez más; si aguantó un rato, volver a empezar
+            backoff = 1.0 if time.time() - started > 60 else min(backoff * 2, self.pool.max_backoff)
+            time.sleep(backoff)
+            self.restarts += 1
+
+    def _spawn(self):
+        """Arranca el proceso y le reenvía la carga de los modelos que siguen en uso"""
+        context = multiprocessing.get_context('spawn')
+        parent, child = context.Pipe()
+        process = context.Process(target=_worker_main, args=(child, self.cpus),
+                                  name=f'inference-worker-{self.index}', daemon=True)
+        process.start()
+        # Sin esta copia abierta, la muerte del worker se detecta como EOF en el Pipe
+        child.close()
+        with self.send_lock:
+            self.conn, self.process = parent, process
+        self.started_at = time.time()
+        specs = self.pool.live_specs()
+        for model_id, spec in specs.items():
+            # La respuesta de la recarga no tiene a nadie esperando: se descarta
+            self.send({'op': 'load', 'id': f'reload-{model_id}', 'model_id': model_id, 'spec': spec,
+                       'n_threads': self.n_threads})
+        logger.info(f"Inference worker {self.index} arrancado (pid {process.pid}, "
+                    f"cpus={self.cpus or 'todas'}, {len(specs)} modelos a recargar)")
+        self.ready.set()
+
+    def _read_until_exit(self):
+        conn = self.conn
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                break
+            with self.lock:
+                responses = self.pending.get(message.get('id'))
+            if responses is not None:
+                responses.put(message)
+            elif message.get('type') == 'error':
+                logger.error(f"Inference worker {self.index}: {message.get('id')}: {message.get('error')}")
+        self._close_process()
+
+    def _close_process(self, terminate: bool = False):
+        """Cierra el Pipe y espera al proceso (terminándolo antes si sigue vivo)"""
+        with self.send_lock:
+            conn, self.conn = self.conn, None
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
+        process = self.process
+        if process is not None:
+            if terminate and process.is_alive():
+                process.terminate()
+            process.join(timeout=5)
+
+    def _fail_pending(self, error: str):
+        with self.lock:
+            pending = list(self.pending.items())
+            self.pending.clear()
+        for request_id, responses in pending:
+            responses.put({'id': request_id, 'type': 'error', 'error': error, 'crashed': True})
+
+    def get_stats(self) -> Dict[str, Any]:
+        process = self.process
+        return {
+            'index': self.index,
+            'pid': process.pid if process is not None else None,
+            'alive': bool(process is not None and process.is_alive()),
+            'ready': self.ready.is_set(),
+            'cpus': self.cpus,
+            'in_flight': self.load,
+            'requests': self.requests,
+            'crashes': self.crashes,
+            'restarts': self.restarts,
+            'uptime_seconds': time.time() - self.started_at if self.started_at else 0,
+        }
+
+
+class InferenceWorkerSupervisor:
+    """
+    Pool de procesos worker. Todos cargan los mismos modelos con use_mmap, así que los
+    pesos se comparten en la page cache y cada worker solo añade su contexto y su caché KV.
+
+    Reparto: una sesión sigue en el mismo worker (su caché de prefijos está allí)
+    mientras no tenga más trabajo que el menos cargado; si no, pasa a este.
+    """
+
+    def __init__(self, workers: int = 1, start_timeout: float = 60.0, max_backoff: float = 30.0,
+                 pin_cpus: bool = True):
+        self.start_timeout = start_timeout
+        self.max_backoff = max_backoff
+        cpus = partition_cpus(workers) if pin_cpus else [None] * max(workers, 1)
+        self._workers = [_WorkerProcess(self, index, cpu_slice) for index, cpu_slice in enumerate(cpus)]
+        self._specs: Dict[str, Dict[str, Any]] = {}
+        self._models: "weakref.WeakValueDictionary[str, RemoteModel]" = weakref.WeakValueDictionary()
+        self._sessions: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.reassignments = 0
+        self.closing = False
+        # Al salir, multiprocessing termina los workers (daemon): no es una caída. Su atexit
+        # se registra al importar multiprocessing.util; el nuestro, después, se ejecuta antes
+        atexit.register(self.shutdown)
+
+    @property
+    def size(self) -> int:
+        return len(self._workers)
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+    def load_model(self, spec: Dict[str, Any]) -> RemoteModel:
+        """Carga un modelo en todos los workers a la vez (bloquea hasta que terminan)"""
+        model_id = uuid.uuid4().hex
+        submitted = [(worker,) + worker.submit({'op': 'load', 'model_id': model_id, 'spec': spec,
+                                                'n_threads': worker.n_threads})
+                     for worker in self._workers]
+        info, error = None, None
+        for worker, request_id, responses in submitted:
+            message = worker.receive(request_id, responses, None)
+            if message['type'] == 'error':
+                error = error or message
+            elif info is None:
+                info = message.get('data') or {}
+        if error is not None:
+            for worker in self._workers:
+                self._send_unload(worker, model_id)
+            self._raise(error)
+        model = RemoteModel(self, model_id, spec, info)
+        with self._lock:
+            self._specs[model_id] = spec
+            self._models[model_id] = model
+        logger.info(f"Inference worker: {os.path.basename(spec['model_path'])} cargado en "
+                    f"{self.size} procesos en {info.get('load_seconds', 0):.1f}s")
+        return model
+
+    def unload(self, model_id: str):
+        """Descarga un modelo de los workers (sin esperar)"""
+        with self._lock:
+            known = self._specs.pop(model_id, None) is not None
+        if known:
+            for worker in self._workers:
+                self._send_unload(worker, model_id)
+
+    def live_specs(self) -> Dict[str, Dict[str, Any]]:
+        """Modelos que un worker reiniciado debe volver a cargar"""
+        with self._lock:
+            return {model_id: spec for model_id, spec in self._specs.items() if model_id in self._models}
+
+    def call(self, request: Dict[str, Any], timeout: Optional[float] = 300.0,
+             session_id: Optional[str] = None) -> Any:
+        """Operación con una única respuesta"""
+        worker = self._pick(session_id)
+        request_id, responses = worker.submit(request)
+        message = worker.receive(request_id, responses, timeout)
+        if message['type'] == 'error':
+            self._raise(message)
+        return message.get('data')
+
+    def stream(self, request: Dict[str, Any], session_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Operación con respuesta en streaming (chunks de create_chat_completion)"""
+        worker = self._pick(session_id)
+        request_id, responses = worker.submit(request)
+        try:
+            while True:
+                message = worker.receive(request_id, responses, None)
+                kind = message['type']
+                if kind == 'chunk':
+                    yield message['data']
+                elif kind == 'end':
+                    if message.get('cancelled'):
+                        raise RequestCancelled('stopped')
+                    return
+                elif kind == 'error':
+                    self._raise(message)
+                else:
+                    return
+        finally:
+            # Consumidor que abandona el stream (break, excepción): parar la generación
+            worker.abandon(request_id, 'abandoned')
+
+    def shutdown(self):
+        """Termina los workers sin reiniciarlos"""
+        self.closing = True
+        for worker in self._workers:
+            process = worker.process
+            if process is not None and process.is_alive():
+                process.terminate()
+
+    def ping(self, timeout: float = 5.0) -> List[Dict[str, Any]]:
+        results = []
+        for worker in self._workers:
+            request_id, responses = worker.submit({'op': 'ping'})
+            results.append(worker.receive(request_id, responses, timeout).get('data'))
+        return results
+
+    def get_stats(self) -> Dict[str, Any]:
+        workers = [worker.get_stats() for worker in self._workers]
+        with self._lock:
+            models, sessions = len(self._specs), len(self._sessions)
+        return {
+            'enabled': Config.INFERENCE_WORKER_ENABLED,
+            'workers': workers,
+            'ready': sum(1 for w in workers if w['ready']),
+            'models': models,
+            'sessions': sessions,
+            'reassignments': self.reassignments,
+            'pending_requests': sum(w['in_flight'] for w in workers),
+            'crashes': sum(w['crashes'] for w in workers),
+            'restarts': sum(w['restarts'] for w in workers),
+        }
+
+    # ------------------------------------------------------------------
+    # Internos
+    # ------------------------------------------------------------------
+    def _pick(self, session_id: Optional[str]) -> _WorkerProcess:
+        """Worker de la sesión, o el menos cargado si el suyo no está disponible o va más cargado"""
+        with self._lock:
+            ready = [w for w in self._workers if w.ready.is_set()] or self._workers
+            least = min(ready, key=lambda w: (w.load, w.index))
+            if session_id is None:
+                return least
+            index = self._sessions.get(session_id)
+            worker = self._workers[index] if index is not None else None
+            if worker is None or worker not in ready or worker.load > least.load:
+                if worker is not None:
+                    self.reassignments += 1
+                worker = least
+            self._sessions[session_id] = worker.index
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > MAX_TRACKED_SESSIONS:
+                self._sessions.popitem(last=False)
+            return worker
+
+    @staticmethod
+    def _send_unload(worker: _WorkerProcess, model_id: str):
+        # Puede llamarse desde __del__: nada de esperas ni respuestas pendientes
+        if not worker.ready.is_set():
+            return
+        try:
+            worker.send({'op': 'unload', 'id': f'unload-{model_id}', 'model_id': model_id})
+        except Exception as e:
+            logger.debug(f"Inference worker {worker.index}: no se pudo descargar {model_id}: {e}")
+
+    @staticmethod
+    def _raise(message: Dict[str, Any]):
+        if message.get('crashed'):
+            raise WorkerCrashed(message.get('error') or 'worker crashed')
+        if message.get('cancelled'):
+            raise RequestCancelled(message.get('error') or 'stopped')
+        raise RuntimeError(message.get('error') or 'Inference worker error')
+
+
+# Instancia global del pool de procesos de inferencia
+inference_worker = InferenceWorkerSupervisor(Config.INFERENCE_WORKERS,
+                                             Config.INFERENCE_WORKER_START_TIMEOUT_SECONDS,
+                                             Config.INFERENCE_WORKER_MAX_BACKOFF_SECONDS,
+                                             Config.INFERENCE_WORKER_PIN_CPUS)
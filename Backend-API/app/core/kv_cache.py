@@ -0,0 +1,243 @@
+"""
+@Author: Borja Otero Ferreira
+Prefix KV Cache - Reutilización del estado KV de llama.cpp entre turnos de chat
+Evita re-evaluar todo el historial en cada turno guardando snapshots del estado
+indexados por el hash del prefijo de mensajes
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from app.config.settings import Config
+from app.utils.logger import logger
+
+# Sufijo que stream_chat_completion añade al último mensaje del usuario
+NO_THINK_SUFFIX = ' /no_think'
+
+
+def _normalize_content(content: Any) -> str:
+    """Normaliza el contenido de un mensaje para que el hash sea estable"""
+    if isinstance(content, str):
+        text = content.rstrip()
+        if text.endswith(NO_THINK_SUFFIX.strip()):
+            text = text[:-len(NO_THINK_SUFFIX.strip())].rstrip()
+        return text
+    return json.dumps(content, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def model_identity(model: Any) -> str:
+    """Identificador del modelo para no mezclar estados de modelos distintos"""
+    model_path = getattr(model, 'model_path', '') or ''
+    try:
+        n_ctx = model.n_ctx()
+    except Exception:
+        n_ctx = 0
+    return f"{model_path}|{n_ctx}"
+
+
+def prefix_keys(messages: List[Dict], model_id: str = '') -> List[str]:
+    """
+    Calcula las claves de todos los prefijos de una lista de mensajes
+
+    Returns:
+        list: keys[i] es el hash de messages[:i + 1]
+    """
+    digest = hashlib.sha256(model_id.encode('utf-8'))
+    keys = []
+    for message in messages:
+        role = message.get('role', '') if isinstance(message, dict) else ''
+        content = message.get('content', '') if isinstance(message, dict) else message
+        digest.update(b'\x1e')
+        digest.update(role.encode('utf-8'))
+        digest.update(b'\x1f')
+        digest.update(_normalize_content(content).encode('utf-8'))
+        keys.append(digest.copy().hexdigest())
+    return keys
+
+
+class PrefixKVCache:
+    """
+    Caché LRU de estados KV (LlamaState) indexados por prefijo de conversación.
+
+    Al empezar un turno se busca el prefijo más largo del historial que tenga un
+    estado guardado y se carga en el modelo; llama.cpp detecta el prefijo de tokens
+    común y solo evalúa la parte nueva del prompt. Al terminar el turno se guarda el
+    estado que cubre el historial completo más la respuesta.
+    """
+
+    def __init__(self, capacity_bytes: int = 2 * 1024 ** 3):
+        self.capacity_bytes = capacity_bytes
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._live: Dict[int, str] = {}  # id(modelo) -> clave del estado cargado
+        self._model_ids: Dict[str, str] = {}  # clave -> identidad del modelo que la generó
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.live_hits = 0
+        self.evictions = 0
+        self.stores = 0
+
+    def restore(self, model: Any, messages: List[Dict]) -> int:
+        """
+        Carga en el modelo el estado del prefijo más largo cacheado
+
+        Args:
+            model: Instancia Llama
+            messages: Mensajes que se van a enviar (el último es el turno nuevo)
+
+        Returns:
+            int: Número de mensajes cubiertos por el estado restaurado (0 = miss)
+        """
+        if not messages or len(messages) < 2:
+            return 0
+        keys = prefix_keys(messages[:-1], model_identity(model))
+        with self._lock:
+            for index in range(len(keys) - 1, -1, -1):
+                key = keys[index]
+                if self._live.get(id(model)) == key:
+                    # El modelo ya tiene ese estado cargado: nada que copiar
+                    self.hits += 1
+                    self.live_hits += 1
+                    return index + 1
+                state = self._entries.get(key)
+                if state is None:
+                    continue
+                self._entries.move_to_end(key)
+                try:
+                    model.load_state(state)
+                except Exception as e:
+                    logger.warning(f"KV cache: error restaurando estado: {e}")
+                    self._drop(key)
+                    break
+                self._live[id(model)] = key
+                self.hits += 1
+                return index + 1
+            self.misses += 1
+        return 0
+
+    def store(self, model: Any, messages: List[Dict]) -> Optional[str]:
+        """
+        Guarda el estado actual del modelo asociado a la conversación completa
+
+        Args:
+            model: Instancia Llama tras generar la respuesta
+            messages: Historial completo, incluida la respuesta del asistente
+        """
+        if not messages or self.capacity_bytes <= 0:
+            return None
+        model_id = model_identity(model)
+        key = prefix_keys(messages, model_id)[-1]
+        try:
+            state = model.save_state()
+        except Exception as e:
+            logger.warning(f"KV cache: error guardando estado: {e}")
+            return None
+        size = self._state_size(state)
+        if size > self.capacity_bytes:
+            logger.info(f"KV cache: estado de {size} bytes supera la capacidad, no se guarda")
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = state
+            self._sizes[key] = size
+            self._model_ids[key] = model_id
+            self.total_bytes += size
+            self._live[id(model)] = key
+            self.stores += 1
+            while self.total_bytes > self.capacity_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+        return key
+
+    def get(self, key: str) -> Optional[Any]:
+        """Obtiene un estado por clave sin alterar las estadísticas"""
+        with self._lock:
+            return self._entries.get(key)
+
+    def find(self, messages: List[Dict]) -> Optional[Dict[str, Any]]:
+        """
+        Busca un estado que cubra exactamente la conversación dada, para cualquier modelo
+        
+        Returns:
+            dict: {'key', 'model_id', 'state'} o None si no hay estado en memoria
+        """
+        if not messages:
+            return None
+        with self._lock:
+            for model_id in set(self._model_ids.values()):
+                key = prefix_keys(messages, model_id)[-1]
+                state = self._entries.get(key)
+                if state is not None:
+                    return {'key': key, 'model_id': model_id, 'state': state}
+        return None
+
+    def put(self, key: str, state: Any, model_id: str = ''):
+        """Inserta un estado ya existente (p. ej. leído de disco)"""
+        size = self._state_size(state)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = state
+            self._sizes[key] = size
+            self._model_ids[key] = model_id
+            self.total_bytes += size
+            while self.total_bytes > self.capacity_bytes and len(self._entries) > 1:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def mark_dirty(self, model: Any):
+        """El modelo ha evaluado otro prompt: su estado ya no coincide con ninguna clave"""
+        with self._lock:
+            self._live.pop(id(model), None)
+
+    def clear(self):
+        """Vacía la caché"""
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._model_ids.clear()
+            self._live.clear()
+            self.total_bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Estadísticas de aciertos/fallos y ocupación"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.total_bytes,
+            'capacity_bytes': self.capacity_bytes,
+            'hits': self.hits,
+            'live_hits': self.live_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits / lookups) if lookups else 0.0,
+            'stores': self.stores,
+            'evictions': self.evictions,
+        }
+
+    def _drop(self, key: str):
+        """Elimina una entrada (llamar con el lock adquirido)"""
+        self._entries.pop(key, None)
+        self._model_ids.pop(key, None)
+        self.total_bytes -= self._sizes.pop(key, 0)
+        for model_id, live_key in list(self._live.items()):
+            if live_key == key:
+                del self._live[model_id]
+
+    @staticmethod
+    def _state_size(state: Any) -> int:
+        """Tamaño en bytes de un LlamaState"""
+        size = getattr(state, 'llama_state_size', None)
+        if size:
+            return int(size)
+        data = getattr(state, 'llama_state', b'')
+        return len(data) if data is not None else 0
+
+
+# Instancia global de la caché de prefijos
+prefix_kv_cache = PrefixKVCache(Config.KV_CACHE_CAPACITY_MB * 1024 ** 2)
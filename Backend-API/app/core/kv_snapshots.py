@@ -0,0 +1,244 @@
+"""
+@Author: Borja Otero Ferreira
+KV Snapshots - Persistencia en disco del estado KV junto a los chats guardados
+Al reabrir una conversación larga el siguiente turno no tiene que re-evaluar todo el historial
+"""
+import json
+import os
+import pickle
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from app.config.settings import Config
+from app.core.kv_cache import prefix_kv_cache, prefix_keys, model_identity
+from app.utils.logger import logger
+
+SNAPSHOT_VERSION = 1
+
+
+class KVSnapshotStore:
+    """
+    Guarda en chats/kv/ un snapshot del estado KV de cada chat:
+
+    - <chat>.kv       estado LlamaState serializado
+    - <chat>.kv.json  metadatos (modelo, n_ctx, hash del historial, tamaño)
+
+    Los snapshots se registran al abrir el chat pero solo se leen de disco cuando el
+    chat continúa con el mismo modelo y el historial coincide.
+
+    Con INFERENCE_WORKER_ENABLED el estado KV vive en el proceso de inferencia y este
+    proceso no puede leerlo ni cargarlo: los snapshots quedan desactivados.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._pending: Dict[str, str] = {}  # clave del historial -> nombre del chat
+        self._lock = threading.Lock()
+        self._remote_warned = False
+        self.saved = 0
+        self.restored = 0
+
+    @property
+    def status(self) -> str:
+        """'enabled', 'disabled' o 'disabled (remote model)'"""
+        if not Config.KV_SNAPSHOTS_ENABLED:
+            return 'disabled'
+        if Config.INFERENCE_WORKER_ENABLED:
+            return 'disabled (remote model)'
+        return 'enabled'
+
+    def _active(self) -> bool:
+        """Indica si los snapshots funcionan; avisa una vez si están anulados por el worker"""
+        status = self.status
+        if status == 'disabled (remote model)' and not self._remote_warned:
+            self._remote_warned = True
+            logger.warning("KV snapshots desactivados: con INFERENCE_WORKER_ENABLED el estado KV "
+                           "está en el proceso de inferencia")
+        return status == 'enabled'
+
+    # ------------------------------------------------------------------
+    # Guardado
+    # ------------------------------------------------------------------
+    def save_async(self, chat_name: str, history: List[Dict]):
+        """Guarda el snapshot en segundo plano para no bloquear la petición HTTP"""
+        if not isinstance(history, list) or not self._active():
+            return
+        entry = prefix_kv_cache.find(history)
+        if entry is None:
+            logger.debug(f"KV snapshot: no hay estado en memoria para el chat {chat_name}")
+            return
+        threading.Thread(
+            target=self._write,
+            args=(chat_name, entry, len(history)),
+            name='kv-snapshot-writer',
+            daemon=True
+        ).start()
+
+    def _write(self, chat_name: str, entry: Dict[str, Any], message_count: int):
+        """Escribe estado y metadatos de forma atómica y aplica el límite de tamaño"""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            state_path, meta_path = self._paths(chat_name)
+            with self._lock:
+                tmp_path = state_path + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    pickle.dump(entry['state'], f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, state_path)
+
+                model_path, _, n_ctx = entry['model_id'].rpartition('|')
+                meta = {
+                    'version': SNAPSHOT_VERSION,
+                    'key': entry['key'],
+                    'model_path': model_path,
+                    'n_ctx': int(n_ctx) if n_ctx.isdigit() else 0,
+                    'messages': message_count,
+                    'size': os.path.getsize(state_path),
+                    'created': time.time()
+                }
+                with open(meta_path, 'w', encoding='utf-8') as f:
+                    json.dump(meta, f, indent=4)
+            self.saved += 1
+            logger.info(f"KV snapshot guardado: {chat_name} ({meta['size'] / 1024 ** 2:.1f} MB)")
+            self.collect_garbage()
+        except Exception as e:
+            logger.error(f"Error guardando KV snapshot de {chat_name}: {e}")
+
+    # ------------------------------------------------------------------
+    # Restauración
+    # ------------------------------------------------------------------
+    def register(self, chat_name: str):
+        """Registra el snapshot de un chat recién abierto sin leerlo todavía"""
+        if not self._active():
+            return
+        meta = self._read_meta(chat_name)
+        if meta is None:
+            return
+        with self._lock:
+            self._pending[meta['key']] = chat_name
+
+    def prefetch(self, model: Any, messages: List[Dict]) -> bool:
+        """
+        Si algún prefijo de la conversación tiene un snapshot registrado, lo carga en la
+        caché de prefijos para que el siguiente restore() lo encuentre
+
+        Returns:
+            bool: True si se cargó un snapshot de disco
+        """
+        if not self._pending or not messages or len(messages) < 2:
+            return False
+        keys = prefix_keys(messages[:-1], model_identity(model))
+        with self._lock:
+            match = next(((key, self._pending[key]) for key in reversed(keys) if key in self._pending), None)
+        if match is None:
+            return False
+        key, chat_name = match
+        if prefix_kv_cache.get(key) is not None:
+            return False
+        state_path, _ = self._paths(chat_name)
+        try:
+            with open(state_path, 'rb') as f:
+                state = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"KV snapshot de {chat_name} ilegible, se descarta: {e}")
+            self.delete(chat_name)
+            return False
+        with self._lock:
+            self._pending.pop(key, None)
+        prefix_kv_cache.put(key, state, model_identity(model))
+        os.utime(state_path, None)  # Marcar como usado recientemente para el GC
+        self.restored += 1
+        logger.info(f"KV snapshot restaurado desde disco: {chat_name}")
+        return True
+
+    # ------------------------------------------------------------------
+    # Mantenimiento
+    # ------------------------------------------------------------------
+    def delete(self, chat_name: str) -> bool:
+        """Elimina el snapshot de un chat"""
+        removed = False
+        with self._lock:
+            for path in self._paths(chat_name):
+                if os.path.exists(path):
+                    os.remove(path)
+                    removed = True
+            for key in [k for k, name in self._pending.items() if name == chat_name]:
+                del self._pending[key]
+        return removed
+
+    def collect_garbage(self) -> int:
+        """
+        Borra snapshots huérfanos (sin chat asociado) y, si se supera el límite de tamaño,
+        los menos usados recientemente
+
+        Returns:
+            int: Número de snapshots eliminados
+        """
+        if not os.path.isdir(self.directory):
+            return 0
+        snapshots = []
+        removed = 0
+        for file in os.listdir(self.directory):
+            if not file.endswith('.kv'):
+                continue
+            chat_name = file[:-len('.kv')]
+            path = os.path.join(self.directory, file)
+            if not os.path.exists(os.path.join(Config.CHATS_DIR, f'{chat_name}.json')):
+                self.delete(chat_name)
+                removed += 1
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshots.append((stat.st_mtime, stat.st_size, chat_name))
+
+        total = sum(size for _, size, _ in snapshots)
+        for _, size, chat_name in sorted(snapshots):
+            if total <= self.max_bytes:
+                break
+            self.delete(chat_name)
+            total -= size
+            removed += 1
+        if removed:
+            logger.info(f"KV snapshots: {removed} eliminados por el recolector")
+        return removed
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Estado y contadores de los snapshots"""
+        with self._lock:
+            registered = len(self._pending)
+        return {
+            'status': self.status,
+            'directory': self.directory,
+            'max_bytes': self.max_bytes,
+            'registered': registered,
+            'saved': self.saved,
+            'restored': self.restored,
+        }
+
+    def _paths(self, chat_name: str):
+        """Rutas del estado y de los metadatos de un chat"""
+        from app.utils.file_manager import file_manager
+        base = os.path.join(self.directory, file_manager.sanitize_filename(chat_name))
+        return f'{base}.kv', f'{base}.kv.json'
+
+    def _read_meta(self, chat_name: str) -> Optional[Dict[str, Any]]:
+        """Lee los metadatos de un snapshot si existen y son de esta versión"""
+        state_path, meta_path = self._paths(chat_name)
+        if not os.path.exists(meta_path) or not os.path.exists(state_path):
+            return None
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except Exception as e:
+            logger.warning(f"Metadatos de KV snapshot ilegibles para {chat_name}: {e}")
+            return None
+        if meta.get('version') != SNAPSHOT_VERSION or 'key' not in meta:
+            return None
+        return meta
+
+
+# Instancia global del almacén de snapshots
+kv_snapshot_store = KVSnapshotStore(Config.KV_SNAPSHOTS_DIR, Config.KV_SNAPSHOTS_MAX_MB * 1024 ** 2)
@@ -0,0 +1,293 @@
+"""
+@Author: Borja Otero Ferreira
+Memory Planner - Estimación de memoria de una carga a partir de los metadatos GGUF
+Calcula pesos + caché KV + buffers de cómputo antes de cargar, sugiere el mayor n_ctx
+que cabe en la RAM disponible y rechaza las cargas que acabarían en swap
+"""
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config.settings import Config
+from app.utils.logger import logger
+from app.utils.gguf_reader import read_gguf_header, kv_bytes_from_metadata
+
+# Tipos de caché KV: (ggml_type para type_k/type_v, bytes por elemento)
+KV_CACHE_TYPES = {
+    'f16': (1, 2.0),
+    'q8_0': (8, 34 / 32),   # bloques de 32 valores: 32 bytes + escala f16
+    'q4_0': (2, 18 / 32),   # bloques de 32 valores: 16 bytes + escala f16
+}
+
+CTX_ALIGNMENT = 256
+
+
+@dataclass
+class MemoryPlan:
+    """Estimación de memoria de una carga"""
+    model_path: str
+    n_ctx: int
+    kv_type: str
+    flash_attn: bool
+    weights_bytes: int = 0
+    kv_bytes: int = 0
+    batch_kv_bytes: int = 0  # Contexto propio del motor de batching (slots x tokens por slot)
+    scratch_bytes: int = 0
+    available_bytes: Optional[int] = None
+    trained_context: Optional[int] = None
+    max_safe_ctx: Optional[int] = None
+    resident: bool = False  # Ya cargado en el pool: no necesita memoria nueva
+    warnings: List[str] = field(default_factory=list)
+
+    @property
+    def total_bytes(self) -> int:
+        return self.weights_bytes + self.kv_bytes + self.batch_kv_bytes + self.scratch_bytes
+
+    @property
+    def fits(self) -> bool:
+        return self.resident or self.available_bytes is None or self.total_bytes <= self.available_bytes
+
+    def to_dict(self) -> Dict[str, Any]:
+        mb = 1024 ** 2
+        return {
+            'model_path': self.model_path,
+            'n_ctx': self.n_ctx,
+            'kv_type': self.kv_type,
+            'flash_attn': self.flash_attn,
+            'weights_mb': round(self.weights_bytes / mb, 1),
+            'kv_mb': round(self.kv_bytes / mb, 1),
+            'batch_kv_mb': round(self.batch_kv_bytes / mb, 1),
+            'scratch_mb': round(self.scratch_bytes / mb, 1),
+            'total_mb': round(self.total_bytes / mb, 1),
+            'available_mb': round(self.available_bytes / mb, 1) if self.available_bytes is not None else None,
+            'fits': self.fits,
+            'resident': self.resident,
+            'trained_context': self.trained_context,
+            'max_safe_ctx': self.max_safe_ctx,
+            'warnings': self.warnings,
+        }
+
+
+def kv_cache_options(kv_type: str, flash_attn: bool) -> Dict[str, Any]:
+    """
+    Parámetros de Llama() para el tipo de caché KV
+
+    llama.cpp solo admite V cuantizada con flash attention: sin ella se cuantiza solo K.
+    """
+    if kv_type not in KV_CACHE_TYPES:
+        raise ValueError(f"Tipo de caché KV desconocido: {kv_type}")
+    options: Dict[str, Any] = {}
+    if flash_attn:
+        options['flash_attn'] = True
+    if kv_type != 'f16':
+        ggml_type = KV_CACHE_TYPES[kv_type][0]
+        options['type_k'] = ggml_type
+        if flash_attn:
+            options['type_v'] = ggml_type
+    unsupported = _unsupported_llama_options(options)
+    if unsupported:
+        raise ValueError(f"La versión instalada de llama-cpp-python no admite {', '.join(unsupported)} "
+                         f"(kv_type={kv_type}, flash_attn={flash_attn}); se necesita >= 0.3 "
+                         f"(ver requirements.txt) o kv_type=f16 sin flash attention")
+    return options
+
+
+def _unsupported_llama_options(options: Dict[str, Any]) -> List[str]:
+    """Opciones que Llama() de la versión instalada no acepta (llama-cpp-python antiguo)"""
+    if not options:
+        return []
+    try:
+        import inspect
+        import llama_cpp
+        parameters = inspect.signature(llama_cpp.Llama.__init__).parameters
+    except (ImportError, TypeError, ValueError):
+        return []  # Sin llama_cpp en este proceso (o sin firma): decide la carga
+    return sorted(name for name in options if name not in parameters)
+
+
+class MemoryPlanner:
+    """
+    Planifica la memoria de una carga.
+
+    - Pesos: tamaño del fichero (la parte descargada en GPU no cuenta como RAM)
+    - KV: 2 * capas * n_ctx * cabezas_kv * dim_cabeza * bytes del tipo elegido
+    - Cómputo: logits y activaciones de un ubatch y, sin flash attention, la matriz
+      de atención n_ctx x ubatch x cabezas en f32
+    """
+
+    def __init__(self, headroom_bytes: int = 0):
+        self.headroom_bytes = headroom_bytes
+        self._headers: Dict[Tuple[str, int, int], Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def plan(self, model_path: str, n_ctx: int, kv_type: str = 'f16', flash_attn: bool = False,
+             gpu_layers: int = 0, n_batch: int = 512, extra_bytes: int = 0,
+             reclaimable_bytes: int = 0, replicas: int = 1, batch_slots: int = 0,
+             batch_slot_ctx: int = 0) -> MemoryPlan:
+        """
+        Estima la memoria de cargar model_path con n_ctx
+
+        Args:
+            model_path: Ruta del GGUF
+            n_ctx: Tamaño de contexto pedido
+            kv_type: 'f16', 'q8_0' o 'q4_0'
+            flash_attn: Activar flash attention
+            gpu_layers: Capas descargadas en GPU (-1 = todas)
+            n_batch: Tamaño de batch de evaluación
+            extra_bytes: Memoria adicional (p. ej. modelo de borrador)
+            reclaimable_bytes: Memoria que se puede liberar antes de cargar (modelos expulsables)
+            replicas: Procesos que cargan el modelo (pesos compartidos por mmap, KV por proceso)
+            batch_slots: Slots del motor de batching (su contexto es una caché KV más)
+            batch_slot_ctx: Tokens por slot (0 = n_ctx)
+        """
+        if kv_type not in KV_CACHE_TYPES:
+            raise ValueError(f"Tipo de caché KV desconocido: {kv_type}")
+        metadata = self._metadata(model_path)
+        arch = metadata.get('general.architecture', 'llama')
+        n_layer = self._meta_int(metadata, f'{arch}.block_count')
+        plan = MemoryPlan(model_path=model_path, n_ctx=n_ctx, kv_type=kv_type, flash_attn=flash_attn)
+        plan.trained_context = self._meta_int(metadata, f'{arch}.context_length') or None
+
+        cpu_fraction = self._cpu_fraction(gpu_layers, n_layer)
+        replicas = max(1, replicas)
+        slot_kv_per_token = self._kv_per_token(metadata, kv_type, flash_attn) * cpu_fraction
+        kv_per_token = slot_kv_per_token * replicas
+        plan.weights_bytes = int(os.path.getsize(model_path) * cpu_fraction) + extra_bytes
+        plan.kv_bytes = int(kv_per_token * n_ctx)
+        plan.batch_kv_bytes = int(slot_kv_per_token * batch_slots * (batch_slot_ctx or n_ctx))
+        plan.scratch_bytes = self._scratch_bytes(metadata, n_ctx, n_batch, flash_attn) * replicas
+
+        # La memoria crece linealmente con n_ctx: fijo + por_token * n_ctx
+        # (los slots del motor de batching crecen con n_ctx si no tienen tamaño propio)
+        fixed = plan.weights_bytes + self._scratch_bytes(metadata, 0, n_batch, flash_attn) * replicas
+        per_token = kv_per_token + self._scratch_per_token(metadata, n_batch, flash_attn) * replicas
+        if batch_slot_ctx:
+            fixed += plan.batch_kv_bytes
+        else:
+            per_token += slot_kv_per_token * batch_slots
+
+        available = self._available_bytes()
+        if available is not None:
+            plan.available_bytes = max(available + reclaimable_bytes - self.headroom_bytes, 0)
+            if per_token > 0:
+                max_ctx = int((plan.available_bytes - fixed) / per_token) // CTX_ALIGNMENT * CTX_ALIGNMENT
+                if plan.trained_context:
+                    max_ctx = min(max_ctx, plan.trained_context)
+                plan.max_safe_ctx = max(max_ctx, 0)
+
+        if plan.trained_context and n_ctx > plan.trained_context:
+            plan.warnings.append(f"n_ctx {n_ctx} supera el contexto de entrenamiento ({plan.trained_context})")
+        if kv_type != 'f16' and not flash_attn:
+            plan.warnings.append("Sin flash attention solo se cuantiza la caché K; V se mantiene en f16")
+        if not plan.fits:
+            plan.warnings.append("La carga no cabe en la RAM disponible y usaría swap")
+        return plan
+
+    # ------------------------------------------------------------------
+    # Auxiliares
+    # ------------------------------------------------------------------
+    def _metadata(self, model_path: str) -> Dict[str, Any]:
+        stat = os.stat(model_path)
+        key = (os.path.abspath(model_path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            header = self._headers.get(key)
+        if header is None:
+            header = read_gguf_header(model_path, read_tensors=False)
+            with self._lock:
+                self._headers[key] = header
+        return header['metadata']
+
+    @staticmethod
+    def _meta_int(metadata: Dict[str, Any], key: str, default: int = 0) -> int:
+        try:
+            return int(metadata.get(key, default))
+        except (TypeError, ValueError):
+            return default
+
+    @staticmethod
+    def _cpu_fraction(gpu_layers: int, n_layer: int) -> float:
+        """Fracción del modelo que queda en RAM según las capas descargadas en GPU"""
+        if not gpu_layers or not n_layer or not _gpu_offload_supported():
+            return 1.0
+        if gpu_layers < 0 or gpu_layers >= n_layer:
+            return 0.0
+        return (n_layer - gpu_layers) / n_layer
+
+    @staticmethod
+    def _kv_per_token(metadata: Dict[str, Any], kv_type: str, flash_attn: bool) -> float:
+        """Bytes de caché KV por token de contexto (K con el tipo elegido; V solo con flash attention)"""
+        k_bytes = kv_bytes_from_metadata(metadata, 1, KV_CACHE_TYPES[kv_type][1]) / 2
+        v_type = kv_type if flash_attn else 'f16'
+        v_bytes = kv_bytes_from_metadata(metadata, 1, KV_CACHE_TYPES[v_type][1]) / 2
+        return k_bytes + v_bytes
+
+    def _scratch_per_token(self, metadata: Dict[str, Any], n_batch: int, flash_attn: bool) -> float:
+        if flash_attn:
+            return 0.0
+        arch = metadata.get('general.architecture', 'llama')
+        n_head = self._meta_int(metadata, f'{arch}.attention.head_count')
+        return 4.0 * min(n_batch, 512) * n_head
+
+    def _scratch_bytes(self, metadata: Dict[str, Any], n_ctx: int, n_batch: int, flash_attn: bool) -> int:
+        """Buffers de cómputo: logits y activaciones de un ubatch más la atención sin flash attention"""
+        arch = metadata.get('general.architecture', 'llama')
+        n_embd = self._meta_int(metadata, f'{arch}.embedding_length')
+        n_ff = self._meta_int(metadata, f'{arch}.feed_forward_length', 4 * n_embd)
+        n_vocab = self._meta_int(metadata, 'tokenizer.ggml.tokens.length')
+        ubatch = min(n_batch, 512)
+        activations = 4 * ubatch * (n_vocab + 4 * n_embd + 2 * n_ff)
+        return int(activations + self._scratch_per_token(metadata, n_batch, flash_attn) * n_ctx)
+
+    @staticmethod
+    def _available_bytes() -> Optional[int]:
+        try:
+            import psutil
+            return int(psutil.virtual_memory().available)
+        except ImportError:
+            return None
+
+
+def _gpu_offload_supported() -> bool:
+    """Con una compilación solo CPU de llama.cpp n_gpu_layers se ignora y todo va a RAM"""
+    try:
+        import llama_cpp
+        return bool(llama_cpp.llama_supports_gpu_offload())
+    except (ImportError, AttributeError):
+        return True  # Versión sin la función: se confía en n_gpu_layers
+
+
+def check_load(model_path: str, n_ctx: int, kv_type: str = 'f16', flash_attn: bool = False,
+               gpu_layers: int = 0, extra_bytes: int = 0, reclaimable_bytes: int = 0,
+               replicas: int = 1, batch_slots: int = 0, batch_slot_ctx: int = 0) -> MemoryPlan:
+    """
+    Planifica una carga y la rechaza si no cabe en memoria
+
+    Raises:
+        MemoryError: Si la carga usaría swap (con el n_ctx máximo sugerido en el mensaje)
+    """
+    if kv_type not in KV_CACHE_TYPES:
+        raise ValueError(f"Tipo de caché KV desconocido: {kv_type}")
+    try:
+        plan = memory_planner.plan(model_path, n_ctx, kv_type=kv_type, flash_attn=flash_attn,
+                                   gpu_layers=gpu_layers, extra_bytes=extra_bytes,
+                                   reclaimable_bytes=reclaimable_bytes, replicas=replicas,
+                                   batch_slots=batch_slots, batch_slot_ctx=batch_slot_ctx)
+    except (OSError, ValueError) as e:
+        # Cabecera ilegible: se deja que llama.cpp decida
+        logger.warning(f"No se pudo planificar la memoria de {model_path}: {e}")
+        return MemoryPlan(model_path=model_path, n_ctx=n_ctx, kv_type=kv_type, flash_attn=flash_attn)
+
+    logger.info(f"Plan de memoria {os.path.basename(model_path)}: n_ctx={n_ctx}, "
+                f"~{plan.total_bytes / 1024 ** 2:.0f} MB (disponible: "
+                f"{plan.available_bytes / 1024 ** 2 if plan.available_bytes is not None else -1:.0f} MB)")
+    if Config.MEMORY_PLANNER_ENFORCE and not plan.fits:
+        raise MemoryError(
+            f"El modelo necesita ~{plan.total_bytes / 1024 ** 2:.0f} MB con n_ctx={n_ctx} y solo hay "
+            f"{plan.available_bytes / 1024 ** 2:.0f} MB disponibles; n_ctx máximo seguro: {plan.max_safe_ctx}"
+        )
+    return plan
+
+
+# Instancia global del planificador de memoria
+memory_planner = MemoryPlanner(Config.MEMORY_PLANNER_HEADROOM_MB * 1024 ** 2)
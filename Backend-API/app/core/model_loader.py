@@ -0,0 +1,192 @@
+"""
+@Author: Borja Otero Ferreira
+Model Loader - Carga asíncrona de modelos con progreso por socket y cambio en caliente
+El modelo anterior sigue respondiendo hasta que el nuevo está listo
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from app.utils import blocking
+from app.utils.logger import logger
+
+# Fases de una carga y progreso aproximado al entrar en cada una
+LOAD_STAGES = {
+    'queued': 0.0,
+    'loading': 0.05,
+    'swapping': 0.95,
+    'ready': 1.0,
+    'failed': 1.0,
+}
+
+
+@dataclass
+class LoadJob:
+    """Trabajo de carga de un modelo"""
+    model_path: str
+    options: Dict[str, Any] = field(default_factory=dict)
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = 'queued'  # queued | loading | swapping | ready | failed
+    progress: float = 0.0
+    message: str = ''
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    done: threading.Event = field(default_factory=threading.Event)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ('ready', 'failed')
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return blocking.wait_event(self.done, timeout)
+
+    def to_dict(self) -> Dict[str, Any]:
+        end = self.finished_at or time.time()
+        return {
+            'job_id': self.job_id,
+            'model_path': self.model_path,
+            'options': self.options,
+            'status': self.status,
+            'progress': round(self.progress, 3),
+            'message': self.message,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'elapsed_seconds': round(end - (self.started_at or end), 3),
+        }
+
+
+class ModelLoadManager:
+    """
+    Ejecuta las cargas en hilos de fondo, de una en una para no competir por la RAM.
+
+    Cada trabajo pasa por dos pasos que aporta quien lo crea:
+    - build(): construye la instancia (puede tardar minutos)
+    - swap(model): la activa; se ejecuta a través del scheduler para no cambiar el
+      modelo en mitad de una respuesta
+    """
+
+    def __init__(self, history_size: int = 20, heartbeat_seconds: float = 0.5):
+        self._jobs: "OrderedDict[str, LoadJob]" = OrderedDict()
+        self._jobs_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._history_size = history_size
+        self._heartbeat_seconds = heartbeat_seconds
+        self._bytes_per_second: Optional[float] = None  # Velocidad observada en cargas anteriores
+
+    def start(self, model_path: str, build: Callable[[], Any], swap: Callable[[Any], None],
+              options: Optional[Dict[str, Any]] = None) -> LoadJob:
+        """
+        Lanza un trabajo de carga
+
+        Returns:
+            LoadJob: Trabajo creado (o el que ya estaba en marcha para la misma configuración)
+        """
+        options = options or {}
+        with self._jobs_lock:
+            for job in self._jobs.values():
+                if not job.finished and job.model_path == model_path and job.options == options:
+                    logger.info(f"Carga de {model_path} ya en curso (job {job.job_id})")
+                    return job
+            job = LoadJob(model_path=model_path, options=options)
+            self._jobs[job.job_id] = job
+            while len(self._jobs) > self._history_size:
+                oldest = next(iter(self._jobs))
+                if not self._jobs[oldest].finished:
+                    break
+                del self._jobs[oldest]
+
+        self._update(job, 'queued', message='En cola')
+        threading.Thread(
+            target=self._run,
+            args=(job, build, swap),
+            name=f'model-load-{job.job_id[:8]}',
+            daemon=True
+        ).start()
+        return job
+
+    def get_job(self, job_id: str) -> Optional[LoadJob]:
+        with self._jobs_lock:
+            return self._jobs.get(job_id)
+
+    def get_jobs(self) -> List[LoadJob]:
+        """Trabajos recientes, del más nuevo al más antiguo"""
+        with self._jobs_lock:
+            return list(reversed(self._jobs.values()))
+
+    def _run(self, job: LoadJob, build: Callable[[], Any], swap: Callable[[Any], None]):
+        with self._load_lock:
+            job.started_at = time.time()
+            self._update(job, 'loading', message='Cargando pesos del modelo')
+            stop_heartbeat = threading.Event()
+            heartbeat = threading.Thread(
+                target=self._heartbeat, args=(job, stop_heartbeat), daemon=True
+            )
+            heartbeat.start()
+            try:
+                model = build()
+                stop_heartbeat.set()
+                self._record_speed(job)
+
+                self._update(job, 'swapping', message='Activando el modelo')
+                swap(model)
+
+                self._update(job, 'ready', message='Modelo listo')
+                logger.info(f"Job {job.job_id}: modelo {job.model_path} activo")
+            except Exception as e:
+                stop_heartbeat.set()
+                job.error = str(e)
+                self._update(job, 'failed', message='Error cargando el modelo')
+                logger.error(f"Job {job.job_id}: error cargando {job.model_path}: {e}")
+            finally:
+                job.finished_at = time.time()
+                job.done.set()
+
+    def _heartbeat(self, job: LoadJob, stop: threading.Event):
+        """Emite progreso estimado mientras llama.cpp carga el modelo"""
+        size = self._file_size(job.model_path)
+        low, high = LOAD_STAGES['loading'], LOAD_STAGES['swapping']
+        while not stop.wait(self._heartbeat_seconds):
+            if job.status != 'loading':
+                return
+            elapsed = time.time() - job.started_at
+            if self._bytes_per_second and size:
+                fraction = min(elapsed * self._bytes_per_second / size, 0.99)
+            else:
+                # Sin historial: curva asintótica para indicar actividad
+                fraction = elapsed / (elapsed + 10.0)
+            self._update(job, 'loading', progress=low + (high - low) * fraction,
+                         message=f'Cargando pesos del modelo ({elapsed:.0f}s)')
+
+    def _record_speed(self, job: LoadJob):
+        size = self._file_size(job.model_path)
+        elapsed = time.time() - job.started_at
+        if size and elapsed > 0.5:
+            self._bytes_per_second = size / elapsed
+
+    def _update(self, job: LoadJob, status: str, progress: Optional[float] = None, message: str = ''):
+        """Actualiza el estado del trabajo y lo notifica por socket"""
+        job.status = status
+        job.progress = LOAD_STAGES.get(status, job.progress) if progress is None else progress
+        if message:
+            job.message = message
+        from app.utils.socket_instance import emit_safely
+        emit_safely('model_load_progress', job.to_dict(), namespace='/test')
+
+    @staticmethod
+    def _file_size(path: str) -> int:
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+
+# Instancia global del gestor de cargas
+model_load_manager = ModelLoadManager()
@@ -0,0 +1,280 @@
+"""
+@Author: Borja Otero Ferreira
+Model Pool - Instancias Llama residentes en memoria con expulsión LRU por presupuesto de RAM
+Permite alternar entre modelos (chat, planificador...) sin recargarlos cada vez
+"""
+import gc
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.config.settings import Config
+from app.utils.logger import logger
+from app.utils import metrics
+from app.utils import blocking
+from app.utils.gguf_reader import kv_bytes_from_metadata
+
+PoolKey = Tuple[str, int, int, str]  # (ruta, n_ctx, gpu_layers, variante)
+
+
+@dataclass
+class PooledModel:
+    """Modelo residente en el pool"""
+    key: PoolKey
+    model: Any
+    file_bytes: int = 0
+    kv_bytes: int = 0
+    loaded_at: float = field(default_factory=time.time)
+    last_used: float = field(default_factory=time.time)
+    load_seconds: float = 0.0
+    uses: int = 0
+
+    @property
+    def estimated_bytes(self) -> int:
+        """Memoria estimada: pesos + caché KV"""
+        return self.file_bytes + self.kv_bytes
+
+    def to_dict(self) -> Dict[str, Any]:
+        path, n_ctx, gpu_layers, variant = self.key
+        return {
+            'model_path': path,
+            'n_ctx': n_ctx,
+            'gpu_layers': gpu_layers,
+            'variant': variant,
+            'weights_bytes': self.file_bytes,
+            'kv_bytes': self.kv_bytes,
+            'estimated_bytes': self.estimated_bytes,
+            'loaded_at': self.loaded_at,
+            'last_used': self.last_used,
+            'load_seconds': round(self.load_seconds, 3),
+            'uses': self.uses,
+        }
+
+
+def estimate_kv_bytes(model: Any, n_ctx: int, bytes_per_element: float = 2.0) -> int:
+    """
+    Estima el tamaño de la caché KV a partir de los metadatos GGUF del modelo
+
+    Args:
+        model: Instancia Llama ya cargada
+        n_ctx: Tamaño de contexto
+        bytes_per_element: Bytes por elemento de K/V (2 para f16)
+    """
+    return kv_bytes_from_metadata(getattr(model, 'metadata', None) or {}, n_ctx, bytes_per_element)
+
+
+def default_ram_budget() -> int:
+    """Presupuesto de RAM por defecto: fracción de la memoria física total"""
+    if Config.MODEL_POOL_RAM_BUDGET_MB > 0:
+        return Config.MODEL_POOL_RAM_BUDGET_MB * 1024 ** 2
+    try:
+        import psutil
+        return int(psutil.virtual_memory().total * Config.MODEL_POOL_RAM_FRACTION)
+    except ImportError:
+        return 0  # Sin límite
+
+
+class ModelPool:
+    """
+    Mantiene hasta max_resident instancias Llama cargadas, indexadas por
+    (ruta, n_ctx, gpu_layers). Cuando se supera el presupuesto de RAM se expulsan
+    los modelos menos usados recientemente, nunca el modelo activo.
+    """
+
+    def __init__(self, ram_budget_bytes: int = 0, max_resident: int = 2):
+        self.ram_budget_bytes = ram_budget_bytes
+        self.max_resident = max(1, max_resident)
+        self._models: "OrderedDict[PoolKey, PooledModel]" = OrderedDict()
+        self._active: Optional[PoolKey] = None
+        self._lock = threading.RLock()
+        self._loading: Dict[PoolKey, threading.Event] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(model_path: str, n_ctx: int, gpu_layers: int, variant: str = '') -> PoolKey:
+        return (os.path.abspath(model_path), int(n_ctx), int(gpu_layers), variant or '')
+
+    def acquire(self, model_path: str, n_ctx: int, gpu_layers: int,
+                loader: Callable[[], Any], activate: bool = True,
+                variant: str = '', extra_bytes: int = 0, kv_bytes: Optional[int] = None) -> Any:
+        """
+        Devuelve el modelo residente o lo carga bajo demanda
+
+        Args:
+            model_path: Ruta del fichero GGUF
+            n_ctx: Tamaño de contexto
+            gpu_layers: Capas en GPU
+            loader: Callable que construye la instancia Llama si no está residente
+            activate: Marcar como modelo activo (protegido frente a expulsión)
+            variant: Opciones de carga que cambian la instancia (p. ej. modo de borrador)
+            extra_bytes: Memoria adicional asociada (p. ej. el modelo de borrador)
+            kv_bytes: Tamaño de la caché KV si ya se conoce (p. ej. del planificador de memoria)
+        """
+        key = self.make_key(model_path, n_ctx, gpu_layers, variant)
+        while True:
+            with self._lock:
+                entry = self._models.get(key)
+                if entry is not None:
+                    self._models.move_to_end(key)
+                    self.hits += 1
+                    logger.info(f"Model pool: {os.path.basename(key[0])} ya residente")
+                    return self._use(key, entry, activate)
+                loading = self._loading.get(key)
+                if loading is None:
+                    # Esta llamada carga el modelo; las concurrentes esperan al evento
+                    loading = self._loading[key] = threading.Event()
+                    self.misses += 1
+                    break
+            # Otra petición ya lo está cargando: esperar sin tener el lock (si falla, se reintenta)
+            blocking.wait_event(loading)
+
+        # La carga (minutos con autotune) se hace sin el lock para que el resto del pool siga
+        # respondiendo; la expulsión se hace después, así una carga fallida no expulsa nada
+        file_bytes = self._file_size(key[0]) + extra_bytes
+        start = time.time()
+        try:
+            model = loader()
+        except BaseException:
+            with self._lock:
+                self._loading.pop(key).set()
+            raise
+        with self._lock:
+            entry = PooledModel(
+                key=key,
+                model=model,
+                file_bytes=file_bytes,
+                kv_bytes=kv_bytes if kv_bytes is not None else estimate_kv_bytes(model, key[1]),
+                load_seconds=time.time() - start
+            )
+            self._models[key] = entry
+            logger.info(f"Model pool: {os.path.basename(key[0])} cargado en {entry.load_seconds:.1f}s "
+                        f"(~{entry.estimated_bytes / 1024 ** 2:.0f} MB)")
+            try:
+                return self._use(key, entry, activate)
+            finally:
+                self._loading.pop(key).set()
+
+    def _use(self, key: PoolKey, entry: PooledModel, activate: bool) -> Any:
+        """Registra un uso del modelo y, si pasa a ser el activo, libera espacio (con el lock)"""
+        entry.last_used = time.time()
+        entry.uses += 1
+        if activate:
+            # El modelo que se sustituye pasa a ser expulsable
+            self._active = key
+        self._make_room(0, keep=key)
+        return entry.model
+
+    def activate(self, model: Any) -> bool:
+        """Marca una instancia residente como modelo activo y libera espacio si hace falta"""
+        with self._lock:
+            for key, entry in self._models.items():
+                if entry.model is model:
+                    self._active = key
+                    self._models.move_to_end(key)
+                    self._make_room(0, keep=key)
+                    return True
+        return False
+
+    def get(self, model_path: str, n_ctx: int, gpu_layers: int, variant: str = '') -> Optional[Any]:
+        """Devuelve el modelo si está residente, sin cargarlo"""
+        with self._lock:
+            entry = self._models.get(self.make_key(model_path, n_ctx, gpu_layers, variant))
+            return entry.model if entry else None
+
+    def release(self, model: Any) -> bool:
+        """Expulsa del pool la instancia indicada"""
+        with self._lock:
+            for key, entry in list(self._models.items()):
+                if entry.model is model:
+                    self._evict(key)
+                    return True
+        return False
+
+    def clear(self):
+        """Descarga todos los modelos"""
+        with self._lock:
+            for key in list(self._models.keys()):
+                self._evict(key)
+
+    @property
+    def used_bytes(self) -> int:
+        with self._lock:
+            return sum(entry.estimated_bytes for entry in self._models.values())
+
+    def get_resident(self) -> List[Dict[str, Any]]:
+        """Modelos residentes, del más reciente al más antiguo"""
+        with self._lock:
+            resident = []
+            for key, entry in reversed(self._models.items()):
+                info = entry.to_dict()
+                info['active'] = key == self._active
+                resident.append(info)
+            return resident
+
+    def reclaimable_bytes(self) -> int:
+        """Memoria de los modelos que se pueden expulsar (todos salvo el activo)"""
+        with self._lock:
+            return sum(entry.estimated_bytes for key, entry in self._models.items() if key != self._active)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'resident': len(self._models),
+            'max_resident': self.max_resident,
+            'used_bytes': self.used_bytes,
+            'ram_budget_bytes': self.ram_budget_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def _make_room(self, incoming_bytes: int, keep: PoolKey):
+        """Expulsa modelos LRU hasta respetar el presupuesto y el máximo de residentes"""
+        while True:
+            count = len(self._models) + (0 if keep in self._models else 1)
+            over_count = count > self.max_resident
+            over_budget = (self.ram_budget_bytes > 0 and
+                           self.used_bytes + incoming_bytes > self.ram_budget_bytes)
+            if not (over_count or over_budget):
+                return
+            victim = next((k for k in self._models if k != keep and k != self._active), None)
+            if victim is None:
+                if over_budget:
+                    logger.warning("Model pool: presupuesto de RAM superado pero no hay modelos expulsables")
+                return
+            self._evict(victim)
+
+    def _evict(self, key: PoolKey):
+        """Libera un modelo (llamar con el lock adquirido)"""
+        entry = self._models.pop(key, None)
+        if entry is None:
+            return
+        if self._active == key:
+            self._active = None
+        self.evictions += 1
+        try:
+            from app.core.kv_cache import prefix_kv_cache
+            prefix_kv_cache.mark_dirty(entry.model)
+        except ImportError:
+            pass
+        # Solo se suelta la referencia: si un stream en curso aún usa el modelo,
+        # la memoria se libera cuando termine
+        entry.model = None
+        gc.collect()
+        logger.info(f"Model pool: {os.path.basename(key[0])} expulsado")
+
+    @staticmethod
+    def _file_size(path: str) -> int:
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+
+# Instancia global del pool de modelos
+model_pool = ModelPool(default_ram_budget(), Config.MODEL_POOL_MAX_RESIDENT)
+metrics.models_resident.set_function(lambda: len(model_pool.get_resident()))
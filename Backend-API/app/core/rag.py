@@ -26,6 +26,9 @@ from langchain_community.document_loaders import (
 )
 
 from app.utils.logger import logger
+from app.utils.tracing import llm_stream, tracer
+from app.utils import metrics
+from app.core.cancellation import RequestCancelled, abort_on, check_cancelled, is_cancelled
 
 
 
@@ -181,6 +184,8 @@ class Retriever:
         ".pptx": (UnstructuredPowerPointLoader, {}),
         ".txt": (TextLoader, {"encoding": "utf8"}),
     }
+    # Fragmentos embebidos por lote; entre lotes se comprueba si el usuario paró
+    INGEST_BATCH_SIZE = 64
 
     def __init__(self, model: Llama, prompt: List[Dict], socket):
         """
@@ -230,7 +235,8 @@ class Retriever:
             # Load and process documents
             logger.info("🔍 Cargando documentos...")
             print("🔍 Cargando documentos...")
-            self.docs = self.load_documents(self.source_dir)
+            with metrics.rag_stage_seconds.labels('load').time():
+                self.docs = self.load_documents(self.source_dir)
             logger.info(f"🔍 {len(self.docs)} documentos cargados")
             print(f"🔍 {len(self.docs)} documentos cargados")
             
@@ -241,18 +247,30 @@ class Retriever:
             if self.is_new_documents():
                 logger.info("🔍 Indexando documentos nuevos...")
                 print("🔍 Indexando documentos nuevos...")
-                self.index_documents()
-                self.doc_store.save_index()
+                with metrics.rag_stage_seconds.labels('index').time(), tracer.span('rag.index'):
+                    self.index_documents()
+                    self.doc_store.save_index()
                 logger.info("🔍 Indexación completada")
                 print("🔍 Indexación completada")
 
             logger.info("🔍 Preparando historial de chat para RAG...")
             print("🔍 Preparando historial de chat para RAG...")
-            self.prepare_chat_history()
+            with metrics.rag_stage_seconds.labels('retrieve').time(), tracer.span('rag.retrieve'):
+                self.prepare_chat_history()
             logger.info("🔍 Generando respuesta RAG...")
             print("🔍 Generando respuesta RAG...")
-            self.emitir_respuesta()
+            with metrics.rag_stage_seconds.labels('generate').time():
+                self.emitir_respuesta()
+            metrics.rag_requests.labels('completed').inc()
+        except RequestCancelled as e:
+            metrics.rag_requests.labels('cancelled').inc()
+            logger.info(f"RAG cancelado: {e}")
+            self.socket.emit('assistant_response', {
+                'content': '',
+                'finished': True
+            }, namespace='/test')
         except Exception as e:
+            metrics.rag_requests.labels('error').inc()
             logger.error(f"Error in RAG processing: {e}")
             # Usar SocketResponseHandler para enviar error
             self.socket_handler.emit_rag_error(
@@ -283,6 +301,7 @@ class Retriever:
         
         documents = []
         for file_path in all_files_list:
+            check_cancelled()
             try:
                 logger.info(f"🔍 DEBUG: Loading file: {file_path}")
                 loaded_docs = self.load_single_document(file_path)
@@ -353,12 +372,7 @@ class Retriever:
         
         # Create vectorstore with error handling
         try:
-            self.vectorstore = Chroma.from_documents(
-                documents=all_splits,
-                collection_name="rag-chroma",
-                embedding=embeddings,
-                persist_directory=self.vectorstore_path,
-            )
+            self.vectorstore = self._index_in_batches(all_splits, embeddings)
             self.retriever = self.vectorstore.as_retriever()
             logger.info("Vector store initialized successfully")
         except RuntimeError as e:
@@ -368,17 +382,24 @@ class Retriever:
                 if os.path.exists(self.vectorstore_path):
                     shutil.rmtree(self.vectorstore_path)
                 # Recreate vectorstore
-                self.vectorstore = Chroma.from_documents(
-                    documents=all_splits,
-                    collection_name="rag-chroma",
-                    embedding=embeddings,
-                    persist_directory=self.vectorstore_path,
-                )
+                self.vectorstore = self._index_in_batches(all_splits, embeddings)
                 self.retriever = self.vectorstore.as_retriever()
                 logger.info("Vector store recreated successfully")
             else:
                 raise
 
+    def _index_in_batches(self, splits: List[Document], embeddings) -> Chroma:
+        """Equivalente a Chroma.from_documents pero por lotes, para poder cancelar la ingesta"""
+        vectorstore = Chroma(
+            collection_name="rag-chroma",
+            embedding_function=embeddings,
+            persist_directory=self.vectorstore_path,
+        )
+        for start in range(0, len(splits), self.INGEST_BATCH_SIZE):
+            check_cancelled()
+            vectorstore.add_documents(splits[start:start + self.INGEST_BATCH_SIZE])
+        return vectorstore
+
     def is_new_documents(self) -> bool:
         """Check if new documents need to be indexed."""
         return True  # Simplified for now, always reindex
@@ -627,25 +648,28 @@ class Retriever:
             print(f"🔍 Enviando prompt al modelo con {len(self.chat_history[0]['content'])} caracteres")
             
             # Stream exactly like legacy - chunk by chunk manually con socket directo
-            for chunk in self.model.create_chat_completion(
-                messages=self.chat_history,
-                max_tokens=10000,
-                stream=True
-            ):
-                if 'content' in chunk['choices'][0]['delta']:
-                    fragmento_response = chunk['choices'][0]['delta']['content']
-                    response_completa += fragmento_response
-                    total_tokens += 1
-                    
-                    # Emit EXACTO como legacy - socket directo
-                    self.socket.emit(
-                        'assistant_response',
-                        {'content': fragmento_response},
-                        namespace='/test'
-                    )
-                    
-                    import time
-                    time.sleep(0.01)
+            from app.core.context_budget import context_budgeter
+            from app.core.speculative import GenerationMeter
+            from app.core.stream_emitter import StreamEmitter
+            meter = GenerationMeter(self.model)
+            emitter = StreamEmitter(self.socket)
+            with abort_on(self.model):
+                for chunk in llm_stream(
+                    self.model,
+                    self.chat_history,
+                    'llm.rag_answer',
+                    max_tokens=context_budgeter.response_budget(self.model, self.chat_history)
+                ):
+                    if is_cancelled():
+                        break
+                    if 'content' in chunk['choices'][0]['delta']:
+                        fragmento_response = chunk['choices'][0]['delta']['content']
+                        response_completa += fragmento_response
+                        total_tokens += 1
+                        meter.token()
+                        
+                        emitter.write(fragmento_response)
+            emitter.close()
             
             logger.info(f"🔍 Respuesta RAG completada con éxito - {total_tokens} tokens generados")
             print(f"🔍 Respuesta RAG completada con éxito - {total_tokens} tokens generados")
@@ -662,13 +686,23 @@ class Retriever:
                 'content': '',
                 'total_user_tokens': user_tokens,
                 'total_assistant_tokens': total_tokens,
-                'finished': True
+                'finished': True,
+                'generation_stats': meter.stats(total_tokens)
             }, namespace='/test')
             
             logger.info("🔍 Señal de finalización enviada")
             print("🔍 Señal de finalización enviada")
             
         except Exception as e:
+            if is_cancelled():
+                # llama.cpp abortó la evaluación porque el usuario paró
+                logger.info(f"Respuesta RAG cancelada: {e}")
+                self.socket.emit('assistant_response', {
+                    'content': '',
+                    'total_assistant_tokens': total_tokens,
+                    'finished': True
+                }, namespace='/test')
+                return
             logger.error(f"❌ Error en RAG response: {e}")
             print(f"❌ Error en RAG response: {e}")
             # Enviar error EXACTO como legacy - socket directo
@@ -0,0 +1,346 @@
+"""
+@Author: Borja Otero Ferreira
+Inference Scheduler - Cola de peticiones de inferencia con worker dedicado
+Sustituye al antiguo flag is_processing que descartaba las peticiones concurrentes
+"""
+import itertools
+import queue
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from app.config.settings import Config
+from app.core import cancellation
+from app.core.cancellation import CancellationToken
+from app.utils import blocking, metrics
+from app.utils.logger import logger
+
+
+@dataclass(order=True)
+class InferenceRequest:
+    """Petición encolada para el worker de inferencia"""
+    priority: int
+    sequence: int
+    job: Callable[[], Any] = field(compare=False)
+    request_id: str = field(default_factory=lambda: uuid.uuid4().hex, compare=False)
+    session_id: str = field(default='default', compare=False)
+    socket: Any = field(default=None, compare=False)
+    enqueued_at: float = field(default_factory=time.time, compare=False)
+    started_at: Optional[float] = field(default=None, compare=False)
+    finished_at: Optional[float] = field(default=None, compare=False)
+    result: Any = field(default=None, compare=False)
+    error: Optional[BaseException] = field(default=None, compare=False)
+    cancelled: bool = field(default=False, compare=False)
+    exclusive: bool = field(default=False, compare=False)
+    cancel_token: CancellationToken = field(default_factory=CancellationToken, compare=False)
+    done: threading.Event = field(default_factory=threading.Event, compare=False)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Espera a que la petición termine (o se cancele); desde el event loop no lo bloquea"""
+        return blocking.wait_event(self.done, timeout)
+
+    @property
+    def wait_time(self) -> float:
+        """Tiempo que la petición pasó en cola"""
+        end = self.started_at or time.time()
+        return end - self.enqueued_at
+
+
+class _ExclusiveGate:
+    """
+    Lock lector/escritor entre los hilos del scheduler: las peticiones normales corren en
+    paralelo y una exclusiva (p. ej. el cambio de modelo) espera a que terminen las que
+    están en curso y no deja empezar ninguna otra hasta acabar. Con una exclusiva
+    esperando no entran peticiones normales nuevas.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._shared = 0
+        self._exclusive = False
+        self._exclusive_waiting = 0
+
+    def acquire(self, exclusive: bool):
+        with self._cond:
+            if exclusive:
+                self._exclusive_waiting += 1
+                try:
+                    while self._exclusive or self._shared:
+                        self._cond.wait()
+                finally:
+                    self._exclusive_waiting -= 1
+                self._exclusive = True
+            else:
+                while self._exclusive or self._exclusive_waiting:
+                    self._cond.wait()
+                self._shared += 1
+
+    def release(self, exclusive: bool):
+        with self._cond:
+            if exclusive:
+                self._exclusive = False
+            else:
+                self._shared -= 1
+            self._cond.notify_all()
+
+
+class InferenceScheduler:
+    """
+    Cola FIFO con prioridades servida por un único worker que es el dueño del modelo.
+    Prioridad menor = se atiende antes; a igual prioridad se respeta el orden de llegada.
+    Con varios procesos de inferencia (concurrency > 1) hay un hilo por proceso y las
+    peticiones se atienden en paralelo, en el mismo orden de la cola; las exclusivas
+    (cambio de modelo) esperan a que terminen todas las que están en curso.
+    """
+
+    def __init__(self, name: str = 'inference-worker', concurrency: int = 1):
+        self._name = name
+        self.concurrency = max(1, concurrency)
+        self._queue: "queue.PriorityQueue[InferenceRequest]" = queue.PriorityQueue()
+        self._pending: List[InferenceRequest] = []
+        self._pending_lock = threading.Lock()
+        self._sequence = itertools.count()
+        self._workers: List[threading.Thread] = []
+        self._worker_lock = threading.Lock()
+        self._running: Dict[str, InferenceRequest] = {}
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._gate = _ExclusiveGate()
+
+        # Contadores de cola
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._cancelled = 0
+        self._max_depth = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._total_run = 0.0
+
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+    def submit(self, job: Callable[[], Any], session_id: str = 'default',
+               priority: int = 10, socket: Any = None,
+               cancel_token: Optional[CancellationToken] = None,
+               request_id: Optional[str] = None, exclusive: bool = False) -> InferenceRequest:
+        """
+        Encola un trabajo de inferencia
+
+        Args:
+            job: Callable sin argumentos que se ejecuta en el worker
+            session_id: Identificador de la sesión que originó la petición
+            priority: Prioridad (menor = antes)
+            socket: Socket para notificar la posición en cola
+            cancel_token: Token de la petición (el worker lo asocia a su hilo mientras la ejecuta)
+            request_id: Identificador a usar (p. ej. el del buffer de stream); por defecto uno nuevo
+            exclusive: Ejecutar sin ninguna otra petición en curso (p. ej. sustituir el modelo)
+
+        Returns:
+            InferenceRequest: Petición encolada (usar .wait() para esperar)
+        """
+        self._ensure_worker()
+        request = InferenceRequest(
+            priority=priority,
+            sequence=next(self._sequence),
+            job=job,
+            session_id=session_id or 'default',
+            socket=socket,
+            exclusive=exclusive,
+            cancel_token=cancel_token if cancel_token is not None else CancellationToken()
+        )
+        if request_id:
+            request.request_id = request_id
+        with self._pending_lock:
+            self._pending.append(request)
+            self._pending.sort()
+            self._submitted += 1
+            self._max_depth = max(self._max_depth, len(self._pending))
+        self._queue.put(request)
+        logger.info(f"Scheduler: petición {request.request_id} encolada "
+                    f"(sesión={request.session_id}, prioridad={priority}, profundidad={self.depth})")
+        self._notify_positions()
+        return request
+
+    def cancel(self, request_id: str) -> bool:
+        """Cancela una petición en cola o la que se está ejecutando"""
+        current = self._running.get(request_id)
+        if current is not None:
+            current.cancel_token.cancel('cancelled')
+            return True
+        with self._pending_lock:
+            for request in self._pending:
+                if request.request_id == request_id and not request.cancelled:
+                    request.cancelled = True
+                    request.cancel_token.cancel('cancelled')
+                    return True
+        return False
+
+    def cancel_session(self, session_id: str) -> int:
+        """Cancela todas las peticiones de una sesión (en cola y en ejecución)"""
+        count = 0
+        for current in list(self._running.values()):
+            if current.session_id == session_id and not current.cancel_token.cancelled:
+                current.cancel_token.cancel('stopped')
+                count += 1
+        with self._pending_lock:
+            for request in self._pending:
+                if request.session_id == session_id and not request.cancelled:
+                    request.cancelled = True
+                    request.cancel_token.cancel('stopped')
+                    count += 1
+        return count
+
+    @property
+    def depth(self) -> int:
+        """Número de peticiones esperando (sin contar la que está en ejecución)"""
+        with self._pending_lock:
+            return sum(1 for r in self._pending if not r.cancelled)
+
+    @property
+    def current_request(self) -> Optional[InferenceRequest]:
+        """Petición que se está ejecutando ahora mismo (la más antigua si hay varias)"""
+        return next(iter(list(self._running.values())), None)
+
+    @property
+    def running(self) -> int:
+        """Número de peticiones en ejecución"""
+        return len(self._running)
+
+    @property
+    def thread_request(self) -> Optional[InferenceRequest]:
+        """Petición que atiende el hilo actual (None fuera de los workers)"""
+        return getattr(self._local, 'request', None)
+
+    def get_position(self, request_id: str) -> Optional[int]:
+        """Posición (1-based) de una petición en la cola, 0 si se está ejecutando"""
+        if request_id in self._running:
+            return 0
+        with self._pending_lock:
+            position = 0
+            for request in self._pending:
+                if request.cancelled:
+                    continue
+                position += 1
+                if request.request_id == request_id:
+                    return position
+        return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Estadísticas de la cola"""
+        finished = self._completed + self._failed
+        current = self.current_request
+        return {
+            'queue_depth': self.depth,
+            'max_queue_depth': self._max_depth,
+            'busy': current is not None,
+            'current_session': current.session_id if current else None,
+            'running': self.running,
+            'concurrency': self.concurrency,
+            'submitted': self._submitted,
+            'completed': self._completed,
+            'failed': self._failed,
+            'cancelled': self._cancelled,
+            'avg_wait_seconds': (self._total_wait / finished) if finished else 0.0,
+            'max_wait_seconds': self._max_wait,
+            'avg_run_seconds': (self._total_run / finished) if finished else 0.0,
+        }
+
+    # ------------------------------------------------------------------
+    # Worker
+    # ------------------------------------------------------------------
+    def _ensure_worker(self):
+        """Arranca los workers la primera vez que se necesitan"""
+        with self._worker_lock:
+            self._workers = [worker for worker in self._workers if worker.is_alive()]
+            while len(self._workers) < self.concurrency:
+                name = self._name if self.concurrency == 1 else f"{self._name}-{len(self._workers)}"
+                worker = threading.Thread(target=self._run, name=name, daemon=True)
+                worker.start()
+                self._workers.append(worker)
+                logger.info(f"Scheduler: worker '{name}' iniciado")
+
+    def _run(self):
+        """Bucle principal del worker: atiende las peticiones de una en una"""
+        while True:
+            request = self._queue.get()
+            # Con varios hilos, una petición exclusiva espera a que terminen las demás; mientras
+            # espera sigue contando como pendiente (y se puede cancelar)
+            gated = not (request.cancelled or request.cancel_token.cancelled)
+            if gated:
+                self._gate.acquire(request.exclusive)
+            with self._pending_lock:
+                if request in self._pending:
+                    self._pending.remove(request)
+
+            if request.cancelled or request.cancel_token.cancelled:
+                if gated:
+                    self._gate.release(request.exclusive)
+                with self._stats_lock:
+                    self._cancelled += 1
+                metrics.inference_requests.labels('cancelled').inc()
+                request.done.set()
+                self._queue.task_done()
+                continue
+
+            self._running[request.request_id] = request
+            request.started_at = time.time()
+            wait = request.wait_time
+            with self._stats_lock:
+                self._total_wait += wait
+                self._max_wait = max(self._max_wait, wait)
+            metrics.queue_wait_seconds.observe(wait)
+            self._local.request = request
+            self._notify_positions()
+
+            try:
+                # Generación, herramientas y RAG consultan el token de la petición del hilo
+                with cancellation.bind(request.cancel_token):
+                    request.result = request.job()
+                with self._stats_lock:
+                    self._completed += 1
+                metrics.inference_requests.labels('completed').inc()
+            except BaseException as e:
+                request.error = e
+                with self._stats_lock:
+                    self._failed += 1
+                metrics.inference_requests.labels('failed').inc()
+                logger.error(f"Scheduler: error en la petición {request.request_id}: {e}")
+            finally:
+                request.finished_at = time.time()
+                with self._stats_lock:
+                    self._total_run += request.finished_at - request.started_at
+                self._running.pop(request.request_id, None)
+                self._gate.release(request.exclusive)
+                self._local.request = None
+                request.done.set()
+                self._queue.task_done()
+
+    def _notify_positions(self):
+        """Envía a cada sesión en espera su posición actual en la cola"""
+        with self._pending_lock:
+            waiting = [r for r in self._pending if not r.cancelled]
+        depth = len(waiting)
+        for position, request in enumerate(waiting, start=1):
+            if request.socket is None:
+                continue
+            try:
+                request.socket.emit('queue_status', {
+                    'request_id': request.request_id,
+                    'session_id': request.session_id,
+                    'position': position,
+                    'queue_depth': depth
+                }, namespace='/test')
+            except Exception as e:
+                logger.debug(f"Scheduler: no se pudo notificar la posición en cola: {e}")
+
+
+# Instancia global del scheduler
+# (un hilo por proceso de inferencia: el modelo local no admite generaciones en paralelo)
+inference_scheduler = InferenceScheduler(
+    concurrency=Config.INFERENCE_WORKERS if Config.INFERENCE_WORKER_ENABLED else 1
+)
+metrics.queue_depth.set_function(lambda: inference_scheduler.depth)
+metrics.inference_running.set_function(lambda: inference_scheduler.running)
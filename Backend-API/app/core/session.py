@@ -0,0 +1,145 @@
+"""
+@Author: Borja Otero Ferreira
+Session - Estado del asistente por sesión (conexión o conversación)
+Cada sesión tiene sus flags de herramientas/RAG, su token de cancelación, su historial
+y su prioridad; el modelo y el pool se comparten a través del Assistant
+"""
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from app.config.settings import Config
+from app.core.cancellation import CancellationToken
+from app.utils.logger import logger
+
+
+class AssistantSession:
+    """
+    Estado de un usuario frente al Assistant compartido.
+
+    Los agentes reciben la sesión como 'assistant' y solo consultan stop_emit,
+    que aquí depende del token de la petición en curso de esta sesión.
+    """
+
+    def __init__(self, session_id: str, assistant: Any, priority: int = 10):
+        self.session_id = session_id
+        self.assistant = assistant
+        self.priority = priority
+        self.tools = False
+        self.rag = False
+        self.history: List[Dict] = []
+        self.original_prompt: Optional[Any] = None
+        self.cancel_token = CancellationToken()
+        self.is_processing = False
+        self.requests = 0
+        self.created_at = time.time()
+        self.last_active = time.time()
+
+    @property
+    def model(self):
+        return self.assistant.model
+
+    @property
+    def stop_emit(self) -> bool:
+        return self.cancel_token.cancelled
+
+    def configure(self, tools: Optional[bool] = None, rag: Optional[bool] = None,
+                  priority: Optional[int] = None):
+        """Actualiza los flags de la sesión (solo afectan a sus propias peticiones)"""
+        if tools is not None:
+            self.tools = bool(tools)
+        if rag is not None:
+            self.rag = bool(rag)
+        if priority is not None:
+            self.priority = priority
+        self.last_active = time.time()
+
+    def begin_request(self, messages: List[Dict]) -> CancellationToken:
+        """Nuevo token de cancelación para una petición; una parada anterior no le afecta"""
+        self.cancel_token = CancellationToken()
+        self.history = messages
+        self.original_prompt = messages
+        self.requests += 1
+        self.last_active = time.time()
+        return self.cancel_token
+
+    def stop(self, reason: str = 'stopped'):
+        """Detiene la respuesta en curso de esta sesión"""
+        self.cancel_token.cancel(reason)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'session_id': self.session_id,
+            'tools': self.tools,
+            'rag': self.rag,
+            'priority': self.priority,
+            'is_processing': self.is_processing,
+            'requests': self.requests,
+            'history_messages': len(self.history),
+            'created_at': self.created_at,
+            'last_active': self.last_active,
+        }
+
+
+class SessionManager:
+    """Sesiones activas indexadas por sid o id de conversación, con expiración por inactividad"""
+
+    def __init__(self, idle_ttl_seconds: float = 3600.0):
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self._sessions: Dict[str, AssistantSession] = {}
+        self._lock = threading.Lock()
+
+    def get_or_create(self, session_id: str, assistant: Any, priority: Optional[int] = None) -> AssistantSession:
+        session_id = session_id or 'default'
+        with self._lock:
+            self._expire_idle()
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = AssistantSession(session_id, assistant, priority if priority is not None else 10)
+                self._sessions[session_id] = session
+                logger.info(f"Sesión {session_id} creada ({len(self._sessions)} activas)")
+            elif priority is not None:
+                session.priority = priority
+            return session
+
+    def get(self, session_id: str) -> Optional[AssistantSession]:
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def remove(self, session_id: str) -> bool:
+        """Detiene y olvida una sesión (p. ej. al desconectarse su cliente)"""
+        from app.core.scheduler import inference_scheduler
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        inference_scheduler.cancel_session(session_id)
+        if session is not None:
+            session.stop('closed')
+            return True
+        return False
+
+    def stop(self, session_id: str) -> bool:
+        """Detiene la respuesta de una sesión y cancela sus peticiones en cola"""
+        from app.core.scheduler import inference_scheduler
+        session = self.get(session_id)
+        inference_scheduler.cancel_session(session_id)
+        if session is None:
+            return False
+        session.stop()
+        return True
+
+    def get_sessions(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [session.to_dict() for session in self._sessions.values()]
+
+    def _expire_idle(self):
+        """Elimina sesiones inactivas (llamar con el lock adquirido)"""
+        if self.idle_ttl_seconds <= 0:
+            return
+        limit = time.time() - self.idle_ttl_seconds
+        for session_id in [sid for sid, s in self._sessions.items()
+                           if s.last_active < limit and not s.is_processing]:
+            del self._sessions[session_id]
+
+
+# Instancia global del gestor de sesiones
+session_manager = SessionManager(Config.SESSION_IDLE_TTL_SECONDS)
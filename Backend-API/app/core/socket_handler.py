@@ -4,8 +4,10 @@ Socket Response Handler - Clase centralizada para el envío de respuestas al fro
 """
 import traceback
 from app.utils.logger import logger
+from app.core.conversation_store import replace_message
 # Importar el proveedor de instancias socketio
 from app.utils import socket_instance
+from app.utils import metrics
 
 class SocketResponseHandler:
     """
@@ -54,7 +56,7 @@ class SocketResponseHandler:
         socket.emit('assistant_response', response_data, namespace='/test')
     
     @staticmethod
-    def emit_finalization_signal(socket, total_user_tokens=0, total_assistant_tokens=0):
+    def emit_finalization_signal(socket, total_user_tokens=0, total_assistant_tokens=0, stats=None):
         """
         Emite la señal de finalización al frontend
         
@@ -62,13 +64,19 @@ class SocketResponseHandler:
             socket: Instancia del socket para enviar la respuesta
             total_user_tokens (int): Total de tokens del usuario
             total_assistant_tokens (int): Total de tokens del asistente
+            stats (dict, optional): Estadísticas de generación (tokens/s, aceptación del borrador);
+                por defecto las de la última respuesta generada en este hilo
         """
+        from app.core.speculative import pop_generation_stats
+        stats = stats if stats is not None else pop_generation_stats()
         finalization_data = {
             'content': '',
             'total_user_tokens': total_user_tokens,
             'total_assistant_tokens': total_assistant_tokens,
             'finished': True
         }
+        if stats:
+            finalization_data['generation_stats'] = stats
         
         socket.emit('assistant_response', finalization_data, namespace='/test')
     
@@ -147,10 +155,10 @@ class SocketResponseHandler:
         socket.emit('utilidades', data, namespace='/test')
     
     @staticmethod
-    def stream_chat_completion(model, messages, socket, max_tokens=8192, 
+    def stream_chat_completion(model, messages, socket, max_tokens=None, 
                               user_tokens=None, process_line_breaks=False, 
                               response_queue=None, link_remover_func=None, 
-                              stop_condition=None):
+                              stop_condition=None, sampling=None, prompt_tokens=None):
         """
         Maneja el streaming de completions de chat de forma unificada
         
@@ -158,20 +166,26 @@ class SocketResponseHandler:
             model: Instancia del modelo para hacer la completion
             messages: Lista de mensajes para la completion
             socket: Instancia del socket para enviar la respuesta
-            max_tokens (int): Máximo número de tokens para la respuesta
+            max_tokens (int, optional): Máximo número de tokens para la respuesta; si no se indica,
+                se ajustan los mensajes al contexto y se usa todo el espacio restante
             user_tokens (int, optional): Tokens del usuario (se envían al inicio)
             process_line_breaks (bool): Si procesar saltos de línea individualmente
             response_queue (queue.Queue, optional): Cola para almacenar líneas procesadas
             link_remover_func (callable, optional): Función para eliminar enlaces de las líneas
             stop_condition (callable, optional): Función que retorna True para detener el streaming
+            sampling (dict, optional): temperature / top_p / stop pedidos por el cliente
+            prompt_tokens (int, optional): Tokens del prompt ya contados (para la traza)
             
         Returns:
             tuple: (response_completa, total_assistant_tokens)
         """
-        import time
+        from app.core.stream_emitter import StreamEmitter
+        from app.core.cancellation import abort_on, is_cancelled
+        from app.utils.tracing import llm_stream
         
         response_completa = ""
         total_assistant_tokens = 0
+        finish_reason = None
         linea = ""
         
         # Enviar tokens del usuario al inicio de la respuesta
@@ -182,22 +196,38 @@ class SocketResponseHandler:
                 user_tokens=user_tokens,
                 finished=False
             )
-        # Añadir '/no_think' al final del último prompt de usuario
+        if max_tokens is None:
+            from app.core.context_budget import context_budgeter
+            budget = context_budgeter.fit(model, messages)
+            messages, max_tokens, prompt_tokens = budget.messages, budget.max_tokens, budget.prompt_tokens
+        # Añadir '/no_think' al final del último prompt de usuario (en una copia: el
+        # historial de la conversación se comparte y no se modifica)
         if messages and isinstance(messages, list):
-            for msg in reversed(messages):
+            for index in range(len(messages) - 1, -1, -1):
+                msg = messages[index]
                 if isinstance(msg, dict) and msg.get('role') == 'user' and 'content' in msg:
-                    msg['content'] = f"{msg['content'].rstrip()} /no_think"
+                    messages = replace_message(messages, index, content=f"{msg['content'].rstrip()} /no_think")
                     break
+        from app.core.speculative import GenerationMeter, record_generation_stats
+        meter = GenerationMeter(model)
+        # Los fragmentos se agrupan por ventana de tiempo/tamaño en lugar de un emit por token
+        emitter = StreamEmitter(socket)
         try:
-            for chunk in model.create_chat_completion(messages=messages, max_tokens=max_tokens, stream=True):
-                if 'content' in chunk['choices'][0]['delta']:
-                    # Verificar condición de parada si se proporciona
-                    if stop_condition and stop_condition():
+            # Con la petición cancelada llama.cpp aborta entre batches, también durante el prompt
+            with abort_on(model):
+                for chunk in llm_stream(model, messages, 'llm.answer', prompt_tokens=prompt_tokens,
+                                        max_tokens=max_tokens, **(sampling or {})):
+                    # Verificar la parada en cada chunk, no solo cuando llega contenido
+                    if (stop_condition and stop_condition()) or is_cancelled():
                         break
+                    finish_reason = chunk['choices'][0].get('finish_reason') or finish_reason
+                    if 'content' not in chunk['choices'][0]['delta']:
+                        continue
                         
                     fragmento_response = chunk['choices'][0]['delta']['content']
                     response_completa += fragmento_response
                     total_assistant_tokens += 1
+                    meter.token()
                     
                     # Procesar saltos de línea si se requiere
                     if process_line_breaks and response_queue is not None:
@@ -211,14 +241,9 @@ class SocketResponseHandler:
                                 linea = ''
                     
                     # Enviar respuesta al frontend
-                    SocketResponseHandler.emit_streaming_response(
-                        socket,
-                        fragmento_response,
-                        assistant_token_count=1,  # Un token por chunk
-                        finished=False
-                    )
-                    time.sleep(0.01)
+                    emitter.write(fragmento_response)
             
+            emitter.close()
             # Procesar línea final si hay contenido restante
             if process_line_breaks and linea and response_queue is not None:
                 if link_remover_func:
@@ -226,12 +251,36 @@ class SocketResponseHandler:
                 if linea.strip():
                     response_queue.put(linea.strip())
             
+            stats = meter.stats(total_assistant_tokens)
+            stats['finish_reason'] = finish_reason
+            if prompt_tokens is not None:
+                stats['prompt_tokens'] = prompt_tokens  # Prompt enviado, ya ajustado al contexto
+            record_generation_stats(stats)
+            stopped = (stop_condition and stop_condition()) or is_cancelled()
+            metrics.record_generation(stats, 'cancelled' if stopped else 'completed',
+                                      SocketResponseHandler._queue_wait())
             return response_completa, total_assistant_tokens
             
         except Exception as e:
-            print(f"Error en stream_chat_completion: {e}")
+            cancelled = is_cancelled() or (stop_condition and stop_condition())
+            if cancelled:
+                logger.info(f"stream_chat_completion cancelado: {e}")
+            else:
+                print(f"Error en stream_chat_completion: {e}")
+            emitter.close()
+            stats = meter.stats(total_assistant_tokens)
+            record_generation_stats(stats)
+            metrics.record_generation(stats, 'cancelled' if cancelled else 'error',
+                                      SocketResponseHandler._queue_wait())
             return response_completa, total_assistant_tokens
     
+    @staticmethod
+    def _queue_wait():
+        """Espera en cola de la petición que atiende este hilo (para el tiempo hasta el primer token)"""
+        from app.core.scheduler import inference_scheduler
+        request = inference_scheduler.thread_request
+        return request.wait_time if request is not None else None
+    
     @staticmethod
     def send_to_console(message, socket):
         """
@@ -0,0 +1,156 @@
+"""
+@Author: Borja Otero Ferreira
+Speculative Decoding - Modos de borrador para acelerar la generación en CPU
+- prompt_lookup: propone n-gramas copiados del propio contexto (RAG, resúmenes de herramientas)
+- draft_model: un GGUF pequeño con el mismo vocabulario propone los siguientes tokens
+"""
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from app.utils.logger import logger
+
+try:
+    from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+    SPECULATIVE_AVAILABLE = True
+except ImportError:  # llama-cpp-python antiguo (requirements.txt fija una versión con borrador)
+    LlamaDraftModel = object
+    LlamaPromptLookupDecoding = None
+    SPECULATIVE_AVAILABLE = False
+
+DRAFT_MODES = ('none', 'prompt_lookup', 'draft_model')
+DEFAULT_NUM_PRED_TOKENS = {'prompt_lookup': 10, 'draft_model': 8}
+
+
+class GGUFDraftModel(LlamaDraftModel):
+    """Borrador basado en un modelo GGUF pequeño (decodificación voraz)"""
+
+    def __init__(self, model: Any, num_pred_tokens: int = 8):
+        self.model = model
+        self.num_pred_tokens = num_pred_tokens
+
+    def __call__(self, input_ids, **kwargs):
+        import numpy as np
+        draft = []
+        # generate() reutiliza el prefijo común con la llamada anterior
+        for token in self.model.generate(input_ids.tolist(), top_k=1, temp=0.0, reset=True):
+            draft.append(token)
+            if len(draft) >= self.num_pred_tokens:
+                break
+        return np.array(draft, dtype=np.intc)
+
+
+class CountingDraftModel(LlamaDraftModel):
+    """Envuelve un borrador y cuenta llamadas y tokens propuestos para medir la aceptación"""
+
+    def __init__(self, inner: Any, mode: str):
+        self.inner = inner
+        self.mode = mode
+        self.calls = 0
+        self.proposed = 0
+
+    def __call__(self, input_ids, **kwargs):
+        draft = self.inner(input_ids, **kwargs)
+        self.calls += 1
+        self.proposed += len(draft)
+        return draft
+
+
+def build_draft_model(mode: str, num_pred_tokens: Optional[int] = None, draft_model_path: Optional[str] = None,
+                      model_factory=None) -> Optional[CountingDraftModel]:
+    """
+    Construye el borrador para un modo dado
+
+    Args:
+        mode: 'none', 'prompt_lookup' o 'draft_model'
+        num_pred_tokens: Tokens propuestos por paso
+        draft_model_path: Ruta del GGUF de borrador (modo draft_model)
+        model_factory: Callable(path) que carga el GGUF de borrador
+
+    Returns:
+        CountingDraftModel o None si no se usa borrador
+    """
+    if not mode or mode == 'none':
+        return None
+    if mode not in DRAFT_MODES:
+        raise ValueError(f"Modo de borrador desconocido: {mode}")
+    if not SPECULATIVE_AVAILABLE:
+        raise ValueError(f"El modo de borrador '{mode}' necesita llama-cpp-python >= 0.3 (llama_speculative); "
+                         f"instala la versión de requirements.txt o usa draft_mode=none")
+
+    num_pred_tokens = num_pred_tokens or DEFAULT_NUM_PRED_TOKENS[mode]
+    if mode == 'prompt_lookup':
+        inner = LlamaPromptLookupDecoding(num_pred_tokens=num_pred_tokens)
+    else:
+        if not draft_model_path or model_factory is None:
+            raise ValueError("El modo draft_model necesita draft_model_path")
+        inner = GGUFDraftModel(model_factory(draft_model_path), num_pred_tokens=num_pred_tokens)
+    logger.info(f"Decodificación especulativa: {mode} ({num_pred_tokens} tokens por paso)")
+    return CountingDraftModel(inner, mode)
+
+
+def check_vocab(model: Any, draft: Optional[CountingDraftModel]):
+    """El modelo de borrador debe compartir vocabulario con el principal"""
+    if draft is None or not isinstance(draft.inner, GGUFDraftModel):
+        return
+    try:
+        if model.n_vocab() != draft.inner.model.n_vocab():
+            raise ValueError("El modelo de borrador no comparte vocabulario con el modelo principal")
+    except AttributeError:
+        pass
+
+
+class GenerationMeter:
+    """Mide velocidad y aceptación del borrador durante una respuesta"""
+
+    def __init__(self, model: Any):
+        self.draft = getattr(model, 'draft_model', None)
+        if not isinstance(self.draft, CountingDraftModel):
+            self.draft = None
+        self.started_at = time.time()
+        self.first_token_at: Optional[float] = None
+        self._calls = self.draft.calls if self.draft else 0
+        self._proposed = self.draft.proposed if self.draft else 0
+
+    def token(self):
+        """Registrar la llegada de un token"""
+        if self.first_token_at is None:
+            self.first_token_at = time.time()
+
+    def stats(self, generated_tokens: int) -> Dict[str, Any]:
+        end = time.time()
+        decode_start = self.first_token_at or end
+        decode_seconds = end - decode_start
+        stats = {
+            'generated_tokens': generated_tokens,
+            'total_seconds': round(end - self.started_at, 3),
+            'time_to_first_token': round(decode_start - self.started_at, 3),
+            'tokens_per_second': round((generated_tokens - 1) / decode_seconds, 2)
+            if generated_tokens > 1 and decode_seconds > 0 else 0.0,
+            'draft_mode': self.draft.mode if self.draft else 'none',
+        }
+        if self.draft:
+            calls = self.draft.calls - self._calls
+            proposed = self.draft.proposed - self._proposed
+            # Cada paso de verificación genera un token propio más los aceptados del borrador
+            accepted = max(generated_tokens - calls, 0)
+            stats.update({
+                'draft_proposed': proposed,
+                'draft_accepted': accepted,
+                'acceptance_rate': round(accepted / proposed, 3) if proposed else 0.0,
+            })
+        return stats
+
+
+# Estadísticas de la última respuesta generada en cada hilo
+_last_stats = threading.local()
+
+
+def record_generation_stats(stats: Dict[str, Any]):
+    _last_stats.value = stats
+
+
+def pop_generation_stats() -> Optional[Dict[str, Any]]:
+    stats = getattr(_last_stats, 'value', None)
+    _last_stats.value = None
+    return stats
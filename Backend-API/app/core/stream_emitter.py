@@ -0,0 +1,157 @@
+"""
+@Author: Borja Otero Ferreira
+Stream Emitter - Envío de tokens por socket agrupados por ventana de tiempo o tamaño
+Sustituye el emit por token + sleep: los fragmentos se acumulan y se envían cuando
+pasa la ventana (p. ej. 30 ms) o se supera el umbral de bytes (p. ej. 256 B)
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.config.settings import Config
+from app.utils.logger import logger
+
+# Límites aceptados para la cadencia pedida por un cliente
+MIN_FLUSH_MS, MAX_FLUSH_MS = 0, 1000
+MIN_FLUSH_BYTES, MAX_FLUSH_BYTES = 1, 64 * 1024
+
+
+class StreamSettingsRegistry:
+    """
+    Cadencia de envío por cliente (sid del socket o session_id).
+
+    El cliente la fija con el evento 'stream_settings'; el hilo que genera una respuesta
+    asocia su cliente con bind() para que los emisores que cree la usen.
+    """
+
+    def __init__(self):
+        self._settings: Dict[str, Tuple[float, int]] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def set(self, client_id: str, flush_ms: Optional[float] = None,
+            flush_bytes: Optional[int] = None) -> Dict[str, Any]:
+        """Guarda la cadencia de un cliente (los valores se acotan a límites razonables)"""
+        interval, size = self.get(client_id)
+        if flush_ms is not None:
+            interval = min(max(float(flush_ms), MIN_FLUSH_MS), MAX_FLUSH_MS) / 1000.0
+        if flush_bytes is not None:
+            size = min(max(int(flush_bytes), MIN_FLUSH_BYTES), MAX_FLUSH_BYTES)
+        with self._lock:
+            self._settings[client_id] = (interval, size)
+        return {'flush_ms': round(interval * 1000, 3), 'flush_bytes': size}
+
+    def get(self, *client_ids: Optional[str]) -> Tuple[float, int]:
+        """(intervalo en segundos, bytes) del primer cliente con cadencia propia, de la sesión asociada al hilo o por defecto"""
+        with self._lock:
+            for key in client_ids + (self.current(),):
+                if key and key in self._settings:
+                    return self._settings[key]
+        return Config.STREAM_FLUSH_MS / 1000.0, Config.STREAM_FLUSH_BYTES
+
+    def remove(self, client_id: str):
+        with self._lock:
+            self._settings.pop(client_id, None)
+
+    @contextmanager
+    def bind(self, client_id: Optional[str]):
+        """Asocia el hilo actual a un cliente mientras genera su respuesta"""
+        previous = getattr(self._local, 'client_id', None)
+        self._local.client_id = client_id
+        try:
+            yield
+        finally:
+            self._local.client_id = previous
+
+    def current(self) -> Optional[str]:
+        return getattr(self._local, 'client_id', None)
+
+
+class StreamEmitter:
+    """
+    Acumula fragmentos de una respuesta y los envía agrupados.
+
+    Se envía en cuanto ha pasado el intervalo desde el último envío (el primer token
+    tras una pausa sale sin espera) o cuando el buffer alcanza el umbral de bytes.
+    close() envía lo pendiente. Pensado para un único productor por emisor.
+    """
+
+    def __init__(self, socket, event: str = 'assistant_response', namespace: str = '/test',
+                 client_id: Optional[str] = None, flush_ms: Optional[float] = None,
+                 flush_bytes: Optional[int] = None,
+                 payload: Optional[Callable[[str, int], Dict[str, Any]]] = None):
+        """
+        Args:
+            socket: Objeto con emit(event, data, namespace=...)
+            event: Evento a emitir
+            namespace: Namespace de Socket.IO
+            client_id: Sesión cuya cadencia se usa si el socket no tiene una propia
+            flush_ms/flush_bytes: Cadencia explícita (tiene prioridad sobre la del cliente)
+            payload: Callable(texto, tokens) que construye los datos de cada envío
+        """
+        self.socket = socket
+        self.event = event
+        self.namespace = namespace
+        interval, size = stream_settings.get(getattr(socket, 'client_id', None), client_id)
+        self.interval = flush_ms / 1000.0 if flush_ms is not None else interval
+        self.flush_bytes = flush_bytes if flush_bytes is not None else size
+        self.payload = payload or self._default_payload
+        self._parts = []
+        self._bytes = 0
+        self._tokens = 0
+        self._last_flush = 0.0
+        self.frames = 0
+        self.closed = False
+
+    def write(self, text: str, tokens: int = 1):
+        """Añade un fragmento; se envía si toca por tiempo o tamaño"""
+        if self.closed:
+            return
+        if text:
+            self._parts.append(text)
+            self._bytes += len(text.encode('utf-8'))
+        self._tokens += tokens
+        if self._bytes >= self.flush_bytes or time.monotonic() - self._last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """Envía lo acumulado"""
+        if not self._parts and not self._tokens:
+            return
+        text = ''.join(self._parts)
+        tokens = self._tokens
+        self._parts = []
+        self._bytes = 0
+        self._tokens = 0
+        self._last_flush = time.monotonic()
+        try:
+            self.socket.emit(self.event, self.payload(text, tokens), namespace=self.namespace)
+            self.frames += 1
+        except Exception as e:
+            logger.error(f"Error emitiendo '{self.event}': {e}")
+
+    def close(self):
+        """Envía lo pendiente; el emisor deja de aceptar fragmentos"""
+        if not self.closed:
+            self.flush()
+            self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    @staticmethod
+    def _default_payload(text: str, tokens: int) -> Dict[str, Any]:
+        return {
+            'content': text,
+            'finished': False,
+            'assistant_token_count': tokens
+        }
+
+
+# Cadencia de envío por cliente
+stream_settings = StreamSettingsRegistry()
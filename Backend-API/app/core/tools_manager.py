@@ -4,6 +4,7 @@ Tools Manager - Gestiona la selección y estado de herramientas para el asistent
 """
 
 from typing import List, Dict, Any, Optional
+from contextlib import contextmanager
 import threading
 from enum import Enum
 from app.utils.logger import logger
@@ -29,6 +30,7 @@ class ToolsManager:
             self._selected_tools: List[str] = []
             self._available_tools: Dict[str, Dict[str, Any]] = {}
             self._tools_enabled: bool = False
+            self._session_local = threading.local()  # Flag de la sesión que se atiende en este hilo
             self._registry = None
             self._initialized = True
             logger.info("Tools manager initialized with assistant service")
@@ -73,8 +75,19 @@ class ToolsManager:
         logger.info(f"ToolsManager: Tools {'habilitado' if enabled else 'deshabilitado'}")
     
     def is_tools_enabled(self) -> bool:
-        """Verificar si las herramientas están habilitadas"""
-        return self._tools_enabled
+        """Verificar si las herramientas están habilitadas (para la sesión de este hilo si la hay)"""
+        enabled = getattr(self._session_local, 'tools_enabled', None)
+        return self._tools_enabled if enabled is None else enabled
+    
+    @contextmanager
+    def session_override(self, enabled: bool):
+        """Usar el flag de herramientas de una sesión en el hilo actual sin tocar el global"""
+        previous = getattr(self._session_local, 'tools_enabled', None)
+        self._session_local.tools_enabled = enabled
+        try:
+            yield
+        finally:
+            self._session_local.tools_enabled = previous
     
     def set_selected_tools(self, tool_names: List[str]):
         """Establecer las herramientas seleccionadas"""
@@ -103,7 +116,7 @@ class ToolsManager:
     
     def get_active_tools(self) -> List[str]:
         """Obtener herramientas que están habilitadas Y seleccionadas Y disponibles"""
-        if not self._tools_enabled:
+        if not self.is_tools_enabled():
             return []
             
         # Filtrar las herramientas que están seleccionadas y disponibles
@@ -116,7 +129,7 @@ class ToolsManager:
     
     def is_tool_active(self, tool_name: str) -> bool:
         """Verificar si una herramienta específica está activa"""
-        return (self._tools_enabled and 
+        return (self.is_tools_enabled() and 
                 tool_name in self._selected_tools and 
                 tool_name in self._available_tools and 
                 self._available_tools[tool_name]["available"])
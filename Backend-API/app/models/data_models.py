@@ -41,6 +41,12 @@ class ModelConfig:
     context_size: int = 8192
     system_message: str = ""
     chat_format: str = "chatml"
+    draft_mode: str = "none"                  # none | prompt_lookup | draft_model
+    draft_model_path: Optional[str] = None    # GGUF de borrador para draft_model
+    draft_num_pred_tokens: Optional[int] = None
+    autotune: Optional[str] = None            # off | auto | retune (None = Config.AUTOTUNE_MODE)
+    kv_type: Optional[str] = None             # f16 | q8_0 | q4_0 (None = Config.DEFAULT_KV_CACHE_TYPE)
+    flash_attn: Optional[bool] = None         # None = Config.DEFAULT_FLASH_ATTN
 
 @dataclass
 class UserInput:
@@ -48,6 +54,12 @@ class UserInput:
     content: Any
     tools: Optional[bool] = False  # Boolean flag for tools usage
     rag: Optional[bool] = False    # Boolean flag for RAG usage
+    session_id: Optional[str] = None  # Session that owns the request (queue bookkeeping)
+    priority: int = 10             # Scheduler priority (lower = served first)
+    sid: Optional[str] = None      # Socket.IO sid that receives the stream
+    room: Optional[str] = None     # Conversation room that receives the stream (takes precedence over sid)
+    conversation_id: Optional[str] = None  # Server-side conversation (content is then only the new message)
+    version: Optional[int] = None  # Conversation version the client last saw
     timestamp: datetime = None
     
     def __post_init__(self):
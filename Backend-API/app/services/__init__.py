@@ -6,9 +6,11 @@ Capa de servicios que integra los componentes core
 from .assistant_service import AssistantService, assistant_service
 from .model_service import ModelService, model_service 
 from .chat_service import ChatService, chat_service
+from .openai_service import OpenAIService, openai_service
 
 __all__ = [
     'AssistantService', 'assistant_service',
     'ModelService', 'model_service',
-    'ChatService', 'chat_service'
+    'ChatService', 'chat_service',
+    'OpenAIService', 'openai_service'
 ]
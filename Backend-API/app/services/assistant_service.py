@@ -3,15 +3,22 @@
 Assistant service for IALab Suite API
 Migrado completamente a la arquitectura modular
 """
+import os
+import threading
+import uuid
 from typing import Optional, List, Dict, Any
 from app.core.assistant import Assistant
 from app.core.rag import Retriever
 from app.core.socket_handler import SocketResponseHandler
+from app.core.session import session_manager
+from app.core.conversation_store import conversation_store, ConversationVersionError
+from app.utils.stream_buffer import stream_buffers
 from app.models.data_models import ModelConfig, UserInput, ApiResponse
 from app.utils.logger import logger
 from app.config.settings import Config
 # Importar el proveedor de instancias socketio
 from app.utils import socket_instance
+from app.utils import blocking
 
 class AssistantService:
     """Service layer for Assistant operations"""
@@ -58,8 +65,13 @@ class AssistantService:
         """Check if assistant is ready"""
         return self._is_initialized and self._assistant is not None
     
-    def load_model(self, config: ModelConfig) -> ApiResponse:
-        """Load a model with given configuration"""
+    def load_model(self, config: ModelConfig, wait: bool = True) -> ApiResponse:
+        """
+        Load a model with given configuration
+        
+        The load runs as a background job; the current model keeps answering until
+        the new one is swapped in. With wait=False the job is returned immediately.
+        """
         try:
             if not self.is_ready():
                 if not self.initialize():
@@ -69,18 +81,23 @@ class AssistantService:
                         error="Assistant initialization failed"
                     )
             
-            # Unload existing model first
-            self.unload_model()
-            
-            # Load new model using the correct parameter order
-            self._assistant.load_model(
-                model_path=config.path,
-                new_temperature=config.temperature,
-                n_gpu_layer=config.gpu_layers,
-                new_system_message=config.system_message,
-                context=config.context_size,
-                max_response_tokens=config.context_size
-            )
+            job = self.start_model_load(config)
+            
+            if not wait:
+                return ApiResponse(
+                    success=True,
+                    message="Model load started",
+                    data=job.to_dict()
+                )
+            
+            job.wait()
+            if job.status != 'ready':
+                return ApiResponse(
+                    success=False,
+                    message="Failed to load model",
+                    data=job.to_dict(),
+                    error=job.error
+                )
             
             logger.info(f"Model loaded: {config.path}")
             
@@ -92,7 +109,9 @@ class AssistantService:
                     'temperature': config.temperature,
                     'gpu_layers': config.gpu_layers,
                     'context_size': config.context_size,
-                    'system_message': config.system_message
+                    'system_message': config.system_message,
+                    'draft_mode': config.draft_mode,
+                    'job_id': job.job_id
                 }
             )
             
@@ -104,11 +123,110 @@ class AssistantService:
                 error=str(e)
             )
     
+    def start_model_load(self, config: ModelConfig):
+        """Start a background load job that hot-swaps the model once it is ready"""
+        from app.core.model_loader import model_load_manager
+        from app.core.scheduler import inference_scheduler
+        
+        assistant = self._assistant
+        
+        def build():
+            return assistant.create_model(
+                config.path,
+                config.gpu_layers,
+                config.context_size,
+                draft_mode=config.draft_mode,
+                draft_model_path=config.draft_model_path,
+                draft_num_pred_tokens=config.draft_num_pred_tokens,
+                autotune=config.autotune,
+                kv_type=config.kv_type,
+                flash_attn=config.flash_attn,
+                temperature=config.temperature
+            )
+        
+        def swap(model):
+            # El cambio pasa por el scheduler para no sustituir el modelo en mitad de una respuesta
+            # (exclusivo: con varios workers espera a que terminen todas las generaciones en curso)
+            request = inference_scheduler.submit(
+                lambda: assistant.activate_model(
+                    model,
+                    model_path=config.path,
+                    new_temperature=config.temperature,
+                    n_gpu_layer=config.gpu_layers,
+                    new_system_message=config.system_message,
+                    context=config.context_size,
+                    max_response_tokens=config.context_size
+                ),
+                session_id='system',
+                priority=0,
+                exclusive=True
+            )
+            request.wait()
+            if request.error:
+                raise request.error
+        
+        return model_load_manager.start(
+            config.path,
+            build,
+            swap,
+            options={
+                'temperature': config.temperature,
+                'gpu_layers': config.gpu_layers,
+                'context_size': config.context_size,
+                'draft_mode': config.draft_mode,
+                'draft_model_path': config.draft_model_path,
+                'draft_num_pred_tokens': config.draft_num_pred_tokens,
+                'autotune': config.autotune,
+                'kv_type': config.kv_type,
+                'flash_attn': config.flash_attn
+            }
+        )
+    
+    def plan_model_load(self, config: ModelConfig):
+        """Estimate the memory a load would need and the largest safe context"""
+        from app.core.memory_planner import memory_planner
+        from app.core.model_pool import model_pool
+        from app.core.batch_engine import batch_engine_manager
+        kv_type = config.kv_type or Config.DEFAULT_KV_CACHE_TYPE
+        flash_attn = Config.DEFAULT_FLASH_ATTN if config.flash_attn is None else config.flash_attn
+        extra_bytes = 0
+        if config.draft_mode == 'draft_model' and config.draft_model_path:
+            try:
+                extra_bytes = os.path.getsize(config.draft_model_path)
+            except OSError as e:
+                raise ValueError(f"Invalid draft model path or file does not exist: {config.draft_model_path}") from e
+        batch_slots, batch_slot_ctx = batch_engine_manager.planned_slots()
+        plan = memory_planner.plan(
+            config.path,
+            config.context_size,
+            kv_type=kv_type,
+            flash_attn=flash_attn,
+            gpu_layers=config.gpu_layers,
+            extra_bytes=extra_bytes,
+            reclaimable_bytes=model_pool.reclaimable_bytes(),
+            replicas=Config.INFERENCE_WORKERS if Config.INFERENCE_WORKER_ENABLED else 1,
+            batch_slots=batch_slots,
+            batch_slot_ctx=batch_slot_ctx
+        )
+        variant = Assistant.pool_variant(config.draft_mode, config.draft_num_pred_tokens,
+                                         config.draft_model_path, kv_type, flash_attn)
+        plan.resident = model_pool.get(config.path, config.context_size, config.gpu_layers, variant) is not None
+        return plan
+    
+    def get_load_status(self, job_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Get a load job by id, or the recent jobs when no id is given"""
+        from app.core.model_loader import model_load_manager
+        if job_id:
+            job = model_load_manager.get_job(job_id)
+            return job.to_dict() if job else None
+        return {'jobs': [job.to_dict() for job in model_load_manager.get_jobs()]}
+    
     def unload_model(self) -> ApiResponse:
         """Unload the current model"""
         try:
             if self.is_ready() and self._assistant:
-                self._assistant.unload_model()
+                # Liberar el modelo (y su memoria) sin detener el event loop
+                blocking.run_blocking(self._assistant.unload_model)
                 logger.info("Model unloaded")
                 
             return ApiResponse(
@@ -139,24 +257,61 @@ class AssistantService:
             tools_value = bool(user_input.tools) if user_input.tools is not None else False
             rag_value = bool(user_input.rag) if user_input.rag is not None else False
             
-            self._assistant.set_tools(tools_value)
-            self._assistant.set_rag(rag_value)
-            logger.info(f"Tools configurado como: {tools_value}")
-            print(f"🔧 Tools configurado como: {tools_value}")
-            logger.info(f"RAG configurado como: {rag_value}")
-            print(f"🔧 RAG configurado como: {rag_value}")
+            # Los flags son de la sesión: no afectan a las peticiones de otros usuarios
+            session = session_manager.get_or_create(
+                user_input.session_id or user_input.sid or 'default',
+                self._assistant,
+                priority=user_input.priority
+            )
+            session.configure(tools=tools_value, rag=rag_value)
+            logger.info(f"Sesión {session.session_id}: tools={tools_value}, rag={rag_value}")
+            print(f"🔧 Sesión {session.session_id}: tools={tools_value}, rag={rag_value}")
+            
+            # Conversación guardada en el servidor: el cliente envía solo el mensaje nuevo
+            content, recorder = user_input.content, None
+            if user_input.conversation_id:
+                content, version = self._conversation_turn(user_input)
+                recorder = conversation_store.recorder(user_input.conversation_id, version, session)
             
             # Process the input using the legacy assistant method
-            logger.info(f"Processing user input: {user_input.content}")
-            self._assistant.add_user_input(user_input.content, socketio)
+            logger.info(f"Processing user input: {content[-1] if isinstance(content, list) and content else content}")
+            # Solo el cliente (o la conversación) que pregunta recibe el stream
+            # Los frames de la respuesta se numeran y guardan para poder reanudar el stream
+            ring = stream_buffers.create(uuid.uuid4().hex, session.session_id, user_input.sid)
+            channel = socket_instance.client_channel(socketio, sid=user_input.sid, room=user_input.room,
+                                                     ring=ring, recorder=recorder)
+            if channel.to is None:
+                logger.warning("User input without sid or conversation room: streaming to all clients")
+            request = self._assistant.add_user_input(
+                content,
+                channel,
+                session_id=session.session_id,
+                priority=session.priority,
+                session=session
+            )
             
             logger.info("User input processed successfully")
             
+            data = {
+                'request_id': request.request_id,
+                'wait_seconds': request.wait_time
+            } if request else {}
+            if recorder is not None:
+                data.update(conversation_id=recorder.conversation_id, version=recorder.version)
             return ApiResponse(
                 success=True,
-                message="User input processed successfully"
+                message="User input processed successfully",
+                data=data or None
             )
             
+        except ConversationVersionError as e:
+            logger.info(str(e))
+            return ApiResponse(
+                success=False,
+                message="Conversation version conflict",
+                data={'conversation_id': e.conversation_id, 'version': e.current, 'conflict': True},
+                error=str(e)
+            )
         except Exception as e:
             logger.error(f"Error processing user input: {e}")
             return ApiResponse(
@@ -167,12 +322,181 @@ class AssistantService:
     
 
     
-    def stop_response(self) -> ApiResponse:
-        """Stop the current response generation"""
+    def _conversation_turn(self, user_input: UserInput):
+        """
+        Add the turn to the server-side conversation
+        
+        A list replaces the whole history (first turn or resync); anything else is
+        the new user message and requires the client's current version.
+        
+        Returns:
+            tuple: (full history for the model, new version)
+        """
+        if isinstance(user_input.content, list):
+            return conversation_store.replace(user_input.conversation_id, user_input.content)
+        return conversation_store.append_user(user_input.conversation_id, user_input.content,
+                                              user_input.version)
+    
+    def get_conversation(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """Server-side history and version of a conversation (for client resync)"""
+        conversation = conversation_store.get(conversation_id)
+        return conversation.to_dict(include_messages=True) if conversation else None
+    
+    def delete_conversation(self, conversation_id: str) -> bool:
+        """Forget a server-side conversation"""
+        return conversation_store.remove(conversation_id)
+    
+    def get_model(self):
+        """Currently active model instance (None if no model is loaded)"""
+        return self._assistant.model if self.is_ready() else None
+    
+    def get_loaded_model_path(self) -> Optional[str]:
+        """Path of the currently active model"""
+        if not self.is_ready() or self._assistant.model is None:
+            return None
+        return getattr(self._assistant, 'model_path', None)
+    
+    def submit_completion(self, messages: List[Dict], channel, session_id: str, priority: int = 10,
+                          generation: Optional[Dict[str, Any]] = None):
+        """
+        Queue a plain chat completion (no tools/RAG) for an API client
+        
+        The request goes through the same scheduler, batch engine and KV caches
+        as the web UI; frames are emitted to the given channel. generation holds
+        the client's max_tokens / temperature / top_p / stop.
+        
+        Returns:
+            AssistantSession: Session of the request (stop it to cancel)
+        """
+        session = session_manager.get_or_create(session_id, self._assistant, priority=priority)
+        session.configure(tools=False, rag=False)
+        self._assistant.add_user_input(
+            messages,
+            channel,
+            session_id=session.session_id,
+            priority=session.priority,
+            wait=False,
+            session=session,
+            generation=generation
+        )
+        return session
+    
+    def get_queue_stats(self) -> Dict[str, Any]:
+        """Get inference queue depth and wait-time counters"""
+        from app.core.scheduler import inference_scheduler
+        from app.core.batch_engine import batch_engine_manager
+        from app.core.inference_worker import inference_worker
+        from app.utils.tracing import tracer
+        from app.utils.profiler import profiler
+        stats = inference_scheduler.get_stats()
+        stats['batch_engine'] = batch_engine_manager.get_stats()
+        stats['stream_buffers'] = stream_buffers.get_stats()
+        stats['conversations'] = conversation_store.get_stats()
+        stats['event_loop'] = blocking.get_stats()
+        stats['inference_worker'] = inference_worker.get_stats()
+        stats['tracing'] = tracer.get_stats()
+        stats['profiler'] = profiler.get_stats()
+        stats['kv_cache'] = self.get_kv_cache_stats()
+        return stats
+    
+    def get_resident_models(self) -> Dict[str, Any]:
+        """Get the models kept resident in the pool and their memory usage"""
+        from app.core.model_pool import model_pool
+        return {
+            'models': model_pool.get_resident(),
+            'pool': model_pool.get_stats()
+        }
+    
+    def get_sessions(self) -> List[Dict[str, Any]]:
+        """Get the active assistant sessions"""
+        return session_manager.get_sessions()
+    
+    def close_session(self, session_id: str) -> bool:
+        """Stop and forget a session (e.g. when its socket disconnects)"""
+        return session_manager.remove(session_id)
+    
+    def handle_disconnect(self, sid: str):
+        """
+        Close the session of a disconnected client.
+        
+        If the client still has a stream in progress, it gets
+        STREAM_RESUME_GRACE_SECONDS to reconnect and resume it before the
+        generation is cancelled.
+        """
+        rings = stream_buffers.active_for(sid)
+        if not rings or Config.STREAM_RESUME_GRACE_SECONDS <= 0:
+            self.close_session(sid)
+            return
+        
+        def close_if_abandoned():
+            # Reanudado desde otro sid o terminado: la sesión sigue siendo útil
+            if any(ring.client_sid == sid and not ring.finished for ring in rings):
+                logger.info(f"Client {sid} did not resume its stream, closing session")
+                self.close_session(sid)
+        
+        timer = threading.Timer(Config.STREAM_RESUME_GRACE_SECONDS, close_if_abandoned)
+        timer.daemon = True
+        timer.start()
+    
+    def stop_socket_response(self, sid: str) -> ApiResponse:
+        """
+        Stop the responses owned by a Socket.IO client: its own session (keyed by
+        its sid) and the streams it resumed after a reconnection.
+        """
+        session_ids = {sid} | {ring.session_id for ring in stream_buffers.active_for(sid) if ring.session_id}
+        result = None
+        for session_id in session_ids:
+            result = self.stop_response(session_id)
+            if not result.success:
+                return result
+        return ApiResponse(success=True, message="Response stopped successfully",
+                           data={'session_ids': sorted(session_ids)})
+    
+    def resume_stream(self, request_id: str, last_seq: int, sid: str, socketio) -> ApiResponse:
+        """Replay the frames a reconnecting client missed and redirect the live stream to it"""
+        def send(event, frame):
+            socketio.emit(event, frame, namespace='/test', to=sid)
+        
+        state = stream_buffers.resume(request_id, last_seq, send, sid=sid)
+        if state is None:
+            return ApiResponse(
+                success=False,
+                message="Unknown or expired stream",
+                error=f"No buffered stream for request {request_id}"
+            )
+        return ApiResponse(success=True, message="Stream resumed", data=state)
+    
+    def get_kv_cache_stats(self) -> Dict[str, Any]:
+        """
+        Get prompt-prefix KV cache hit/miss statistics and the KV snapshot status.
+        
+        With the inference worker the cache lives in the worker processes, so the
+        counters of this process stay at zero and snapshots are disabled.
+        """
+        from app.core.kv_cache import prefix_kv_cache
+        from app.core.kv_snapshots import kv_snapshot_store
+        stats = prefix_kv_cache.get_stats()
+        if not Config.KV_CACHE_ENABLED:
+            stats['status'] = 'disabled'
+        elif Config.INFERENCE_WORKER_ENABLED:
+            stats['status'] = 'disabled (remote model)'
+        else:
+            stats['status'] = 'enabled'
+        stats['snapshots'] = kv_snapshot_store.get_stats()
+        return stats
+    
+    def stop_response(self, session_id: str) -> ApiResponse:
+        """Stop the response of one session"""
+        if not session_id:
+            return ApiResponse(
+                success=False,
+                message="Missing session id",
+                error="A session id is required to stop a response"
+            )
         try:
             if self.is_ready() and self._assistant:
-                self._assistant.stop_response()
-                logger.info("Response stopped by user")
+                self._assistant.stop_response(session_id)
+                logger.info(f"Response stopped by user (session={session_id})")
                 
             return ApiResponse(
                 success=True,
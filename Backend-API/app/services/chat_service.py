@@ -6,6 +6,7 @@ from typing import List, Dict, Any, Optional
 from app.models.data_models import ChatHistory, ApiResponse
 from app.utils.file_manager import file_manager
 from app.utils.logger import logger
+from app.config.settings import Config
 
 class ChatService:
     """Service for chat-related operations"""
@@ -15,6 +16,10 @@ class ChatService:
         try:
             success = file_manager.save_chat_history(name, history)
             
+            if success and Config.KV_SNAPSHOTS_ENABLED:
+                from app.core.kv_snapshots import kv_snapshot_store
+                kv_snapshot_store.save_async(name, history)
+            
             if success:
                 return ApiResponse(
                     success=True,
@@ -40,6 +45,10 @@ class ChatService:
         try:
             history = file_manager.load_chat_history(name)
             
+            if history is not None and Config.KV_SNAPSHOTS_ENABLED:
+                from app.core.kv_snapshots import kv_snapshot_store
+                kv_snapshot_store.register(name)
+            
             if history is not None:
                 return ApiResponse(
                     success=True,
@@ -67,6 +76,8 @@ class ChatService:
             success = file_manager.delete_chat_history(name)
             
             if success:
+                from app.core.kv_snapshots import kv_snapshot_store
+                kv_snapshot_store.delete(name)
                 return ApiResponse(
                     success=True,
                     message=f"Chat '{name}' deleted successfully"
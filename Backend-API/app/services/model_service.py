@@ -2,9 +2,9 @@
 @Author: Borja Otero Ferreira
 Model service for IALab Suite API
 """
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from llama_cpp.llama_chat_format import LlamaChatCompletionHandlerRegistry
-from app.utils.file_manager import file_manager
+from app.utils.model_index import model_index
 from app.utils.logger import logger
 from app.config.settings import Config
 
@@ -14,15 +14,20 @@ class ModelService:
     def __init__(self):
         self._chat_formats_cache = None
     
-    def get_available_models(self) -> List[dict]:
-        """Get list of available models with size"""
+    def get_available_models(self, offset: int = 0, limit: Optional[int] = None,
+                             **filters) -> Dict[str, Any]:
+        """Get a page of available models (with GGUF metadata) from the model index"""
         try:
-            models = file_manager.get_models_list(Config.MODELS_DIRECTORY)
-            logger.debug(f"Found {len(models)} available models")
-            return models
+            models, total = model_index.query(Config.MODELS_DIRECTORY, offset=offset, limit=limit, **filters)
+            logger.debug(f"Found {total} available models")
+            return {'models': models, 'total': total}
         except Exception as e:
             logger.error(f"Error getting available models: {e}")
-            return []
+            return {'models': [], 'total': 0}
+    
+    def refresh_models(self):
+        """Refresh the model index in the background"""
+        model_index.refresh(Config.MODELS_DIRECTORY)
     
     def get_chat_formats(self) -> List[str]:
         """Get list of available chat formats"""
@@ -37,10 +42,15 @@ class ModelService:
             logger.error(f"Error getting chat formats: {e}")
             return []
     
-    def get_models_and_formats(self) -> Dict[str, List[str]]:
+    def get_models_and_formats(self, offset: int = 0, limit: Optional[int] = None,
+                               **filters) -> Dict[str, Any]:
         """Get both models and formats in a single call"""
+        page = self.get_available_models(offset=offset, limit=limit, **filters)
         return {
-            'models': self.get_available_models(),
+            'models': page['models'],
+            'total': page['total'],
+            'offset': offset,
+            'limit': limit,
             'formats': self.get_chat_formats()
         }
     
@@ -0,0 +1,310 @@
+"""
+@Author: Borja Otero Ferreira
+OpenAI-compatible service for IALab Suite API
+Runs /v1/chat/completions requests through the same Assistant, scheduler, batch
+engine and KV caches as the web UI, collecting the streamed frames instead of
+sending them over Socket.IO
+"""
+import os
+import queue
+import time
+import uuid
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.config.settings import Config
+from app.core.context_budget import context_budgeter
+from app.core.session import session_manager
+from app.services.assistant_service import assistant_service
+from app.services.model_service import model_service
+from app.utils.logger import logger
+from app.utils import blocking, serialization
+
+VALID_ROLES = ('system', 'user', 'assistant', 'tool')
+STREAM_OPTIONS = ('include_usage',)
+MAX_STOP_SEQUENCES = 4
+
+
+class OpenAIError(Exception):
+    """Error returned to the client in the OpenAI error format"""
+
+    def __init__(self, message: str, status: int = 400, error_type: str = 'invalid_request_error',
+                 param: Optional[str] = None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.error_type = error_type
+        self.param = param
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'error': {'message': self.message, 'type': self.error_type,
+                          'param': self.param, 'code': None}}
+
+
+class CompletionChannel:
+    """
+    Socket-like sink for one API request.
+
+    The Assistant emits to it exactly as it does to a ClientChannel; the
+    assistant_response frames are queued for the HTTP handler.
+    """
+
+    def __init__(self, client_id: str):
+        self.client_id = client_id
+        self.request_id = None
+        self.frames: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+
+    def emit(self, event, data=None, namespace=None, **kwargs):
+        if event == 'assistant_response' and isinstance(data, dict):
+            self.frames.put(dict(data))
+
+
+class OpenAIService:
+    """OpenAI chat completions and model listing over the Assistant engine"""
+
+    # ------------------------------------------------------------------
+    # Models
+    # ------------------------------------------------------------------
+    def list_models(self) -> Dict[str, Any]:
+        """Models from the model index in the /v1/models format"""
+        loaded = self._loaded_model_path()
+        page = model_service.get_available_models()
+        data = []
+        for model in page['models']:
+            data.append({
+                'id': self._model_id(model['path']),
+                'object': 'model',
+                'created': int(model.get('mtime_ns', 0) / 1e9),
+                'owned_by': 'ialab-suite',
+                'loaded': loaded is not None and os.path.abspath(model['path']) == os.path.abspath(loaded),
+                'architecture': model.get('architecture'),
+                'quantization': model.get('quantization'),
+                'context_length': model.get('context_length'),
+            })
+        return {'object': 'list', 'data': data}
+
+    # ------------------------------------------------------------------
+    # Chat completions
+    # ------------------------------------------------------------------
+    def create_chat_completion(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Non-streaming completion: waits for the whole answer"""
+        request = self._start(body)
+        content = []
+        finish_reason, usage = 'stop', None
+        try:
+            for kind, value in self._events(request):
+                if kind == 'delta':
+                    content.append(value)
+                else:
+                    finish_reason, usage = value
+        finally:
+            self._close(request)
+        return {
+            'id': request['id'],
+            'object': 'chat.completion',
+            'created': request['created'],
+            'model': request['model'],
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': ''.join(content)},
+                'finish_reason': finish_reason,
+            }],
+            'usage': usage,
+        }
+
+    def stream_chat_completion(self, body: Dict[str, Any]) -> Iterator[str]:
+        """
+        Streaming completion as Server-Sent Events.
+
+        Validation errors are raised before the first event so the controller
+        can still answer with a JSON error and status code.
+        """
+        stream_options = body.get('stream_options') or {}
+        if not isinstance(stream_options, dict):
+            raise OpenAIError("'stream_options' must be an object", param='stream_options')
+        unsupported = sorted(set(stream_options) - set(STREAM_OPTIONS))
+        if unsupported:
+            raise OpenAIError(f"Unsupported stream_options: {', '.join(unsupported)}", param='stream_options')
+        request = self._start(body)
+        return self._sse(request, bool(stream_options.get('include_usage')))
+
+    def _sse(self, request: Dict[str, Any], include_usage: bool) -> Iterator[str]:
+        def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> str:
+            return self._sse_event({
+                'id': request['id'],
+                'object': 'chat.completion.chunk',
+                'created': request['created'],
+                'model': request['model'],
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+            })
+
+        try:
+            yield chunk({'role': 'assistant'})
+            for kind, value in self._events(request):
+                if kind == 'delta':
+                    yield chunk({'content': value})
+                    continue
+                finish_reason, usage = value
+                yield chunk({}, finish_reason)
+                if include_usage:
+                    yield self._sse_event({
+                        'id': request['id'],
+                        'object': 'chat.completion.chunk',
+                        'created': request['created'],
+                        'model': request['model'],
+                        'choices': [],
+                        'usage': usage,
+                    })
+            yield 'data: [DONE]\n\n'
+        except OpenAIError as e:
+            yield self._sse_event(e.to_dict())
+            yield 'data: [DONE]\n\n'
+        finally:
+            # Client gone (GeneratorExit) or finished: free the engine and the session
+            self._close(request)
+
+    def _start(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Validate the request and submit it to the Assistant"""
+        messages = self._validate_messages(body.get('messages'))
+        generation = self._validate_generation(body)
+        if not assistant_service.is_ready() and not assistant_service.initialize():
+            raise OpenAIError("Assistant is not initialized", 503, 'server_error')
+        model = assistant_service.get_model()
+        if model is None:
+            raise OpenAIError("No model is loaded; load one with /load_model first", 503, 'server_error')
+
+        completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+        channel = CompletionChannel(client_id=completion_id)
+        session = assistant_service.submit_completion(
+            messages,
+            channel,
+            session_id=completion_id,
+            priority=self._priority(body.get('priority')),
+            generation=generation
+        )
+        logger.info(f"OpenAI API: {completion_id} queued ({len(messages)} messages)")
+        return {
+            'id': completion_id,
+            'created': int(time.time()),
+            'model': body.get('model') or self._model_id(self._loaded_model_path() or 'unknown'),
+            'channel': channel,
+            'session': session,
+            'model_instance': model,
+            'messages': messages,
+        }
+
+    def _events(self, request: Dict[str, Any]) -> Iterator[Tuple[str, Any]]:
+        """
+        Translate Assistant frames into ('delta', text) and a final
+        ('done', (finish_reason, usage)) event
+        """
+        channel: CompletionChannel = request['channel']
+        completion_tokens = 0
+        prompt_tokens = None
+        finish_reason = 'stop'
+        while True:
+            try:
+                frame = blocking.queue_get(channel.frames, timeout=Config.OPENAI_REQUEST_TIMEOUT_SECONDS)
+            except queue.Empty:
+                raise OpenAIError("Timed out waiting for the model", 504, 'server_error')
+            if frame.get('error'):
+                raise OpenAIError(str(frame.get('content') or 'Generation failed'), 500, 'server_error')
+            if frame.get('finished'):
+                # max_tokens is enforced by the engine: this is the real number of generated tokens
+                completion_tokens = frame.get('total_assistant_tokens') or completion_tokens
+                stats = frame.get('generation_stats') or {}
+                # Tokens of the prompt actually evaluated, after the context budget trimmed it
+                prompt_tokens = stats.get('prompt_tokens')
+                if stats.get('finish_reason') == 'length':
+                    finish_reason = 'length'
+                break
+            text = frame.get('content') or ''
+            completion_tokens += frame.get('assistant_token_count') or 0
+            if text:
+                yield 'delta', text
+        if prompt_tokens is None:
+            # No stats from the engine: fit the request the same way the Assistant does
+            prompt_tokens = context_budgeter.fit(request['model_instance'], request['messages']).prompt_tokens
+        yield 'done', (finish_reason, {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+        })
+
+    def _close(self, request: Dict[str, Any]):
+        """Stop whatever is still running for the request and drop its session"""
+        session_manager.remove(request['session'].session_id)
+
+    # ------------------------------------------------------------------
+    # Helpers
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _validate_messages(messages: Any) -> List[Dict[str, Any]]:
+        if not isinstance(messages, list) or not messages:
+            raise OpenAIError("'messages' must be a non-empty array", param='messages')
+        validated = []
+        for index, message in enumerate(messages):
+            if not isinstance(message, dict) or message.get('role') not in VALID_ROLES:
+                raise OpenAIError(f"messages[{index}] must have a role in {VALID_ROLES}", param='messages')
+            content = message.get('content')
+            if content is None:
+                content = ''
+            if not isinstance(content, (str, list)):
+                raise OpenAIError(f"messages[{index}].content must be a string or an array",
+                                  param='messages')
+            # Only role and content reach the model (extra OpenAI fields are dropped)
+            validated.append({'role': message['role'], 'content': content})
+        return validated
+
+    @staticmethod
+    def _validate_generation(body: Dict[str, Any]) -> Dict[str, Any]:
+        """Sampling options passed to the engine; anything unsupported is rejected, not ignored"""
+        generation: Dict[str, Any] = {}
+        max_tokens = body.get('max_completion_tokens', body.get('max_tokens'))
+        if max_tokens is not None:
+            if isinstance(max_tokens, bool) or not isinstance(max_tokens, int) or max_tokens < 1:
+                raise OpenAIError("'max_tokens' must be a positive integer", param='max_tokens')
+            generation['max_tokens'] = max_tokens
+        for name, low, high in (('temperature', 0.0, 2.0), ('top_p', 0.0, 1.0)):
+            value = body.get(name)
+            if value is None:
+                continue
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not low <= value <= high:
+                raise OpenAIError(f"'{name}' must be a number between {low:g} and {high:g}", param=name)
+            generation[name] = float(value)
+        stop = body.get('stop')
+        if stop is not None:
+            stop = [stop] if isinstance(stop, str) else stop
+            if (not isinstance(stop, list) or len(stop) > MAX_STOP_SEQUENCES
+                    or not all(isinstance(s, str) and s for s in stop)):
+                raise OpenAIError(f"'stop' must be a string or an array of up to {MAX_STOP_SEQUENCES} strings",
+                                  param='stop')
+            generation['stop'] = stop
+        if body.get('n') not in (None, 1):
+            raise OpenAIError("Only n=1 is supported", param='n')
+        return generation
+
+    @staticmethod
+    def _priority(value: Any) -> int:
+        try:
+            return int(value) if value is not None else Config.OPENAI_DEFAULT_PRIORITY
+        except (TypeError, ValueError):
+            return Config.OPENAI_DEFAULT_PRIORITY
+
+    @staticmethod
+    def _model_id(path: str) -> str:
+        try:
+            return os.path.relpath(path, Config.MODELS_DIRECTORY).replace(os.sep, '/')
+        except ValueError:
+            return os.path.basename(path)
+
+    @staticmethod
+    def _loaded_model_path() -> Optional[str]:
+        return assistant_service.get_loaded_model_path()
+
+    @staticmethod
+    def _sse_event(data: Dict[str, Any]) -> str:
+        return f"data: {serialization.dumps(data)}\n\n"
+
+
+# Global OpenAI-compatible service instance
+openai_service = OpenAIService()
@@ -0,0 +1,206 @@
+"""
+@Author: Borja Otero Ferreira
+Blocking - Llamadas bloqueantes fuera del event loop en modo gevent/eventlet
+En producción el servidor corre sobre gevent o eventlet parcheando todo salvo threading:
+el scheduler, el motor de batching, las herramientas y el RAG siguen en hilos nativos
+(llama.cpp libera el GIL) y el loop solo atiende sockets. Este módulo hace de puente:
+- run_blocking: ejecuta una llamada bloqueante en el pool de hilos nativos del loop
+- wait_event / queue_get: esperas cooperativas desde el loop sin ocupar un hilo
+- call_in_loop: los hilos nativos no tocan objetos del loop (emits de Socket.IO), se los
+  pasan al loop en orden
+En modo threading todo se ejecuta directamente, como antes
+"""
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from app.utils.logger import logger
+
+ASYNC_MODES = ('gevent', 'eventlet')
+
+# Cadencia de las esperas cooperativas desde el loop
+POLL_INTERVAL = 0.01
+
+
+class _LoopBridge:
+    """Estado del puente con el loop (uno por proceso)"""
+
+    def __init__(self):
+        self.mode = 'threading'
+        self.loop_thread: Optional[int] = None
+        self.pool_size = 0
+        self.offloaded = 0
+        self.relayed = 0
+        # Llamadas pendientes de los hilos nativos; el lock (nativo) despierta al relay
+        self.pending: Deque[Tuple[Callable, tuple, Dict[str, Any]]] = deque()
+        self.signal = threading.Lock()
+        self.signal.acquire()
+
+    @property
+    def active(self) -> bool:
+        return self.mode in ASYNC_MODES
+
+
+_bridge = _LoopBridge()
+
+
+def is_monkey_patched(mode: str) -> bool:
+    """Si gevent/eventlet ha parcheado los sockets (servidor asíncrono en marcha)"""
+    try:
+        if mode == 'gevent':
+            from gevent import monkey
+            return monkey.is_module_patched('socket')
+        if mode == 'eventlet':
+            from eventlet import patcher
+            return patcher.is_monkey_patched('socket')
+    except ImportError:
+        pass
+    return False
+
+
+def threading_is_patched(mode: str) -> bool:
+    try:
+        if mode == 'gevent':
+            from gevent import monkey
+            return monkey.is_module_patched('threading')
+        if mode == 'eventlet':
+            from eventlet import patcher
+            return patcher.is_monkey_patched('thread')
+    except ImportError:
+        pass
+    return False
+
+
+def configure(socketio, async_mode: str, pool_size: int = 16):
+    """
+    Activa el puente si el servidor corre sobre gevent/eventlet (llamar desde el hilo del
+    loop al crear la aplicación)
+
+    Args:
+        socketio: Instancia SocketIO (sus emits desde hilos nativos se pasan al loop)
+        async_mode: Modo de Socket.IO configurado
+        pool_size: Hilos nativos del pool para run_blocking
+    """
+    if async_mode not in ASYNC_MODES or not is_monkey_patched(async_mode):
+        _bridge.mode = 'threading'
+        return
+    if threading_is_patched(async_mode):
+        # Los "hilos" del scheduler serían greenlets: la inferencia bloquearía el loop
+        logger.warning(f"{async_mode} ha parcheado threading: arranca con run.py (parchea "
+                       f"todo salvo threading) para que la inferencia no bloquee el loop")
+    _bridge.mode = async_mode
+    _bridge.loop_thread = threading.get_ident()
+    _bridge.pool_size = pool_size
+    if async_mode == 'gevent':
+        import gevent
+        gevent.get_hub().threadpool.maxsize = pool_size
+    socketio.emit = loop_safe(socketio.emit)
+    socketio.start_background_task(_relay)
+    logger.info(f"Modo {async_mode}: llamadas bloqueantes en un pool de {pool_size} hilos nativos")
+
+
+def get_mode() -> str:
+    return _bridge.mode
+
+
+def in_loop() -> bool:
+    """Si el código se ejecuta en el hilo del event loop (un greenlet)"""
+    return _bridge.active and threading.get_ident() == _bridge.loop_thread
+
+
+def run_blocking(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Ejecuta una llamada bloqueante (C, disco, red) sin detener el loop: desde el loop se
+    envía al pool de hilos nativos y el greenlet espera cooperativamente. Fuera del loop
+    (o en modo threading) se llama directamente.
+    """
+    if not in_loop():
+        return func(*args, **kwargs)
+    _bridge.offloaded += 1
+    if _bridge.mode == 'gevent':
+        import gevent
+        return gevent.get_hub().threadpool.apply(func, args, kwargs)
+    from eventlet import tpool
+    return tpool.execute(func, *args, **kwargs)
+
+
+def sleep(seconds: float):
+    """Pausa que cede el loop (time.sleep está parcheado en modo asíncrono)"""
+    time.sleep(seconds)
+
+
+def wait_event(event: threading.Event, timeout: Optional[float] = None) -> bool:
+    """
+    Espera un threading.Event nativo. Desde el loop se consulta periódicamente en lugar
+    de bloquear (y sin ocupar un hilo del pool durante toda una generación).
+    """
+    if not in_loop():
+        return event.wait(timeout)
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    while not event.is_set():
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+        sleep(POLL_INTERVAL)
+    return True
+
+
+def queue_get(q: "queue.Queue", timeout: Optional[float] = None) -> Any:
+    """queue.Queue.get que no bloquea el loop (lanza queue.Empty al agotar el timeout)"""
+    if not in_loop():
+        return q.get(timeout=timeout)
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    while True:
+        try:
+            return q.get_nowait()
+        except queue.Empty:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise
+            sleep(POLL_INTERVAL)
+
+
+def call_in_loop(func: Callable[..., Any], *args, **kwargs):
+    """
+    Ejecuta func en el loop. Desde un hilo nativo se encola y vuelve enseguida (el orden
+    se respeta); desde el loop o en modo threading se llama directamente.
+    """
+    if not _bridge.active or threading.get_ident() == _bridge.loop_thread:
+        return func(*args, **kwargs)
+    _bridge.pending.append((func, args, kwargs))
+    try:
+        _bridge.signal.release()
+    except RuntimeError:
+        pass  # Ya había un aviso pendiente: el relay vaciará también esta llamada
+    return None
+
+
+def loop_safe(func: Callable[..., Any]) -> Callable[..., Any]:
+    """Envuelve una función del loop (p. ej. socketio.emit) para poder llamarla desde cualquier hilo"""
+    def wrapper(*args, **kwargs):
+        return call_in_loop(func, *args, **kwargs)
+    wrapper.__wrapped__ = func
+    return wrapper
+
+
+def _relay():
+    """Greenlet del loop que ejecuta las llamadas encoladas por los hilos nativos"""
+    while True:
+        run_blocking(_bridge.signal.acquire)
+        while _bridge.pending:
+            func, args, kwargs = _bridge.pending.popleft()
+            _bridge.relayed += 1
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                logger.error(f"Error en llamada diferida al loop ({getattr(func, '__name__', func)}): {e}")
+
+
+def get_stats() -> Dict[str, Any]:
+    return {
+        'mode': _bridge.mode,
+        'pool_size': _bridge.pool_size,
+        'offloaded_calls': _bridge.offloaded,
+        'relayed_calls': _bridge.relayed,
+        'pending_relay': len(_bridge.pending),
+    }
@@ -3,11 +3,11 @@
 File utilities for IALab Suite API
 """
 import os
-import json
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 from app.config.settings import Config
 from app.utils.logger import logger
+from app.utils import serialization
 
 class FileManager:
     """Handles file operations for the application"""
@@ -20,7 +20,8 @@ class FileManager:
         directories = [
             Config.CHATS_DIR,
             Config.LOGS_DIR,
-            Config.DOCUMENTS_DIR
+            Config.DOCUMENTS_DIR,
+            Config.CACHE_DIR
         ]
         
         for directory in directories:
@@ -51,8 +52,7 @@ class FileManager:
             sanitized_name = self.sanitize_filename(chat_name)
             file_path = os.path.join(Config.CHATS_DIR, f'{sanitized_name}.json')
             
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(history, f, indent=4, ensure_ascii=False)
+            serialization.dump_file(history, file_path)
             
             logger.info(f"Chat history saved: {sanitized_name}")
             return True
@@ -69,8 +69,7 @@ class FileManager:
             if not os.path.exists(file_path):
                 return None
             
-            with open(file_path, 'r', encoding='utf-8') as f:
-                history = json.load(f)
+            history = serialization.load_file(file_path)
             
             logger.info(f"Chat history loaded: {chat_name}")
             return history
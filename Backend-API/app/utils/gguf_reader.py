@@ -0,0 +1,200 @@
+"""
+@Author: Borja Otero Ferreira
+GGUF Reader - Lectura de la cabecera de ficheros GGUF sin cargar el modelo
+Extrae metadatos (arquitectura, cuantización, contexto de entrenamiento) y recorre
+la tabla de tensores para contar parámetros
+"""
+import struct
+from typing import Any, BinaryIO, Dict, Optional
+
+GGUF_MAGIC = b'GGUF'
+
+# Tipos de valor de los metadatos (gguf_type)
+_SCALAR_FORMATS = {
+    0: '<B',   # uint8
+    1: '<b',   # int8
+    2: '<H',   # uint16
+    3: '<h',   # int16
+    4: '<I',   # uint32
+    5: '<i',   # int32
+    6: '<f',   # float32
+    7: '<?',   # bool
+    10: '<Q',  # uint64
+    11: '<q',  # int64
+    12: '<d',  # float64
+}
+_TYPE_STRING = 8
+_TYPE_ARRAY = 9
+
+# llama_ftype (general.file_type)
+FILE_TYPES = {
+    0: 'F32', 1: 'F16', 2: 'Q4_0', 3: 'Q4_1', 7: 'Q8_0', 8: 'Q5_0', 9: 'Q5_1',
+    10: 'Q2_K', 11: 'Q3_K_S', 12: 'Q3_K_M', 13: 'Q3_K_L', 14: 'Q4_K_S', 15: 'Q4_K_M',
+    16: 'Q5_K_S', 17: 'Q5_K_M', 18: 'Q6_K', 19: 'IQ2_XXS', 20: 'IQ2_XS', 21: 'Q2_K_S',
+    22: 'IQ3_XS', 23: 'IQ3_XXS', 24: 'IQ1_S', 25: 'IQ4_NL', 26: 'IQ3_S', 27: 'IQ3_M',
+    28: 'IQ2_S', 29: 'IQ2_M', 30: 'IQ4_XS', 31: 'IQ1_M', 32: 'BF16',
+}
+
+# ggml_type de los tensores (para deducir la cuantización si falta general.file_type)
+TENSOR_TYPES = {
+    0: 'F32', 1: 'F16', 2: 'Q4_0', 3: 'Q4_1', 6: 'Q5_0', 7: 'Q5_1', 8: 'Q8_0', 9: 'Q8_1',
+    10: 'Q2_K', 11: 'Q3_K', 12: 'Q4_K', 13: 'Q5_K', 14: 'Q6_K', 15: 'Q8_K',
+    16: 'IQ2_XXS', 17: 'IQ2_XS', 18: 'IQ3_XXS', 19: 'IQ1_S', 20: 'IQ4_NL', 21: 'IQ3_S',
+    22: 'IQ2_S', 23: 'IQ4_XS', 30: 'BF16',
+}
+
+
+class GGUFError(ValueError):
+    """Fichero que no es un GGUF válido"""
+
+
+def read_gguf_header(path: str, read_tensors: bool = True) -> Dict[str, Any]:
+    """
+    Lee la cabecera de un fichero GGUF
+
+    Los arrays (vocabulario, merges...) no se guardan: solo su longitud,
+    con la clave '<nombre>.length'.
+
+    Args:
+        path: Ruta del fichero
+        read_tensors: Recorrer también la tabla de tensores para contar parámetros
+
+    Returns:
+        dict: {'version', 'tensor_count', 'metadata', 'parameter_count', 'tensor_types'}
+    """
+    with open(path, 'rb') as f:
+        if f.read(4) != GGUF_MAGIC:
+            raise GGUFError(f"{path} no es un fichero GGUF")
+        version = _read(f, '<I')
+        count_format = '<I' if version == 1 else '<Q'
+        tensor_count = _read(f, count_format)
+        kv_count = _read(f, count_format)
+
+        metadata: Dict[str, Any] = {}
+        for _ in range(kv_count):
+            key = _read_string(f, count_format)
+            value_type = _read(f, '<I')
+            if value_type == _TYPE_ARRAY:
+                metadata[f'{key}.length'] = _skip_array(f, count_format)
+            else:
+                metadata[key] = _read_value(f, value_type, count_format)
+
+        header = {
+            'version': version,
+            'tensor_count': tensor_count,
+            'metadata': metadata,
+            'parameter_count': None,
+            'tensor_types': {},
+        }
+        if read_tensors:
+            parameters = 0
+            tensor_types: Dict[str, int] = {}
+            for _ in range(tensor_count):
+                _read_string(f, count_format)
+                n_dims = _read(f, '<I')
+                elements = 1
+                for _ in range(n_dims):
+                    elements *= _read(f, count_format)
+                tensor_type = TENSOR_TYPES.get(_read(f, '<I'), 'UNKNOWN')
+                _read(f, '<Q')  # offset
+                parameters += elements
+                tensor_types[tensor_type] = tensor_types.get(tensor_type, 0) + elements
+            header['parameter_count'] = parameters
+            header['tensor_types'] = tensor_types
+        return header
+
+
+def summarize_header(header: Dict[str, Any], context_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Resumen de una cabecera GGUF para listados de modelos
+
+    Args:
+        header: Resultado de read_gguf_header
+        context_size: Contexto con el que estimar la caché KV (por defecto el de entrenamiento)
+    """
+    metadata = header.get('metadata', {})
+    arch = metadata.get('general.architecture', '')
+    context_length = _meta_int(metadata, f'{arch}.context_length')
+    quantization = FILE_TYPES.get(metadata.get('general.file_type'))
+    if quantization is None and header.get('tensor_types'):
+        # Tipo dominante sin contar las normas en F32
+        weights = {k: v for k, v in header['tensor_types'].items() if k != 'F32'} or header['tensor_types']
+        quantization = max(weights, key=weights.get)
+    return {
+        'name': metadata.get('general.name'),
+        'architecture': arch or None,
+        'quantization': quantization,
+        'parameter_count': header.get('parameter_count'),
+        'context_length': context_length or None,
+        'kv_bytes': kv_bytes_from_metadata(metadata, context_size or context_length or 0),
+    }
+
+
+def kv_bytes_from_metadata(metadata: Dict[str, Any], n_ctx: int, bytes_per_element: float = 2.0) -> int:
+    """
+    Tamaño de la caché KV para n_ctx según los metadatos GGUF
+
+    Args:
+        metadata: Metadatos GGUF (clave -> valor)
+        n_ctx: Tamaño de contexto
+        bytes_per_element: Bytes por elemento de K/V (2 para f16)
+    """
+    arch = metadata.get('general.architecture', 'llama')
+    n_layer = _meta_int(metadata, f'{arch}.block_count')
+    n_embd = _meta_int(metadata, f'{arch}.embedding_length')
+    n_head = _meta_int(metadata, f'{arch}.attention.head_count')
+    n_head_kv = _meta_int(metadata, f'{arch}.attention.head_count_kv', n_head)
+    if not (n_layer and n_embd and n_head and n_ctx):
+        return 0
+    head_dim = _meta_int(metadata, f'{arch}.attention.key_length', n_embd // n_head) or n_embd // n_head
+    return int(2 * n_layer * n_ctx * n_head_kv * head_dim * bytes_per_element)
+
+
+def _meta_int(metadata: Dict[str, Any], key: str, default: int = 0) -> int:
+    try:
+        return int(metadata.get(key, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _read(f: BinaryIO, fmt: str):
+    size = struct.calcsize(fmt)
+    data = f.read(size)
+    if len(data) != size:
+        raise GGUFError("Cabecera GGUF truncada")
+    return struct.unpack(fmt, data)[0]
+
+
+def _read_string(f: BinaryIO, count_format: str) -> str:
+    length = _read(f, count_format)
+    data = f.read(length)
+    if len(data) != length:
+        raise GGUFError("Cabecera GGUF truncada")
+    return data.decode('utf-8', errors='replace')
+
+
+def _read_value(f: BinaryIO, value_type: int, count_format: str):
+    if value_type == _TYPE_STRING:
+        return _read_string(f, count_format)
+    fmt = _SCALAR_FORMATS.get(value_type)
+    if fmt is None:
+        raise GGUFError(f"Tipo de metadato GGUF desconocido: {value_type}")
+    return _read(f, fmt)
+
+
+def _skip_array(f: BinaryIO, count_format: str) -> int:
+    """Salta un array de metadatos y devuelve su longitud"""
+    item_type = _read(f, '<I')
+    length = _read(f, count_format)
+    if item_type in _SCALAR_FORMATS:
+        f.seek(struct.calcsize(_SCALAR_FORMATS[item_type]) * length, 1)
+    elif item_type == _TYPE_STRING:
+        for _ in range(length):
+            f.seek(_read(f, count_format), 1)
+    else:
+        for _ in range(length):
+            if item_type == _TYPE_ARRAY:
+                _skip_array(f, count_format)
+            else:
+                raise GGUFError(f"Tipo de array GGUF desconocido: {item_type}")
+    return length
@@ -0,0 +1,341 @@
+"""
+@Author: Borja Otero Ferreira
+Metrics - Registro de métricas (contadores, gauges e histogramas) en formato Prometheus
+Sin dependencias: cada serie es un objeto con su propio lock, así que actualizarla cuesta
+una suma bajo un lock y se puede hacer en los caminos calientes. /metrics lo publica en
+formato de texto de Prometheus (version 0.0.4).
+
+Uso:
+    metrics.tool_calls.labels('web_search', 'ok').inc()
+    with metrics.model_load_seconds.time():
+        ...
+"""
+import bisect
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Buckets por defecto (segundos)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+LOAD_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 150, 250)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if value != value:
+        return 'NaN'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Timer:
+    """Context manager que observa la duración del bloque en un histograma (o la suma a un gauge)"""
+
+    __slots__ = ('_observe', '_started')
+
+    def __init__(self, observe: Callable[[float], None]):
+        self._observe = observe
+        self._started = 0.0
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._observe(time.perf_counter() - self._started)
+        return False
+
+
+class _Metric:
+    """Métrica con nombre y etiquetas; cada combinación de valores es una serie hija"""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], '_Metric'] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values, **kwargs) -> '_Metric':
+        """Serie hija para los valores de las etiquetas (posicionales o por nombre)"""
+        if kwargs:
+            values = tuple(str(kwargs[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name}: se esperaban las etiquetas {self.labelnames}")
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._new_child()
+                    self._children[values] = child
+        return child
+
+    def _new_child(self) -> '_Metric':
+        raise NotImplementedError
+
+    def _series(self) -> List[Tuple[Tuple[str, ...], '_Metric']]:
+        if not self.labelnames:
+            return [((), self)]
+        with self._lock:
+            return list(self._children.items())
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {_escape(self.documentation)}', f'# TYPE {self.name} {self.kind}']
+        for values, series in self._series():
+            lines.extend(series._samples(self.name, self.labelnames, values))
+        return lines
+
+    def _samples(self, name: str, labelnames: Sequence[str], values: Sequence[str]) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Valor que solo crece"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._value = 0.0
+        self._value_lock = threading.Lock()
+
+    def _new_child(self) -> 'Counter':
+        return Counter(self.name, self.documentation)
+
+    def inc(self, amount: float = 1.0):
+        if amount < 0:
+            raise ValueError("Un contador no puede decrecer")
+        with self._value_lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def _samples(self, name, labelnames, values):
+        return [f'{name}{_format_labels(labelnames, values)} {_format_value(self._value)}']
+
+
+class Gauge(_Metric):
+    """Valor que sube y baja; con set_function se calcula al exportar"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._value = 0.0
+        self._value_lock = threading.Lock()
+        self._function: Optional[Callable[[], float]] = None
+
+    def _new_child(self) -> 'Gauge':
+        return Gauge(self.name, self.documentation)
+
+    def set(self, value: float):
+        self._value = float(value)
+
+    def inc(self, amount: float = 1.0):
+        with self._value_lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+    def set_function(self, function: Callable[[], float]):
+        """El valor se lee de function en cada exportación (p. ej. la profundidad de la cola)"""
+        self._function = function
+
+    def track_inprogress(self) -> '_InProgress':
+        """Context manager que suma 1 mientras dura el bloque"""
+        return _InProgress(self)
+
+    @property
+    def value(self) -> float:
+        if self._function is not None:
+            try:
+                return float(self._function())
+            except Exception:
+                return math.nan
+        return self._value
+
+    def _samples(self, name, labelnames, values):
+        return [f'{name}{_format_labels(labelnames, values)} {_format_value(self.value)}']
+
+
+class _InProgress:
+    __slots__ = ('_gauge',)
+
+    def __init__(self, gauge: Gauge):
+        self._gauge = gauge
+
+    def __enter__(self):
+        self._gauge.inc()
+        return self
+
+    def __exit__(self, *exc):
+        self._gauge.dec()
+        return False
+
+
+class Histogram(_Metric):
+    """Distribución de observaciones en buckets acumulativos (más suma y recuento)"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets if b != math.inf))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._value_lock = threading.Lock()
+
+    def _new_child(self) -> 'Histogram':
+        return Histogram(self.name, self.documentation, buckets=self.buckets)
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._value_lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def time(self) -> _Timer:
+        """Context manager que observa la duración del bloque"""
+        return _Timer(self.observe)
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    def _samples(self, name, labelnames, values):
+        with self._value_lock:
+            counts, total = list(self._counts), self._sum
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            labels = _format_labels(labelnames, values, ('le', _format_value(bound)))
+            lines.append(f'{name}_bucket{labels} {cumulative}')
+        plain = _format_labels(labelnames, values)
+        lines.append(f'{name}_sum{plain} {_format_value(total)}')
+        lines.append(f'{name}_count{plain} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    """Conjunto de métricas exportadas por /metrics"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Métrica duplicada: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """Todas las métricas en formato de texto de Prometheus"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+def record_generation(stats: Dict, outcome: str = 'completed', queue_wait: Optional[float] = None):
+    """
+    Registra una respuesta completa a partir de las estadísticas de GenerationMeter
+    (una vez por respuesta: el bucle por token no toca las métricas)
+    """
+    generations.labels(outcome).inc()
+    tokens = stats.get('generated_tokens') or 0
+    if tokens:
+        generated_tokens.inc(tokens)
+        prompt_eval = stats.get('time_to_first_token') or 0.0
+        prompt_eval_seconds.observe(prompt_eval)
+        time_to_first_token_seconds.observe(prompt_eval + (queue_wait or 0.0))
+    if stats.get('tokens_per_second'):
+        tokens_per_second.observe(stats['tokens_per_second'])
+    if stats.get('total_seconds') is not None:
+        generation_seconds.observe(stats['total_seconds'])
+
+
+# Instancia global del registro y métricas de la aplicación
+registry = MetricsRegistry()
+
+# Inferencia
+generations = registry.counter('ialab_generations_total', 'Respuestas generadas por resultado', ('outcome',))
+generated_tokens = registry.counter('ialab_generated_tokens_total', 'Tokens generados')
+time_to_first_token_seconds = registry.histogram(
+    'ialab_time_to_first_token_seconds', 'Desde que la petición entra en cola hasta el primer token')
+prompt_eval_seconds = registry.histogram(
+    'ialab_prompt_eval_seconds', 'Evaluación del prompt (desde que empieza la generación hasta el primer token)')
+tokens_per_second = registry.histogram(
+    'ialab_tokens_per_second', 'Velocidad de generación por respuesta', buckets=TOKENS_PER_SECOND_BUCKETS)
+generation_seconds = registry.histogram('ialab_generation_seconds', 'Duración total de cada generación')
+
+# Cola de inferencia
+queue_depth = registry.gauge('ialab_queue_depth', 'Peticiones esperando en la cola de inferencia')
+inference_running = registry.gauge('ialab_inference_running', 'Peticiones de inferencia en ejecución')
+queue_wait_seconds = registry.histogram('ialab_queue_wait_seconds', 'Tiempo de espera en la cola de inferencia')
+inference_requests = registry.counter('ialab_inference_requests_total',
+                                      'Peticiones atendidas por el scheduler por resultado', ('outcome',))
+
+# Modelos
+model_loads = registry.counter('ialab_model_loads_total', 'Cargas de modelo por resultado', ('outcome',))
+model_load_seconds = registry.histogram('ialab_model_load_seconds', 'Duración de las cargas de modelo',
+                                        buckets=LOAD_BUCKETS)
+models_resident = registry.gauge('ialab_models_resident', 'Modelos residentes en el pool')
+
+# RAG, herramientas y agentes
+rag_requests = registry.counter('ialab_rag_requests_total', 'Respuestas RAG por resultado', ('outcome',))
+rag_stage_seconds = registry.histogram('ialab_rag_stage_seconds',
+                                       'Duración de cada fase del RAG (load, index, retrieve, generate)', ('stage',))
+tool_calls = registry.counter('ialab_tool_calls_total', 'Ejecuciones de herramientas por resultado',
+                              ('tool', 'outcome'))
+tool_duration_seconds = registry.histogram('ialab_tool_duration_seconds', 'Duración de las herramientas', ('tool',))
+agent_phase_seconds = registry.histogram('ialab_agent_phase_seconds', 'Duración de cada fase de los agentes',
+                                         ('agent', 'phase'))
@@ -0,0 +1,222 @@
+"""
+@Author: Borja Otero Ferreira
+Model Index - Índice persistente de modelos GGUF con metadatos de cabecera
+Evita recorrer y leer el directorio de modelos en cada petición: el índice se guarda
+en disco, se invalida por tamaño/mtime y se refresca de forma incremental en segundo plano
+"""
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config.settings import Config
+from app.utils.logger import logger
+from app.utils.gguf_reader import read_gguf_header, summarize_header
+
+INDEX_VERSION = 1
+
+
+class ModelIndex:
+    """
+    Índice de modelos por directorio.
+
+    - query() responde siempre desde memoria; solo el primer escaneo de un directorio
+      sin índice previo es síncrono.
+    - Si el índice tiene más de refresh_seconds se lanza un refresco en segundo plano
+      que solo vuelve a leer las cabeceras de los ficheros cuyo tamaño o mtime cambió.
+    """
+
+    def __init__(self, index_path: str, refresh_seconds: float = 60.0):
+        self.index_path = index_path
+        self.refresh_seconds = refresh_seconds
+        self._directories: Optional[Dict[str, Dict[str, Any]]] = None
+        self._lock = threading.RLock()
+        self._refreshing: Dict[str, threading.Thread] = {}
+        self.scans = 0
+        self.headers_read = 0
+
+    # ------------------------------------------------------------------
+    # Consultas
+    # ------------------------------------------------------------------
+    def query(self, directory: Optional[str] = None, offset: int = 0, limit: Optional[int] = None,
+              search: str = '', architecture: str = '', quantization: str = '',
+              max_ram_bytes: int = 0) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Modelos del índice filtrados y paginados
+
+        Args:
+            directory: Directorio de modelos (por defecto Config.MODELS_DIRECTORY)
+            offset: Primer resultado
+            limit: Número máximo de resultados (None = todos)
+            search: Texto contenido en la ruta (sin distinguir mayúsculas)
+            architecture: Arquitectura exacta (llama, gemma3, qwen2...)
+            quantization: Tipo de cuantización exacto (Q4_K_M, Q8_0...)
+            max_ram_bytes: Descarta modelos con RAM estimada mayor
+
+        Returns:
+            tuple: (modelos de la página, total tras filtrar)
+        """
+        directory = directory or Config.MODELS_DIRECTORY
+        entries = self._entries(directory)
+
+        search = (search or '').lower()
+        architecture = (architecture or '').lower()
+        quantization = (quantization or '').upper()
+        models = [
+            entry for entry in entries
+            if (not search or search in entry['path'].lower())
+            and (not architecture or (entry.get('architecture') or '').lower() == architecture)
+            and (not quantization or (entry.get('quantization') or '').upper() == quantization)
+            and (not max_ram_bytes or (entry.get('estimated_ram_bytes') or 0) <= max_ram_bytes)
+        ]
+        total = len(models)
+        offset = max(offset, 0)
+        page = models[offset:offset + limit] if limit is not None else models[offset:]
+        return page, total
+
+    def refresh(self, directory: Optional[str] = None, wait: bool = False):
+        """Refresca el índice de un directorio (en segundo plano salvo wait=True)"""
+        directory = directory or Config.MODELS_DIRECTORY
+        if wait:
+            self._scan(directory)
+            return
+        with self._lock:
+            thread = self._refreshing.get(directory)
+            if thread is not None and thread.is_alive():
+                return
+            thread = threading.Thread(target=self._scan, args=(directory,),
+                                      name='model-index-refresh', daemon=True)
+            self._refreshing[directory] = thread
+        thread.start()
+
+    def get_stats(self) -> Dict[str, Any]:
+        directories = self._load()
+        with self._lock:
+            return {
+                'index_path': self.index_path,
+                'directories': {
+                    directory: {
+                        'models': len(data.get('models', {})),
+                        'scanned_at': data.get('scanned_at'),
+                        'scan_seconds': data.get('scan_seconds'),
+                    }
+                    for directory, data in directories.items()
+                },
+                'scans': self.scans,
+                'headers_read': self.headers_read,
+            }
+
+    # ------------------------------------------------------------------
+    # Escaneo
+    # ------------------------------------------------------------------
+    def _entries(self, directory: str) -> List[Dict[str, Any]]:
+        directories = self._load()
+        with self._lock:
+            data = directories.get(directory)
+        if data is None:
+            self._scan(directory)
+            with self._lock:
+                data = directories.get(directory, {})
+        elif time.time() - data.get('scanned_at', 0) > self.refresh_seconds:
+            self.refresh(directory)
+        models = data.get('models', {})
+        return [models[path] for path in sorted(models)]
+
+    def _scan(self, directory: str):
+        """Recorre el directorio y relee solo las cabeceras de los ficheros modificados"""
+        start = time.time()
+        directories = self._load()
+        with self._lock:
+            previous = dict(directories.get(directory, {}).get('models', {}))
+
+        models: Dict[str, Dict[str, Any]] = {}
+        changed = False
+        for path, stat in self._walk(directory):
+            entry = previous.get(path)
+            if entry and entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns:
+                models[path] = entry
+                continue
+            models[path] = self._describe(path, stat)
+            changed = True
+        changed = changed or set(previous) != set(models)
+
+        elapsed = time.time() - start
+        with self._lock:
+            directories[directory] = {
+                'models': models,
+                'scanned_at': time.time(),
+                'scan_seconds': round(elapsed, 3),
+            }
+            self.scans += 1
+        if changed:
+            self._save()
+        logger.debug(f"Índice de modelos: {len(models)} modelos en {directory} ({elapsed:.2f}s)")
+
+    @staticmethod
+    def _walk(directory: str):
+        """os.walk con scandir: el stat de cada entrada sale del propio listado cuando el SO lo permite"""
+        pending = [directory]
+        while pending:
+            current = pending.pop()
+            try:
+                with os.scandir(current) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=True):
+                                pending.append(entry.path)
+                            elif entry.name.endswith('.gguf'):
+                                yield entry.path, entry.stat()
+                        except OSError:
+                            continue
+            except OSError as e:
+                logger.warning(f"No se pudo leer el directorio de modelos {current}: {e}")
+
+    def _describe(self, path: str, stat: os.stat_result) -> Dict[str, Any]:
+        entry: Dict[str, Any] = {
+            'path': path,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+        }
+        try:
+            summary = summarize_header(read_gguf_header(path), Config.DEFAULT_CONTEXT_SIZE)
+            self.headers_read += 1
+        except Exception as e:
+            logger.warning(f"No se pudo leer la cabecera GGUF de {path}: {e}")
+            summary = {'error': str(e), 'kv_bytes': 0}
+        entry.update(summary)
+        # Pesos (mmap) + caché KV f16 con el contexto por defecto
+        entry['estimated_ram_bytes'] = stat.st_size + (summary.get('kv_bytes') or 0)
+        return entry
+
+    # ------------------------------------------------------------------
+    # Persistencia
+    # ------------------------------------------------------------------
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            if self._directories is None:
+                self._directories = {}
+                try:
+                    with open(self.index_path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    if data.get('version') == INDEX_VERSION:
+                        self._directories = data.get('directories', {})
+                except (OSError, ValueError):
+                    pass
+            return self._directories
+
+    def _save(self):
+        with self._lock:
+            data = {'version': INDEX_VERSION, 'directories': self._directories or {}}
+            try:
+                os.makedirs(os.path.dirname(self.index_path) or '.', exist_ok=True)
+                tmp_path = self.index_path + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.index_path)
+            except OSError as e:
+                logger.error(f"Error guardando el índice de modelos: {e}")
+
+
+# Instancia global del índice de modelos
+model_index = ModelIndex(Config.MODEL_INDEX_PATH, Config.MODEL_INDEX_REFRESH_SECONDS)
@@ -0,0 +1,369 @@
+"""
+@Author: Borja Otero Ferreira
+Profiler - Profiler de muestreo bajo demanda para las peticiones lentas
+Mientras hay peticiones perfiladas, un hilo lee cada PROFILER_INTERVAL_MS las pilas de sus
+hilos (sys._current_frames) y las agrega por pila; no instrumenta ninguna llamada, así que el
+coste es el mismo sea cual sea el código que corre. Si la petición supera el umbral de
+latencia su perfil se guarda en logs/profiles/ (speedscope o collapsed stacks) con el
+trace id en el nombre del fichero.
+
+Uso:
+    with profiler.profile('chat', trace_id=request_id):
+        ...  # los hilos de herramientas se suman con profiler.attach(capture)
+"""
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config.settings import Config
+from app.utils import serialization
+from app.utils.logger import logger
+
+_current_capture: ContextVar[Optional['ProfileCapture']] = ContextVar('ialab_profile_capture', default=None)
+
+FORMATS = ('speedscope', 'collapsed')
+MAX_STACK_DEPTH = 128
+
+
+def _parse_bool(name: str, value: Any) -> Optional[bool]:
+    """Booleano estricto (True/False o 'true'/'false'/'1'/'0'); bool('false') sería True"""
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ('true', '1', 'false', '0'):
+        return value.strip().lower() in ('true', '1')
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    raise ValueError(f"'{name}' debe ser un booleano")
+
+
+def _parse_number(name: str, value: Any, minimum: float) -> Optional[float]:
+    """Número (o cadena numérica) >= minimum"""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"'{name}' debe ser un número")
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{name}' debe ser un número")
+    if not number >= minimum:
+        raise ValueError(f"'{name}' debe ser al menos {minimum:g}")
+    return number
+
+
+class ProfileCapture:
+    """Muestras de una petición: (hilo, pila de la raíz a la hoja) -> [muestras, segundos]"""
+
+    def __init__(self, name: str, trace_id: Optional[str]):
+        self.name = name
+        self.trace_id = trace_id
+        self.started = time.perf_counter()
+        self.start_time = time.time()
+        self.threads: Dict[int, str] = {}
+        self.samples: Dict[Tuple[str, Tuple[Any, ...]], List[float]] = {}
+        self.sample_count = 0
+        self.duration: Optional[float] = None
+
+    def add_thread(self, thread: threading.Thread):
+        self.threads[thread.ident] = thread.name
+
+    def remove_thread(self, thread: threading.Thread):
+        self.threads.pop(thread.ident, None)
+
+
+class SamplingProfiler:
+    """Muestrea los hilos de las peticiones activas y guarda el perfil de las que superan el umbral"""
+
+    def __init__(self, output_dir: str, enabled: bool = False, threshold_seconds: float = 10.0,
+                 interval_ms: float = 10.0, output_format: str = 'speedscope', max_files: int = 200):
+        self.output_dir = output_dir
+        self.enabled = enabled
+        self.threshold_seconds = threshold_seconds
+        self.interval_ms = interval_ms
+        self.output_format = output_format if output_format in FORMATS else 'speedscope'
+        self.max_files = max_files
+        self._captures: List[ProfileCapture] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._tick = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        # code object -> nombre del frame ("func (fichero:línea)"); se calcula una sola vez
+        self._frame_names: Dict[Any, str] = {}
+        self.profiled = 0
+        self.saved = 0
+        self.last_profile: Optional[str] = None
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+    def configure(self, enabled: Any = None, threshold_seconds: Any = None,
+                  interval_ms: Any = None, output_format: Optional[str] = None):
+        """
+        Cambia la configuración en caliente (endpoint de administración). Todos los valores
+        se validan antes de aplicar ninguno: con uno erróneo no cambia nada.
+
+        Raises:
+            ValueError: Si algún valor no es válido
+        """
+        if output_format is not None and output_format not in FORMATS:
+            raise ValueError(f"Formato de perfil no soportado: {output_format} (usar {', '.join(FORMATS)})")
+        enabled = _parse_bool('enabled', enabled)
+        threshold_seconds = _parse_number('threshold_seconds', threshold_seconds, minimum=0.0)
+        interval_ms = _parse_number('interval_ms', interval_ms, minimum=1.0)
+        if enabled is not None:
+            self.enabled = enabled
+        if threshold_seconds is not None:
+            self.threshold_seconds = threshold_seconds
+        if interval_ms is not None:
+            self.interval_ms = interval_ms
+        if output_format is not None:
+            self.output_format = output_format
+        logger.info(f"Profiler: enabled={self.enabled}, umbral={self.threshold_seconds}s, "
+                    f"intervalo={self.interval_ms}ms, formato={self.output_format}")
+        return self.get_stats()
+
+    @contextmanager
+    def profile(self, name: str, trace_id: Optional[str] = None):
+        """
+        Perfila el hilo actual mientras dura el bloque (y los que se sumen con attach).
+        Con el profiler desactivado no hace nada.
+        """
+        if not self.enabled:
+            yield None
+            return
+        capture = ProfileCapture(name, trace_id)
+        capture.add_thread(threading.current_thread())
+        token = _current_capture.set(capture)
+        self._register(capture)
+        try:
+            yield capture
+        finally:
+            _current_capture.reset(token)
+            self._unregister(capture)
+            capture.duration = time.perf_counter() - capture.started
+            self.profiled += 1
+            if capture.duration >= self.threshold_seconds and capture.samples:
+                # Un fallo al exportar nunca debe hacer fallar la petición perfilada
+                try:
+                    self._save(capture)
+                except Exception as e:
+                    logger.error(f"Profiler: no se pudo exportar el perfil de {capture.trace_id}: {e}")
+
+    @staticmethod
+    def current() -> Optional[ProfileCapture]:
+        return _current_capture.get()
+
+    @contextmanager
+    def attach(self, capture: Optional[ProfileCapture]):
+        """Suma el hilo actual (p. ej. el de una herramienta) al perfil de la petición"""
+        if capture is None:
+            yield
+            return
+        thread = threading.current_thread()
+        capture.add_thread(thread)
+        try:
+            yield
+        finally:
+            capture.remove_thread(thread)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'threshold_seconds': self.threshold_seconds,
+            'interval_ms': self.interval_ms,
+            'format': self.output_format,
+            'output_dir': self.output_dir,
+            'active': len(self._captures),
+            'profiled': self.profiled,
+            'saved': self.saved,
+            'last_profile': self.last_profile,
+        }
+
+    # ------------------------------------------------------------------
+    # Muestreo
+    # ------------------------------------------------------------------
+    def _register(self, capture: ProfileCapture):
+        with self._lock:
+            self._captures.append(capture)
+            if self._sampler is None or not self._sampler.is_alive():
+                self._sampler = threading.Thread(target=self._sample_loop, name='profiler-sampler', daemon=True)
+                self._sampler.start()
+            self._wake.set()
+
+    def _unregister(self, capture: ProfileCapture):
+        # El muestreo se hace con el lock: al volver, el sampler ya no escribe en capture.samples
+        with self._lock:
+            if capture in self._captures:
+                self._captures.remove(capture)
+
+    def _sample_loop(self):
+        last = time.perf_counter()
+        while True:
+            with self._lock:
+                active = bool(self._captures)
+                if active:
+                    last = self._sample(last)
+                else:
+                    self._wake.clear()
+            if not active:
+                # Sin peticiones perfiladas el hilo duerme hasta la siguiente
+                self._wake.wait()
+                last = time.perf_counter()
+                continue
+            # Event nativo: no depende de que time.sleep esté parcheado por gevent/eventlet
+            self._tick.wait(self.interval_ms / 1000.0)
+
+    def _sample(self, last: float) -> float:
+        """Una muestra de los hilos de todas las peticiones perfiladas (llamar con el lock)"""
+        # Cada muestra pesa el tiempo real desde la anterior (el bucle puede ir más lento que el intervalo)
+        now = time.perf_counter()
+        elapsed = now - last
+        frames = sys._current_frames()
+        try:
+            for capture in self._captures:
+                for ident, thread_name in list(capture.threads.items()):
+                    frame = frames.get(ident)
+                    if frame is None:
+                        continue
+                    key = (thread_name, self._stack(frame))
+                    entry = capture.samples.get(key)
+                    if entry is None:
+                        capture.samples[key] = [1, elapsed]
+                    else:
+                        entry[0] += 1
+                        entry[1] += elapsed
+                    capture.sample_count += 1
+        finally:
+            del frames
+        return now
+
+    @staticmethod
+    def _stack(frame) -> Tuple[Any, ...]:
+        codes = []
+        while frame is not None and len(codes) < MAX_STACK_DEPTH:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        codes.reverse()
+        return tuple(codes)
+
+    def _frame_name(self, code) -> str:
+        name = self._frame_names.get(code)
+        if name is None:
+            filename = code.co_filename
+            try:
+                filename = os.path.relpath(filename)
+            except ValueError:
+                pass
+            name = f"{code.co_name} ({filename}:{code.co_firstlineno})"
+            self._frame_names[code] = name
+        return name
+
+    # ------------------------------------------------------------------
+    # Exportación
+    # ------------------------------------------------------------------
+    def _save(self, capture: ProfileCapture):
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(capture.start_time))
+        base = f"{stamp}_{capture.trace_id or 'notrace'}_{int(capture.duration * 1000)}ms"
+        if self.output_format == 'collapsed':
+            path = os.path.join(self.output_dir, f"{base}.folded")
+            data = self._collapsed(capture)
+        else:
+            path = os.path.join(self.output_dir, f"{base}.speedscope.json")
+            data = serialization.dumps_bytes(self._speedscope(capture))
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+            self._prune()
+        except OSError as e:
+            logger.error(f"Profiler: no se pudo guardar el perfil {path}: {e}")
+            return
+        self.saved += 1
+        self.last_profile = path
+        logger.warning(f"Profiler: petición lenta '{capture.name}' (trace {capture.trace_id}, "
+                       f"{capture.duration:.2f}s, {capture.sample_count} muestras) -> {path}")
+        from app.utils.tracing import tracer
+        span = tracer.current_span()
+        if span is not None:
+            span.set_attribute('profile', path)
+
+    def _collapsed(self, capture: ProfileCapture) -> bytes:
+        """Formato de flamegraph.pl / speedscope: 'hilo;raíz;...;hoja muestras' por línea"""
+        lines = []
+        for (thread_name, stack), (count, _seconds) in capture.samples.items():
+            names = [thread_name] + [self._frame_name(code).replace(';', ':') for code in stack]
+            lines.append(f"{';'.join(names)} {count}")
+        header = f"# {capture.name} trace_id={capture.trace_id} duration={capture.duration:.3f}s\n"
+        return (header + '\n'.join(lines) + '\n').encode('utf-8')
+
+    def _speedscope(self, capture: ProfileCapture) -> Dict[str, Any]:
+        """Un perfil 'sampled' por hilo, con el peso de cada pila en segundos"""
+        frame_index: Dict[Any, int] = {}
+        frames: List[Dict[str, Any]] = []
+        per_thread: Dict[str, Dict[str, list]] = {}
+        for (thread_name, stack), (_count, seconds) in capture.samples.items():
+            indexes = []
+            for code in stack:
+                index = frame_index.get(code)
+                if index is None:
+                    index = frame_index[code] = len(frames)
+                    frames.append({'name': code.co_name, 'file': code.co_filename, 'line': code.co_firstlineno})
+                indexes.append(index)
+            profile = per_thread.setdefault(thread_name, {'samples': [], 'weights': []})
+            profile['samples'].append(indexes)
+            profile['weights'].append(round(seconds, 6))
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': f"{capture.name} {capture.trace_id or ''}".strip(),
+            'exporter': 'IALab-Suite sampling profiler',
+            'activeProfileIndex': 0,
+            'shared': {'frames': frames},
+            'profiles': [
+                {
+                    'type': 'sampled',
+                    'name': thread_name,
+                    'unit': 'seconds',
+                    'startValue': 0,
+                    'endValue': sum(data['weights']),
+                    'samples': data['samples'],
+                    'weights': data['weights'],
+                }
+                for thread_name, data in per_thread.items()
+            ],
+            'metadata': {
+                'trace_id': capture.trace_id,
+                'duration_seconds': round(capture.duration, 4),
+                'interval_ms': self.interval_ms,
+                'samples': capture.sample_count,
+            },
+        }
+
+    def _prune(self):
+        """Conserva solo los max_files perfiles más recientes"""
+        if self.max_files <= 0:
+            return
+        entries = [os.path.join(self.output_dir, name) for name in os.listdir(self.output_dir)
+                   if name.endswith(('.speedscope.json', '.folded'))]
+        if len(entries) <= self.max_files:
+            return
+        entries.sort(key=os.path.getmtime)
+        for path in entries[:len(entries) - self.max_files]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+# Instancia global del profiler
+profiler = SamplingProfiler(
+    Config.PROFILES_DIR,
+    enabled=Config.PROFILER_ENABLED,
+    threshold_seconds=Config.PROFILER_THRESHOLD_SECONDS,
+    interval_ms=Config.PROFILER_INTERVAL_MS,
+    output_format=Config.PROFILER_FORMAT,
+    max_files=Config.PROFILER_MAX_FILES,
+)
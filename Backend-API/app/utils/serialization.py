@@ -0,0 +1,171 @@
+"""
+@Author: Borja Otero Ferreira
+Serialization - Capa de serialización común para Socket.IO, HTTP y ficheros
+Usa orjson si está instalado (con json de la librería estándar como alternativa) y
+MessagePack opcional para los frames binarios de Socket.IO
+"""
+import dataclasses
+import json
+from enum import Enum
+from typing import Any, Optional
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    msgpack = None
+    MSGPACK_AVAILABLE = False
+
+if ORJSON_AVAILABLE:
+    # Claves no str (p. ej. enteros) como json; dataclasses y objetos pasan por _default
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATACLASS
+else:
+    _ORJSON_OPTIONS = 0
+
+
+def _default(obj: Any) -> Any:
+    """
+    Tipos que no son JSON nativo, con las mismas reglas que make_json_serializable:
+    enums por su valor y objetos por sus atributos públicos
+    """
+    if isinstance(obj, Enum):
+        return obj.value
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return {k: v for k, v in obj.__dict__.items() if not k.startswith('_')}
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if isinstance(obj, bytes):
+        return obj.decode('utf-8', errors='replace')
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    if hasattr(obj, '__dict__'):
+        return {k: v for k, v in obj.__dict__.items() if not k.startswith('_')}
+    return str(obj)
+
+
+def dumps_bytes(obj: Any, indent: bool = False, sort_keys: bool = False) -> bytes:
+    """Codifica a JSON en UTF-8"""
+    if ORJSON_AVAILABLE:
+        options = _ORJSON_OPTIONS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        if sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=_default, option=options)
+    return json.dumps(obj, default=_default, ensure_ascii=False, sort_keys=sort_keys,
+                      indent=2 if indent else None,
+                      separators=None if indent else (',', ':')).encode('utf-8')
+
+
+def dumps(obj: Any, indent: bool = False, sort_keys: bool = False) -> str:
+    """Codifica a JSON (str)"""
+    return dumps_bytes(obj, indent=indent, sort_keys=sort_keys).decode('utf-8')
+
+
+def loads(data: Any) -> Any:
+    """Decodifica JSON desde str o bytes"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = bytes(data).decode('utf-8')
+    return json.loads(data)
+
+
+def to_jsonable(obj: Any) -> Any:
+    """
+    Convierte un objeto (enums, objetos con atributos, dataclasses...) en tipos JSON
+    nativos. Con orjson la conversión se hace en C en lugar de recorrer el objeto en Python.
+    """
+    if ORJSON_AVAILABLE:
+        return orjson.loads(orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS))
+    return _to_jsonable_py(obj)
+
+
+def _to_jsonable_py(obj: Any) -> Any:
+    if isinstance(obj, dict):
+        return {k: _to_jsonable_py(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_to_jsonable_py(item) for item in obj]
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    return _to_jsonable_py(_default(obj))
+
+
+def dump_file(obj: Any, path: str, indent: bool = True):
+    """Escribe JSON en un fichero"""
+    with open(path, 'wb') as f:
+        f.write(dumps_bytes(obj, indent=indent))
+
+
+def load_file(path: str) -> Any:
+    """Lee JSON de un fichero"""
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+
+# ----------------------------------------------------------------------
+# Socket.IO
+# ----------------------------------------------------------------------
+class SocketIOJSON:
+    """
+    Módulo json para SocketIO(json=...): python-socketio llama a dumps/loads con los
+    argumentos de la librería estándar (separators, etc.), que aquí se ignoran
+    """
+
+    @staticmethod
+    def dumps(obj: Any, *args, **kwargs) -> str:
+        return dumps(obj)
+
+    @staticmethod
+    def loads(data: Any, *args, **kwargs) -> Any:
+        return loads(data)
+
+
+socketio_json = SocketIOJSON()
+
+
+def socketio_options(serializer: Optional[str] = None) -> dict:
+    """
+    Argumentos de SocketIO() según el serializador configurado
+
+    Args:
+        serializer: 'json' (por defecto) o 'msgpack' (frames binarios; el cliente debe
+            usar socket.io-msgpack-parser). Si msgpack no está instalado se usa JSON.
+    """
+    if serializer == 'msgpack':
+        if MSGPACK_AVAILABLE:
+            return {'serializer': 'msgpack'}
+        from app.utils.logger import logger
+        logger.warning("SOCKETIO_SERIALIZER=msgpack pero msgpack no está instalado: se usa JSON")
+    return {'json': socketio_json}
+
+
+# ----------------------------------------------------------------------
+# Flask
+# ----------------------------------------------------------------------
+try:
+    from flask.json.provider import JSONProvider
+
+    class FastJSONProvider(JSONProvider):
+        """Proveedor JSON de Flask (jsonify, request.get_json) sobre esta capa"""
+
+        def dumps(self, obj: Any, **kwargs) -> str:
+            return dumps(obj, sort_keys=bool(kwargs.get('sort_keys')))
+
+        def loads(self, s: Any, **kwargs) -> Any:
+            return loads(s)
+
+except ImportError:
+    FastJSONProvider = None
+
+
+def get_backend() -> str:
+    """Nombre del codificador JSON en uso"""
+    return 'orjson' if ORJSON_AVAILABLE else 'json'
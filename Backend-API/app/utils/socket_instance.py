@@ -62,3 +62,85 @@ def emit_safely(event, data, namespace=None, room=None, **kwargs):
         logger.error(f"Error al emitir evento '{event}': {e}")
         logger.debug(f"Traceback: {traceback.format_exc()}")
         return False
+
+
+def conversation_room(conversation_id: str) -> str:
+    """Nombre de la sala Socket.IO de una conversación"""
+    return f'conversation:{conversation_id}'
+
+
+class ClientChannel:
+    """
+    Socket restringido a un destinatario: el sid que hizo la petición o la sala de
+    la conversación. Expone la misma interfaz emit() que la instancia socketio, de modo
+    que agentes, RAG y herramientas lo usan sin cambios. Sin destinatario emite a todo
+    el namespace (comportamiento anterior).
+    
+    Con ring (buffer de la petición) los eventos de la respuesta se numeran y se guardan
+    para que el cliente pueda reanudar el stream tras una reconexión. Con recorder
+    (conversación guardada en el servidor) la respuesta se añade al historial.
+    """
+    
+    def __init__(self, socketio, to=None, sid=None, ring=None, recorder=None):
+        self.socketio = socketio
+        self.to = to
+        self.sid = sid
+        self.ring = ring
+        self.recorder = recorder
+        if ring is not None:
+            ring.channel = self
+    
+    @property
+    def request_id(self):
+        return self.ring.request_id if self.ring is not None else None
+    
+    @property
+    def client_id(self):
+        """Identificador del cliente (para su cadencia de streaming)"""
+        return self.sid or self.to
+    
+    def emit(self, event, data=None, namespace=None, **kwargs):
+        from app.utils.stream_buffer import BUFFERED_EVENTS
+        if self.recorder is not None and event == 'assistant_response' and isinstance(data, dict):
+            data = self.recorder.feed(data)
+        ring = self.ring
+        if ring is None or event not in BUFFERED_EVENTS or not isinstance(data, dict):
+            return self._send(event, data, namespace, kwargs)
+        # Numerar, guardar y emitir de forma atómica frente a un resume concurrente
+        with ring.lock:
+            return self._send(event, ring.append(event, data), namespace, kwargs)
+    
+    def redirect(self, sid):
+        """Envía lo que queda del stream a otro sid (cliente que ha reconectado)"""
+        if self.to == self.sid:
+            self.to = sid
+        self.sid = sid
+    
+    def _send(self, event, data, namespace, kwargs):
+        if self.to and 'to' not in kwargs and 'room' not in kwargs:
+            kwargs['to'] = self.to
+        return self.socketio.emit(event, data, namespace=namespace or '/test', **kwargs)
+    
+    def __getattr__(self, name):
+        # start_background_task, sleep, etc. se delegan en la instancia socketio
+        return getattr(self.socketio, name)
+    
+    def __repr__(self):
+        return f"ClientChannel(to={self.to!r}, request_id={self.request_id!r})"
+
+
+def client_channel(socketio=None, sid=None, room=None, ring=None, recorder=None):
+    """
+    Canal hacia un cliente concreto
+    
+    Args:
+        socketio: Instancia socketio (por defecto la global)
+        sid: sid del cliente que hizo la petición
+        room: Sala de la conversación (si se indica, tiene prioridad sobre el sid)
+        ring: Buffer de la petición para poder reanudar el stream
+        recorder: TurnRecorder que guarda la respuesta en la conversación
+    """
+    socketio = socketio or get_socketio()
+    if isinstance(socketio, ClientChannel):
+        return socketio
+    return ClientChannel(socketio, to=room or sid, sid=sid, ring=ring, recorder=recorder)
@@ -0,0 +1,165 @@
+"""
+@Author: Borja Otero Ferreira
+Stream Buffer - Buffer circular de los envíos de cada petición para reanudar streams
+Cada frame emitido a un cliente lleva request_id y un número de secuencia; si la conexión
+se corta, el cliente reconecta y pide resume(request_id, last_seq) para recibir solo lo
+que le falta, sin volver a generar la respuesta
+"""
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from app.config.settings import Config
+from app.utils.logger import logger
+
+# Eventos que forman parte de la respuesta y se guardan para reanudar
+BUFFERED_EVENTS = ('assistant_response', 'output_console', 'utilidades')
+
+
+class StreamRing:
+    """Últimos frames emitidos de una petición (acotado a max_frames)"""
+
+    def __init__(self, request_id: str, session_id: Optional[str], client_sid: Optional[str],
+                 max_frames: int):
+        self.request_id = request_id
+        self.session_id = session_id
+        self.client_sid = client_sid          # sid que recibe el stream ahora mismo
+        self.channel = None                   # ClientChannel que emite el stream
+        self.frames: Deque[Tuple[int, str, Dict[str, Any]]] = deque(maxlen=max_frames)
+        self.next_seq = 0
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.resumes = 0
+        # Se emite con el lock tomado: un resume nunca pierde ni duplica frames
+        self.lock = threading.RLock()
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def append(self, event: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Numera un frame, lo guarda y devuelve la copia que se debe emitir"""
+        with self.lock:
+            frame = dict(data, request_id=self.request_id, seq=self.next_seq)
+            self.frames.append((self.next_seq, event, frame))
+            self.next_seq += 1
+            if event == 'assistant_response' and data.get('finished'):
+                self.finished_at = time.time()
+            return frame
+
+    def since(self, last_seq: int) -> Tuple[List[Tuple[int, str, Dict[str, Any]]], bool]:
+        """
+        Frames posteriores a last_seq
+
+        Returns:
+            tuple: (frames, truncated) - truncated si parte de la cola ya salió del buffer
+        """
+        with self.lock:
+            frames = [f for f in self.frames if f[0] > last_seq]
+            oldest = self.frames[0][0] if self.frames else self.next_seq
+            return frames, oldest > last_seq + 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'request_id': self.request_id,
+            'session_id': self.session_id,
+            'client_sid': self.client_sid,
+            'next_seq': self.next_seq,
+            'buffered_frames': len(self.frames),
+            'finished': self.finished,
+            'resumes': self.resumes,
+            'created_at': self.created_at,
+        }
+
+
+class StreamBufferRegistry:
+    """
+    Buffers por request_id.
+
+    Los buffers de peticiones terminadas se conservan ttl_seconds para que un cliente
+    que reconecta justo al final pueda recuperar el cierre; después se descartan.
+    """
+
+    def __init__(self, max_frames: int = 4096, ttl_seconds: float = 300.0):
+        self.max_frames = max_frames
+        self.ttl_seconds = ttl_seconds
+        self._rings: Dict[str, StreamRing] = {}
+        self._lock = threading.Lock()
+
+    def create(self, request_id: str, session_id: Optional[str] = None,
+               client_sid: Optional[str] = None) -> StreamRing:
+        ring = StreamRing(request_id, session_id, client_sid, self.max_frames)
+        with self._lock:
+            self._expire()
+            self._rings[request_id] = ring
+        return ring
+
+    def get(self, request_id: str) -> Optional[StreamRing]:
+        with self._lock:
+            return self._rings.get(request_id)
+
+    def active_for(self, client_sid: str) -> List[StreamRing]:
+        """Streams sin terminar que se están enviando a un sid"""
+        with self._lock:
+            return [r for r in self._rings.values() if r.client_sid == client_sid and not r.finished]
+
+    def resume(self, request_id: str, last_seq: int, send: Callable[[str, Dict[str, Any]], Any],
+               sid: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Reenvía los frames posteriores a last_seq
+
+        Args:
+            request_id: Petición a reanudar
+            last_seq: Último seq recibido por el cliente (-1 si no recibió ninguno)
+            send: Callable(evento, frame) que emite al cliente que reconecta
+            sid: sid del cliente que reconecta; si el stream sigue en curso, los frames
+                siguientes se le envían a él (con el lock tomado: sin huecos ni duplicados)
+
+        Returns:
+            dict: Estado del stream o None si el request_id no existe (o ya expiró)
+        """
+        ring = self.get(request_id)
+        if ring is None:
+            return None
+        with ring.lock:
+            frames, truncated = ring.since(last_seq)
+            for _, event, frame in frames:
+                send(event, frame)
+            if sid and not ring.finished:
+                ring.client_sid = sid
+                if ring.channel is not None:
+                    ring.channel.redirect(sid)
+            ring.resumes += 1
+            logger.info(f"Stream {request_id}: reanudado desde seq {last_seq} "
+                        f"({len(frames)} frames reenviados{', truncado' if truncated else ''})")
+            return {
+                'request_id': request_id,
+                'session_id': ring.session_id,
+                'replayed': len(frames),
+                'truncated': truncated,
+                'finished': ring.finished,
+                'next_seq': ring.next_seq,
+            }
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            rings = list(self._rings.values())
+        return {
+            'buffers': len(rings),
+            'active': sum(1 for r in rings if not r.finished),
+            'max_frames': self.max_frames,
+            'ttl_seconds': self.ttl_seconds,
+        }
+
+    def _expire(self):
+        """Descarta los buffers terminados hace más de ttl_seconds (llamar con el lock)"""
+        now = time.time()
+        for request_id in [rid for rid, r in self._rings.items()
+                           if (r.finished_at or r.created_at + Config.STREAM_BUFFER_MAX_AGE_SECONDS)
+                           + self.ttl_seconds < now]:
+            del self._rings[request_id]
+
+
+# Instancia global de buffers de stream
+stream_buffers = StreamBufferRegistry(Config.STREAM_BUFFER_FRAMES, Config.STREAM_BUFFER_TTL_SECONDS)
@@ -0,0 +1,288 @@
+"""
+@Author: Borja Otero Ferreira
+Tracing - Trazas de extremo a extremo de cada petición (asistente, agente, herramientas, stream)
+Cada petición abre una traza (id = request_id del stream) y las fases abren spans hijos
+con atributos; el span activo se guarda en un ContextVar del hilo. Los spans terminados se
+escriben como líneas JSON en logs/traces.jsonl desde un hilo aparte y, opcionalmente, se
+emiten al cliente ('trace_span'). Las llamadas al LLM registran tokens de prompt y de
+respuesta y tiempos de evaluación.
+
+Uso:
+    with tracer.start_trace('chat', request_id=rid, session_id=sid):
+        with tracer.span('agent', agent='adaptive') as span:
+            span.set_attribute('steps', 3)
+            for chunk in llm_stream(model, messages, 'llm.reflection', max_tokens=300):
+                ...
+"""
+import os
+import queue
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from app.config.settings import Config
+from app.utils import serialization
+from app.utils.logger import logger
+
+_current_span: ContextVar[Optional['Span']] = ContextVar('ialab_current_span', default=None)
+
+
+class Span:
+    """Fase de una petición: nombre, padre, atributos, duración y error"""
+
+    def __init__(self, tracer: 'Tracer', name: str, trace_id: str, parent: Optional['Span'] = None,
+                 attributes: Optional[Dict[str, Any]] = None, emit: Optional[Callable] = None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.root = parent.root if parent is not None else self
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.emit = emit
+        self.start_time = time.time()
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+        self._started = time.perf_counter()
+        self._token = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error: Optional[BaseException] = None):
+        """Cierra el span (solo la primera vez) y lo exporta"""
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._started
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.tracer.export(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self.start_time,
+            'duration_ms': round((self.duration or 0.0) * 1000, 3),
+            'status': 'error' if self.error else 'ok',
+            'error': self.error,
+            'attributes': self.attributes,
+        }
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._token is not None:
+            _current_span.reset(self._token)
+            self._token = None
+        self.end(exc if exc_type is not None and not issubclass(exc_type, GeneratorExit) else None)
+        return False
+
+
+class _NoopSpan:
+    """Span sin traza activa (o con el tracing desactivado): no mide ni exporta nada"""
+
+    trace_id = None
+    span_id = None
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def set_attributes(self, **attributes):
+        pass
+
+    def end(self, error: Optional[BaseException] = None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """Crea trazas y spans y escribe los terminados en un fichero JSONL (con rotación)"""
+
+    def __init__(self, path: str, enabled: bool = True, max_bytes: int = 50 * 1024 ** 2,
+                 emit_to_client: bool = False):
+        self.path = path
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.emit_to_client = emit_to_client
+        self._queue: "queue.SimpleQueue[Dict[str, Any]]" = queue.SimpleQueue()
+        self._writer: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.traces = 0
+        self.spans = 0
+        self.dropped = 0
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+    def start_trace(self, name: str, request_id: Optional[str] = None, socket: Any = None,
+                    **attributes) -> Any:
+        """
+        Span raíz de una petición (usar con with)
+
+        Args:
+            name: Nombre de la petición (p. ej. 'chat')
+            request_id: Id de la petición; se usa como trace_id para cruzarlo con el stream
+            socket: Canal del cliente; con TRACE_EMIT_TO_CLIENT recibe cada span ('trace_span')
+        """
+        if not self.enabled:
+            return NOOP_SPAN
+        emit = None
+        if self.emit_to_client and socket is not None and hasattr(socket, 'emit'):
+            emit = socket.emit
+        self.traces += 1
+        return Span(self, name, request_id or uuid.uuid4().hex, attributes=attributes, emit=emit)
+
+    def span(self, name: str, **attributes) -> Any:
+        """
+        Span hijo del activo; con with pasa a ser el activo mientras dura el bloque, sin
+        with se cierra con end(). Sin traza activa no hace nada.
+        """
+        parent = _current_span.get()
+        if parent is None or not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, parent.trace_id, parent=parent, attributes=attributes)
+
+    @staticmethod
+    def current_span() -> Optional[Span]:
+        return _current_span.get()
+
+    def current_trace_id(self) -> Optional[str]:
+        span = _current_span.get()
+        return span.trace_id if span is not None else None
+
+    def export(self, span: Span):
+        data = span.to_dict()
+        self.spans += 1
+        self._ensure_writer()
+        self._queue.put(data)
+        emit = span.root.emit
+        if emit is not None:
+            try:
+                emit('trace_span', data)
+            except Exception as e:
+                logger.debug(f"Tracing: no se pudo emitir el span {span.name}: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'path': self.path,
+            'traces': self.traces,
+            'spans': self.spans,
+            'dropped': self.dropped,
+            'emit_to_client': self.emit_to_client,
+        }
+
+    # ------------------------------------------------------------------
+    # Escritura
+    # ------------------------------------------------------------------
+    def _ensure_writer(self):
+        if self._writer is not None:
+            return
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name='trace-writer', daemon=True)
+                self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            lines: List[bytes] = [serialization.dumps_bytes(self._queue.get())]
+            # Agrupar lo que haya acumulado en una sola escritura
+            while len(lines) < 512:
+                try:
+                    lines.append(serialization.dumps_bytes(self._queue.get_nowait()))
+                except queue.Empty:
+                    break
+            try:
+                self._rotate()
+                with open(self.path, 'ab') as f:
+                    f.write(b'\n'.join(lines) + b'\n')
+            except OSError as e:
+                self.dropped += len(lines)
+                logger.error(f"Tracing: no se pudieron escribir {len(lines)} spans en {self.path}: {e}")
+
+    def _rotate(self):
+        """Con el fichero por encima del límite se renombra a .1 (se conserva una copia)"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        try:
+            if self.max_bytes > 0 and os.path.getsize(self.path) > self.max_bytes:
+                os.replace(self.path, f"{self.path}.1")
+        except FileNotFoundError:
+            pass
+
+
+def llm_stream(model: Any, messages: List[Dict], name: str = 'llm', prompt_tokens: Optional[int] = None,
+               **kwargs) -> Iterator[Dict[str, Any]]:
+    """
+    model.create_chat_completion(messages, stream=True, **kwargs) con un span que registra
+    tokens de prompt y respuesta y tiempos de evaluación. Sin traza activa devuelve el
+    iterador del modelo tal cual.
+
+    prompt_tokens es el recuento ya calculado por el llamante (p. ej. el del presupuesto de
+    contexto); si no se pasa se toma del usage de la respuesta o se cuenta solo con un
+    modelo local (con un RemoteModel costaría otra ida y vuelta al worker).
+    """
+    span = tracer.span(name, max_tokens=kwargs.get('max_tokens'))
+    if span is NOOP_SPAN:
+        return model.create_chat_completion(messages=messages, stream=True, **kwargs)
+    return _traced_stream(model, messages, span, prompt_tokens, kwargs)
+
+
+def _traced_stream(model: Any, messages: List[Dict], span: Span, prompt_tokens: Optional[int],
+                   kwargs: Dict[str, Any]):
+    started = time.perf_counter()
+    first_token_at = None
+    completion_tokens = 0
+    error = None
+    try:
+        for chunk in model.create_chat_completion(messages=messages, stream=True, **kwargs):
+            usage = chunk.get('usage')
+            if usage and usage.get('prompt_tokens') is not None:
+                prompt_tokens = usage['prompt_tokens']
+            if chunk['choices'] and chunk['choices'][0]['delta'].get('content'):
+                completion_tokens += 1
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+            yield chunk
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        if prompt_tokens is None and not getattr(model, 'remote', False):
+            from app.core.context_budget import context_budgeter
+            prompt_tokens = context_budgeter.count_messages(model, messages)
+        end = time.perf_counter()
+        decode_start = first_token_at or end
+        span.set_attributes(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            prompt_eval_seconds=round(decode_start - started, 4),
+            eval_seconds=round(end - decode_start, 4),
+            tokens_per_second=round((completion_tokens - 1) / (end - decode_start), 2)
+            if completion_tokens > 1 and end > decode_start else 0.0,
+        )
+        span.end(error)
+
+
+# Instancia global del tracer
+tracer = Tracer(Config.TRACE_FILE, Config.TRACING_ENABLED, Config.TRACE_MAX_MB * 1024 ** 2,
+                Config.TRACE_EMIT_TO_CLIENT)
@@ -0,0 +1,107 @@
+"""
+@Author: Borja Otero Ferreira
+Benchmark de serialización: coste de codificar/decodificar los payloads típicos
+(registro de herramientas, historial de chat y frames de tokens) con json de la
+librería estándar, la capa app.utils.serialization (orjson) y MessagePack
+
+Uso: python benchmarks/serialization_bench.py [iteraciones]
+"""
+import json
+import os
+import sys
+import timeit
+from enum import Enum
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils import serialization
+
+
+class ToolCategory(Enum):
+    SEARCH = 'search'
+    MEDIA = 'media'
+    SYSTEM = 'system'
+
+
+def registry_payload():
+    """Respuesta de /api/tools con ~40 herramientas"""
+    categories = list(ToolCategory)
+    return {
+        'success': True,
+        'tools': {
+            f'tool_{i}': {
+                'name': f'tool_{i}',
+                'description': 'Herramienta de ejemplo que busca información en la web ' * 3,
+                'category': categories[i % len(categories)],
+                'enabled': i % 2 == 0,
+                'parameters': {
+                    'query': {'type': 'string', 'description': 'Consulta', 'required': True},
+                    'max_results': {'type': 'integer', 'description': 'Resultados', 'default': 5},
+                },
+            }
+            for i in range(40)
+        },
+    }
+
+
+def chat_payload():
+    """Historial de chat con 200 mensajes (guardado en disco y /user_input)"""
+    return {
+        'content': [
+            {'role': 'user' if i % 2 == 0 else 'assistant',
+             'content': 'Explícame cómo funciona la caché KV de llama.cpp con detalle. ' * 8}
+            for i in range(200)
+        ]
+    }
+
+
+def token_payload():
+    """Frame de assistant_response (se emite decenas de veces por segundo)"""
+    return {'content': ' función', 'finished': False, 'assistant_token_count': 2,
+            'request_id': '1b4e28ba-2fa1-11d2-883f-0016d3cca427', 'seq': 1234}
+
+
+def stdlib_jsonable(obj):
+    """Conversión previa que hacía make_json_serializable en Python puro"""
+    if isinstance(obj, dict):
+        return {k: stdlib_jsonable(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [stdlib_jsonable(item) for item in obj]
+    if isinstance(obj, Enum):
+        return obj.value
+    if hasattr(obj, '__dict__'):
+        return {k: stdlib_jsonable(v) for k, v in obj.__dict__.items() if not k.startswith('_')}
+    return obj
+
+
+def encoders():
+    """(nombre, codificar, decodificar) de cada serializador disponible"""
+    result = [
+        ('json', lambda o: json.dumps(stdlib_jsonable(o), ensure_ascii=False),
+         json.loads),
+        (f'serialization ({serialization.get_backend()})', serialization.dumps_bytes,
+         serialization.loads),
+    ]
+    if serialization.MSGPACK_AVAILABLE:
+        import msgpack
+        result.append(('msgpack', lambda o: msgpack.packb(serialization.to_jsonable(o)),
+                       msgpack.unpackb))
+    return result
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    payloads = [('registro', registry_payload()), ('chat', chat_payload()),
+                ('token', token_payload())]
+    print(f"Iteraciones: {iterations}")
+    print(f"{'payload':<10} {'serializador':<24} {'bytes':>8} {'encode µs':>10} {'decode µs':>10}")
+    for payload_name, payload in payloads:
+        for name, encode, decode in encoders():
+            data = encode(payload)
+            encode_us = timeit.timeit(lambda: encode(payload), number=iterations) / iterations * 1e6
+            decode_us = timeit.timeit(lambda: decode(data), number=iterations) / iterations * 1e6
+            print(f"{payload_name:<10} {name:<24} {len(data):>8} {encode_us:>10.2f} {decode_us:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -8,26 +8,64 @@ import sys
 # Add the project root to Python path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+# Get environment configuration
+config_name = os.environ.get('FLASK_ENV', 'development')
+# Production: gevent/eventlet WSGI server instead of Werkzeug's development server
+async_mode = os.environ.get('SOCKETIO_ASYNC_MODE', 'gevent' if config_name == 'production' else 'threading')
+
+
+def monkey_patch(mode):
+    """
+    Patch sockets, select, time, etc. before anything else is imported.
+
+    threading is left native on purpose: the inference scheduler, batch engine,
+    tools and RAG run in real OS threads (llama.cpp releases the GIL) and the
+    event loop only serves sockets, so pings and other clients stay responsive.
+    """
+    if mode == 'gevent':
+        from gevent import monkey
+        monkey.patch_all(thread=False, queue=False)
+    elif mode == 'eventlet':
+        # tpool (eventlet's native thread pool) reads its size when first imported
+        os.environ.setdefault('EVENTLET_THREADPOOL_SIZE', os.environ.get('BLOCKING_POOL_SIZE', '16'))
+        import eventlet
+        eventlet.monkey_patch(thread=False)
+
+
+if async_mode in ('gevent', 'eventlet'):
+    os.environ['SOCKETIO_ASYNC_MODE'] = async_mode
+    monkey_patch(async_mode)
+
 from app.app import create_app
 
 def main():
-    # Get environment configuration
-    config_name = os.environ.get('FLASK_ENV', 'development')
-    
     # Create application
     app, socketio = create_app(config_name)
-    
+
     # Get host and port from environment or use defaults
     host = os.environ.get('HOST', '0.0.0.0')
     port = int(os.environ.get('PORT', 8081))
     debug = os.environ.get('DEBUG', 'False').lower() == 'true'
     use_reloader = os.environ.get('USE_RELOADER', 'False').lower() == 'true'
-    
+
     print(f"🚀 Starting IALab Suite API on {host}:{port}")
     print(f"🔧 Environment: {config_name}")
+    print(f"⚙️ Server: {async_mode}")
     print(f"🐛 Debug mode: {debug}")
     print(f"🔄 Auto-reload: {use_reloader}")
-    
+
+    if async_mode in ('gevent', 'eventlet'):
+        # Flask-SocketIO serves with gevent's pywsgi (+ gevent-websocket) or eventlet.wsgi
+        socketio.run(
+            app,
+            host=host,
+            port=port,
+            debug=debug,
+            use_reloader=False,
+            log_output=debug
+        )
+        return
+
     # Run the application
     socketio.run(
         app,
@@ -0,0 +1,10 @@
+"""
+@Author: Borja Otero Ferreira
+Configuración de pytest: importa el paquete app desde Backend-API
+Los tests solo cubren el núcleo en Python puro: app y app.core cargan sus módulos bajo
+demanda, así que basta con pytest (y numpy para el motor de batching), sin Flask ni llama_cpp
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -0,0 +1,131 @@
+"""
+@Author: Borja Otero Ferreira
+Tests del camino de error del ContinuousBatchEngine con un llama_cpp falso
+"""
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from app.config.settings import Config
+from app.core import batch_engine
+from app.core.batch_engine import BatchEngineManager, BatchSequence, ContinuousBatchEngine
+
+np = pytest.importorskip('numpy')
+TIMEOUT = 5
+
+
+class FakeBatch:
+    def __init__(self, n_tokens):
+        self.n_tokens = 0
+        self.token = [0] * n_tokens
+        self.pos = [0] * n_tokens
+        self.n_seq_id = [0] * n_tokens
+        self.seq_id = [[0] for _ in range(n_tokens)]
+        self.logits = [False] * n_tokens
+
+
+class FakeLlama:
+    model = object()
+    metadata = None
+
+    def n_ctx(self):
+        return 64
+
+    def n_vocab(self):
+        return 8
+
+    def token_eos(self):
+        return 7
+
+    def token_bos(self):
+        return 1
+
+    def tokenize(self, data, add_bos=True, special=False):
+        return [1] * len(data.split())
+
+
+@pytest.fixture
+def fake_llama_cpp(monkeypatch):
+    """llama_cpp mínimo: llama_decode espera a gate y falla con state.error si lo hay"""
+    state = SimpleNamespace(error=None, gate=threading.Event(), freed=0)
+    state.gate.set()
+
+    def llama_decode(ctx, batch):
+        state.gate.wait(TIMEOUT)
+        if state.error:
+            raise RuntimeError(state.error)
+        return 0
+
+    def llama_free(ctx):
+        state.freed += 1
+
+    fake = SimpleNamespace(
+        llama_batch_init=lambda n_tokens, embd, n_seq_max: FakeBatch(n_tokens),
+        llama_batch_free=lambda batch: None,
+        llama_context_default_params=lambda: SimpleNamespace(),
+        llama_new_context_with_model=lambda model, params: object(),
+        llama_kv_cache_seq_rm=lambda ctx, slot, p0, p1: None,
+        llama_decode=llama_decode,
+        llama_free=llama_free,
+    )
+    monkeypatch.setattr(batch_engine, 'llama_cpp', fake)
+    monkeypatch.setattr(batch_engine, 'np', np)
+    monkeypatch.setattr(batch_engine, 'BATCH_ENGINE_AVAILABLE', True)
+    return state
+
+
+def _sequence(prompt_length=4):
+    return BatchSequence([1] * prompt_length, max_tokens=8, on_token=lambda text: None)
+
+
+def test_decode_failure_finishes_active_and_waiting_sequences(fake_llama_cpp):
+    fake_llama_cpp.error = 'decode roto'
+    fake_llama_cpp.gate.clear()
+    engine = ContinuousBatchEngine(FakeLlama(), n_slots=1, n_batch=16)
+    # Una secuencia queda en el slot y las otras dos esperando mientras falla el decode
+    sequences = [_sequence() for _ in range(3)]
+    for sequence in sequences:
+        engine.submit(sequence)
+    fake_llama_cpp.gate.set()
+    for sequence in sequences:
+        assert sequence.wait(TIMEOUT)
+        assert sequence.finish_reason == 'error'
+        assert 'decode roto' in sequence.error
+
+    engine._thread.join(TIMEOUT)
+    assert not engine.alive
+    assert fake_llama_cpp.freed == 1
+    with pytest.raises(RuntimeError):
+        engine.submit(_sequence())
+
+
+def test_prompt_that_does_not_fit_a_slot_fails_without_truncation(fake_llama_cpp):
+    engine = ContinuousBatchEngine(FakeLlama(), n_slots=1, slot_ctx=8, n_batch=16)
+    sequence = engine.submit(_sequence(prompt_length=8))
+    assert sequence.done.is_set()
+    assert sequence.finish_reason == 'error'
+    assert sequence.prompt_tokens == [1] * 8
+    engine.shutdown()
+
+
+def test_manager_rebuilds_a_dead_engine(fake_llama_cpp, monkeypatch):
+    monkeypatch.setattr(Config, 'BATCH_ENGINE_ENABLED', True)
+    monkeypatch.setattr(Config, 'BATCH_ENGINE_SLOTS', 1)
+    monkeypatch.setattr(Config, 'BATCH_ENGINE_SLOT_CTX', 0)
+    monkeypatch.setattr(Config, 'BATCH_ENGINE_N_BATCH', 16)
+    manager = BatchEngineManager()
+    model = FakeLlama()
+
+    dead = manager.get(model)
+    fake_llama_cpp.error = 'decode roto'
+    failed = manager.submit_chat(model, [{'role': 'user', 'content': 'hola'}], max_tokens=4,
+                                 on_token=lambda text: None, on_done=None)
+    assert failed.wait(TIMEOUT) and failed.finish_reason == 'error'
+    dead._thread.join(TIMEOUT)
+    assert not dead.alive
+
+    fake_llama_cpp.error = None
+    engine = manager.get(model)
+    assert engine is not dead and engine.alive
+    manager.release(model)
@@ -0,0 +1,76 @@
+"""
+@Author: Borja Otero Ferreira
+Tests de ContextBudgeter.fit con un modelo falso (un token por palabra)
+"""
+from app.config.settings import Config
+from app.core.context_budget import TRUNCATION_MARKER, ContextBudgeter
+
+OVERHEAD = Config.CONTEXT_MESSAGE_OVERHEAD_TOKENS
+
+
+class FakeModel:
+    model_path = 'fake.gguf'
+
+    def __init__(self, n_ctx):
+        self._n_ctx = n_ctx
+
+    def n_ctx(self):
+        return self._n_ctx
+
+    def tokenize(self, data, add_bos=True, special=False):
+        return data.decode('utf-8').split()
+
+    def detokenize(self, tokens):
+        return ' '.join(tokens).encode('utf-8')
+
+
+def _words(count, word='w'):
+    return ' '.join(f'{word}{index}' for index in range(count))
+
+
+def _conversation():
+    return [
+        {'role': 'system', 'content': _words(10)},
+        {'role': 'user', 'content': _words(200)},
+        {'role': 'assistant', 'content': _words(200)},
+        {'role': 'user', 'content': _words(10, 'q')},
+    ]
+
+
+def test_conversation_that_fits_is_untouched():
+    messages = _conversation()
+    result = ContextBudgeter().fit(FakeModel(1000), messages)
+    assert result.messages == messages
+    assert result.prompt_tokens == 420 + 4 * OVERHEAD
+    assert result.max_tokens == 1000 - result.prompt_tokens
+    assert result.dropped == result.truncated == 0
+
+
+def test_max_response_tokens_caps_the_answer_and_the_reserve():
+    # La reserva de respuesta baja a max_response_tokens: el historial completo cabe
+    result = ContextBudgeter().fit(FakeModel(600), _conversation(), max_response_tokens=50)
+    assert result.dropped == 0
+    assert result.max_tokens == 50
+
+
+def test_drop_policy_removes_oldest_turns_and_keeps_system_and_last_user():
+    result = ContextBudgeter().fit(FakeModel(600), _conversation(), policy='drop')
+    assert [m['role'] for m in result.messages] == ['system', 'user']
+    assert result.messages[-1]['content'].startswith('q0')
+    assert result.dropped == 2
+    assert result.prompt_tokens == 20 + 2 * OVERHEAD
+    assert result.max_tokens == 600 - result.prompt_tokens
+
+
+def test_oversized_last_message_keeps_its_tail():
+    messages = [
+        {'role': 'system', 'content': 'sys'},
+        {'role': 'user', 'content': _words(1000)},
+    ]
+    result = ContextBudgeter().fit(FakeModel(512), messages)
+    content = result.messages[-1]['content']
+    assert result.truncated == 1
+    assert content.startswith(TRUNCATION_MARKER)
+    assert content.endswith('w999')
+    assert result.prompt_tokens <= 512 - min(Config.CONTEXT_RESPONSE_RESERVE_TOKENS, 256)
+    assert messages[-1]['content'].startswith('w0')  # La lista del llamante no cambia
@@ -0,0 +1,68 @@
+"""
+@Author: Borja Otero Ferreira
+Tests del ConversationStore: versiones y conflictos (409)
+"""
+import pytest
+
+from app.core.conversation_store import (ConversationStore, ConversationVersionError,
+                                         compact_message, replace_message)
+
+
+def test_append_user_on_current_version():
+    store = ConversationStore()
+    messages, version = store.replace('c1', [{'role': 'system', 'content': 'sys', 'id': 'x'}])
+    assert version == 1
+    assert messages == [{'role': 'system', 'content': 'sys'}]
+
+    messages, version = store.append_user('c1', 'hola', expected_version=1)
+    assert version == 2
+    assert messages[-1] == {'role': 'user', 'content': 'hola'}
+
+    assert store.append_assistant('c1', 'respuesta', base_version=2) == 3
+    assert store.get('c1').snapshot()[-1] == {'role': 'assistant', 'content': 'respuesta'}
+
+
+def test_stale_version_is_rejected():
+    store = ConversationStore()
+    store.replace('c1', [])
+    store.append_user('c1', 'uno', expected_version=1)
+    with pytest.raises(ConversationVersionError) as error:
+        store.append_user('c1', 'dos', expected_version=1)
+    assert error.value.expected == 1 and error.value.current == 2
+    assert len(store.get('c1').messages) == 1
+
+
+def test_unknown_conversation_is_rejected():
+    store = ConversationStore()
+    with pytest.raises(ConversationVersionError) as error:
+        store.append_user('missing', 'hola', expected_version=0)
+    assert error.value.current is None
+
+
+def test_assistant_answer_for_a_replaced_turn_is_discarded():
+    store = ConversationStore()
+    store.replace('c1', [])
+    _, version = store.append_user('c1', 'hola', expected_version=1)
+    store.replace('c1', [{'role': 'user', 'content': 'otra cosa'}])
+    assert store.append_assistant('c1', 'tarde', base_version=version) == 3
+    assert store.get('c1').snapshot() == [{'role': 'user', 'content': 'otra cosa'}]
+
+
+def test_versions_share_messages_without_mutating_them():
+    store = ConversationStore()
+    before, _ = store.replace('c1', [{'role': 'user', 'content': 'hola'}])
+    changed = replace_message(before, 0, content='hola /no_think')
+    assert before[0]['content'] == 'hola'
+    assert changed[0]['content'] == 'hola /no_think'
+    assert store.get('c1').snapshot()[0]['content'] == 'hola'
+    assert compact_message('texto', role='assistant') == {'role': 'assistant', 'content': 'texto'}
+
+
+def test_least_recently_used_conversation_is_dropped_over_the_limit():
+    store = ConversationStore(max_conversations=2, idle_ttl_seconds=0)
+    store.replace('a', [])
+    store.replace('b', [])
+    store.get('a')
+    store.replace('c', [])
+    assert store.get('b') is None
+    assert store.get('a') is not None and store.get('c') is not None
@@ -0,0 +1,58 @@
+"""
+@Author: Borja Otero Ferreira
+Tests del formato de texto de Prometheus de las métricas
+"""
+import pytest
+
+from app.utils.metrics import MetricsRegistry
+
+
+def test_render_counter_gauge_and_histogram():
+    registry = MetricsRegistry()
+    calls = registry.counter('test_calls_total', 'Llamadas', ('tool', 'outcome'))
+    calls.labels('web_search', 'ok').inc()
+    calls.labels(tool='web_search', outcome='ok').inc(2)
+    depth = registry.gauge('test_depth', 'Profundidad')
+    depth.set_function(lambda: 3)
+    latency = registry.histogram('test_seconds', 'Latencia', buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 2.0):
+        latency.observe(value)
+
+    assert registry.render().splitlines() == [
+        '# HELP test_calls_total Llamadas',
+        '# TYPE test_calls_total counter',
+        'test_calls_total{tool="web_search",outcome="ok"} 3',
+        '# HELP test_depth Profundidad',
+        '# TYPE test_depth gauge',
+        'test_depth 3',
+        '# HELP test_seconds Latencia',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{le="0.1"} 1',
+        'test_seconds_bucket{le="1"} 2',
+        'test_seconds_bucket{le="+Inf"} 3',
+        'test_seconds_sum 2.55',
+        'test_seconds_count 3',
+    ]
+
+
+def test_label_values_are_escaped():
+    registry = MetricsRegistry()
+    registry.counter('test_escape_total', 'Escape', ('path',)).labels('a"b\\c\nd').inc()
+    assert 'test_escape_total{path="a\\"b\\\\c\\nd"} 1' in registry.render()
+
+
+def test_failing_gauge_function_renders_nan():
+    registry = MetricsRegistry()
+    registry.gauge('test_broken', 'Rota').set_function(lambda: 1 / 0)
+    assert 'test_broken NaN' in registry.render()
+
+
+def test_invalid_usage_is_rejected():
+    registry = MetricsRegistry()
+    counter = registry.counter('test_total', 'Total', ('outcome',))
+    with pytest.raises(ValueError):
+        counter.labels('a', 'b')
+    with pytest.raises(ValueError):
+        counter.labels('ok').inc(-1)
+    with pytest.raises(ValueError):
+        registry.gauge('test_total', 'Duplicada')
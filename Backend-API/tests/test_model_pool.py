@@ -0,0 +1,86 @@
+"""
+@Author: Borja Otero Ferreira
+Tests del ModelPool: expulsión LRU y cargas concurrentes del mismo modelo
+"""
+import threading
+import time
+
+import pytest
+
+from app.core.model_pool import ModelPool
+
+
+class FakeLlama:
+    def __init__(self, name):
+        self.name = name
+
+
+def _acquire(pool, name, extra_bytes=0, activate=True, loader=None):
+    return pool.acquire(f'/models/{name}.gguf', 2048, 0, loader or (lambda: FakeLlama(name)),
+                        activate=activate, extra_bytes=extra_bytes, kv_bytes=0)
+
+
+def _resident(pool):
+    return [entry['model_path'].rsplit('/', 1)[-1] for entry in pool.get_resident()]
+
+
+def test_hit_returns_the_resident_instance():
+    pool = ModelPool(max_resident=2)
+    first = _acquire(pool, 'a')
+    assert _acquire(pool, 'a', loader=lambda: pytest.fail('no debe recargar')) is first
+    assert pool.hits == 1 and pool.misses == 1
+
+
+def test_least_recently_used_model_is_evicted_over_max_resident():
+    pool = ModelPool(max_resident=2)
+    _acquire(pool, 'a')
+    _acquire(pool, 'b')
+    _acquire(pool, 'c')
+    assert _resident(pool) == ['c.gguf', 'b.gguf']
+    assert pool.evictions == 1
+
+
+def test_active_model_is_never_evicted_for_ram_budget():
+    pool = ModelPool(ram_budget_bytes=100, max_resident=4)
+    _acquire(pool, 'a', extra_bytes=60)
+    _acquire(pool, 'helper', extra_bytes=60, activate=False)
+    # 'a' sigue activo: el presupuesto se supera pero no hay nada expulsable
+    assert set(_resident(pool)) == {'a.gguf', 'helper.gguf'}
+
+    _acquire(pool, 'b', extra_bytes=60)
+    assert _resident(pool) == ['b.gguf']
+    assert pool.used_bytes == 60
+
+
+def test_concurrent_acquires_of_the_same_model_load_it_once():
+    pool = ModelPool(max_resident=2)
+    calls = []
+    results = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.1)
+        return FakeLlama('a')
+
+    threads = [threading.Thread(target=lambda: results.append(_acquire(pool, 'a', loader=loader)))
+               for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1
+    assert len(results) == 3 and all(result is results[0] for result in results)
+
+
+def test_failed_load_evicts_nothing_and_can_be_retried():
+    pool = ModelPool(max_resident=1)
+    _acquire(pool, 'a')
+
+    def broken():
+        raise RuntimeError('GGUF corrupto')
+
+    with pytest.raises(RuntimeError):
+        _acquire(pool, 'b', loader=broken)
+    assert _resident(pool) == ['a.gguf']
+    _acquire(pool, 'b')
+    assert _resident(pool) == ['b.gguf']
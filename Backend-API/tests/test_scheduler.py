@@ -0,0 +1,141 @@
+"""
+@Author: Borja Otero Ferreira
+Tests del InferenceScheduler: orden de la cola, cancelación y peticiones exclusivas
+"""
+import threading
+import time
+
+from app.core import cancellation
+from app.core.scheduler import InferenceScheduler
+
+TIMEOUT = 5
+
+
+def _blocker(scheduler, started, release):
+    """Ocupa el worker hasta que se activa release"""
+    def job():
+        started.set()
+        release.wait(TIMEOUT)
+    return scheduler.submit(job)
+
+
+def test_priority_then_arrival_order():
+    scheduler = InferenceScheduler(name='test-order')
+    started, release = threading.Event(), threading.Event()
+    _blocker(scheduler, started, release)
+    assert started.wait(TIMEOUT)
+
+    order = []
+    requests = [scheduler.submit(lambda name=name: order.append(name), priority=priority)
+                for name, priority in (('a', 10), ('b', 1), ('c', 10), ('d', 5))]
+    assert scheduler.depth == 4
+    assert scheduler.get_position(requests[1].request_id) == 1
+    release.set()
+    for request in requests:
+        assert request.wait(TIMEOUT)
+    assert order == ['b', 'd', 'a', 'c']
+
+
+def test_cancel_pending_request_never_runs():
+    scheduler = InferenceScheduler(name='test-cancel-pending')
+    started, release = threading.Event(), threading.Event()
+    _blocker(scheduler, started, release)
+    assert started.wait(TIMEOUT)
+
+    ran = []
+    request = scheduler.submit(lambda: ran.append(True))
+    assert scheduler.cancel(request.request_id)
+    assert scheduler.depth == 0
+    release.set()
+    assert request.wait(TIMEOUT)
+    assert ran == []
+    assert request.cancelled
+    assert scheduler.get_stats()['cancelled'] == 1
+
+
+def test_cancel_running_request_sets_its_token():
+    scheduler = InferenceScheduler(name='test-cancel-running')
+    started = threading.Event()
+
+    def job():
+        started.set()
+        deadline = time.time() + TIMEOUT
+        while not cancellation.is_cancelled() and time.time() < deadline:
+            time.sleep(0.01)
+        return cancellation.is_cancelled()
+
+    request = scheduler.submit(job)
+    assert started.wait(TIMEOUT)
+    assert scheduler.get_position(request.request_id) == 0
+    assert scheduler.cancel(request.request_id)
+    assert request.wait(TIMEOUT)
+    assert request.result is True
+
+
+def test_cancel_session_only_touches_that_session():
+    scheduler = InferenceScheduler(name='test-cancel-session')
+    started, release = threading.Event(), threading.Event()
+    _blocker(scheduler, started, release)
+    assert started.wait(TIMEOUT)
+
+    mine = scheduler.submit(lambda: None, session_id='mine')
+    other = scheduler.submit(lambda: None, session_id='other')
+    assert scheduler.cancel_session('mine') == 1
+    release.set()
+    assert mine.wait(TIMEOUT) and other.wait(TIMEOUT)
+    assert mine.cancelled and not other.cancelled
+
+
+def test_job_error_is_recorded_and_worker_keeps_running():
+    scheduler = InferenceScheduler(name='test-error')
+
+    def fail():
+        raise RuntimeError('boom')
+
+    failed = scheduler.submit(fail)
+    ok = scheduler.submit(lambda: 'ok')
+    assert failed.wait(TIMEOUT) and ok.wait(TIMEOUT)
+    assert isinstance(failed.error, RuntimeError)
+    assert ok.result == 'ok'
+    stats = scheduler.get_stats()
+    assert stats['failed'] == 1 and stats['completed'] == 1
+
+
+def test_exclusive_request_waits_for_running_jobs_and_runs_alone():
+    scheduler = InferenceScheduler(name='test-exclusive', concurrency=2)
+    events = []
+    lock = threading.Lock()
+    release = threading.Event()
+    both_running = threading.Barrier(3)
+
+    def record(event):
+        with lock:
+            events.append(event)
+
+    def shared(name):
+        def job():
+            record(f'{name}-start')
+            both_running.wait(TIMEOUT)
+            release.wait(TIMEOUT)
+            record(f'{name}-end')
+        return job
+
+    def swap():
+        record('swap-start')
+        time.sleep(0.05)
+        record('swap-end')
+
+    first = scheduler.submit(shared('a'))
+    second = scheduler.submit(shared('b'))
+    both_running.wait(TIMEOUT)
+    exclusive = scheduler.submit(swap, exclusive=True)
+    after = scheduler.submit(lambda: record('c'))
+    time.sleep(0.05)
+    assert 'swap-start' not in events
+    release.set()
+    for request in (first, second, exclusive, after):
+        assert request.wait(TIMEOUT)
+
+    swap_start, swap_end = events.index('swap-start'), events.index('swap-end')
+    assert swap_start > events.index('a-end') and swap_start > events.index('b-end')
+    assert events.index('c') > swap_end
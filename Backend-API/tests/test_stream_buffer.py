@@ -0,0 +1,62 @@
+"""
+@Author: Borja Otero Ferreira
+Tests de StreamRing y de la reanudación de streams
+"""
+from app.utils.stream_buffer import StreamBufferRegistry, StreamRing
+
+
+def _fill(ring, count):
+    for index in range(count):
+        ring.append('assistant_response', {'content': str(index), 'finished': False})
+
+
+def test_since_returns_frames_after_last_seq():
+    ring = StreamRing('req', 'session', 'sid', max_frames=10)
+    _fill(ring, 5)
+    frames, truncated = ring.since(2)
+    assert [seq for seq, _, _ in frames] == [3, 4]
+    assert [frame['content'] for _, _, frame in frames] == ['3', '4']
+    assert all(frame['request_id'] == 'req' for _, _, frame in frames)
+    assert not truncated
+
+    frames, truncated = ring.since(-1)
+    assert len(frames) == 5 and not truncated
+    assert ring.since(4) == ([], False)
+
+
+def test_since_reports_frames_dropped_from_the_ring():
+    ring = StreamRing('req', None, None, max_frames=3)
+    _fill(ring, 6)
+    frames, truncated = ring.since(0)
+    assert [seq for seq, _, _ in frames] == [3, 4, 5]
+    assert truncated
+    assert ring.since(2) == (frames, False)
+
+
+def test_finished_frame_marks_the_ring_finished():
+    ring = StreamRing('req', None, None, max_frames=10)
+    ring.append('output_console', {'content': 'tool'})
+    assert not ring.finished
+    ring.append('assistant_response', {'content': '', 'finished': True})
+    assert ring.finished
+
+
+def test_resume_replays_missing_frames_and_redirects_the_stream():
+    registry = StreamBufferRegistry(max_frames=10, ttl_seconds=60)
+    ring = registry.create('req', session_id='session', client_sid='old-sid')
+    _fill(ring, 4)
+    sent = []
+
+    state = registry.resume('req', 1, lambda event, frame: sent.append((event, frame['seq'])),
+                            sid='new-sid')
+    assert sent == [('assistant_response', 2), ('assistant_response', 3)]
+    assert state['replayed'] == 2 and state['next_seq'] == 4
+    assert state['session_id'] == 'session' and not state['finished']
+    assert ring.client_sid == 'new-sid' and ring.resumes == 1
+    assert registry.active_for('new-sid') == [ring]
+    assert registry.active_for('old-sid') == []
+
+
+def test_resume_unknown_request_returns_none():
+    registry = StreamBufferRegistry()
+    assert registry.resume('missing', -1, lambda event, frame: None) is None
@@ -5,6 +5,7 @@ import os
 import importlib
 import importlib.util
 import inspect
+import time
 from pathlib import Path
 from typing import Dict, List, Optional, Type, Any
 from .base_tool import BaseTool, ToolCategory, ToolExecutionResult
@@ -271,8 +272,27 @@ class ToolRegistry:
                     error=f"Tool '{tool_name}' is not available (missing API key?)"
                 )
             
-            # Ejecutar la herramienta
-            result = tool.execute(query, **kwargs)
+            # Ejecutar la herramienta; si la petición se cancela se deja de esperarla
+            from app.core.cancellation import RequestCancelled, run_cancellable
+            from app.utils import metrics
+            from app.utils.tracing import tracer
+            started = time.perf_counter()
+            try:
+                with tracer.span('tool', tool=tool_name, query=query[:200]):
+                    result = run_cancellable(tool.execute, (query,), kwargs, name=f'tool-{tool_name}')
+            except RequestCancelled as e:
+                metrics.tool_calls.labels(tool_name, 'cancelled').inc()
+                return ToolExecutionResult(
+                    success=False,
+                    error=f"Tool '{tool_name}' cancelled ({e})",
+                    metadata={"tool_name": tool_name, "cancelled": True}
+                )
+            except Exception:
+                metrics.tool_calls.labels(tool_name, 'error').inc()
+                metrics.tool_duration_seconds.labels(tool_name).observe(time.perf_counter() - started)
+                raise
+            metrics.tool_calls.labels(tool_name, 'ok').inc()
+            metrics.tool_duration_seconds.labels(tool_name).observe(time.perf_counter() - started)
             
             return ToolExecutionResult(
                 success=True,
@@ -38,6 +38,10 @@ export const ChatProvider = ({ children }) => {
   const messagesLengthRef = useRef(0);
   const finalizationProcessedRef = useRef(false);
   const currentResponseRef = useRef('');
+  // Último frame recibido de la respuesta en curso (para reanudar tras una reconexión)
+  const streamCursorRef = useRef({ requestId: null, seq: -1, finished: true, sessionId: null });
+  // Conversación guardada en el servidor: tras el primer envío solo se manda el mensaje nuevo
+  const conversationRef = useRef({ id: null, version: null });
   
   messagesLengthRef.current = messages.length;
 
@@ -180,6 +184,20 @@ export const ChatProvider = ({ children }) => {
 
     newSocket.on('connect', () => {
       console.log('✅ Conectado al servidor Socket.io en puerto 8081, namespace /test');
+      // Volver a la sala de la conversación (el stream de sus respuestas se envía ahí)
+      if (conversationRef.current.id) {
+        newSocket.emit('join_conversation', { conversation_id: conversationRef.current.id });
+      }
+      // Reconexión con una respuesta a medias: pedir solo los frames que faltan
+      const cursor = streamCursorRef.current;
+      if (cursor.requestId && !cursor.finished) {
+        newSocket.emit('resume', { request_id: cursor.requestId, last_seq: cursor.seq }, (ack) => {
+          console.log('🔁 Stream reanudado:', ack);
+          if (ack?.success && ack.data?.session_id) {
+            cursor.sessionId = ack.data.session_id;
+          }
+        });
+      }
     });
 
     newSocket.on('disconnect', () => {
@@ -189,6 +207,24 @@ export const ChatProvider = ({ children }) => {
     newSocket.on('assistant_response', (response) => {
       console.log('🎯 DEBUG: assistant_response listener ejecutado, finished:', response.finished, 'content length:', response.content?.length || 0);
       
+      // Frames numerados: descartar duplicados de un resume y recordar el último
+      if (response.seq !== undefined) {
+        const cursor = streamCursorRef.current;
+        if (response.request_id === cursor.requestId && response.seq <= cursor.seq) {
+          return;
+        }
+        if (response.request_id !== cursor.requestId) {
+          streamCursorRef.current = { requestId: response.request_id, seq: -1, finished: false, sessionId: null };
+        }
+        streamCursorRef.current.seq = response.seq;
+        streamCursorRef.current.finished = response.finished === true;
+      }
+      
+      // Versión de la conversación tras guardar la respuesta en el servidor
+      if (response.conversation_version !== undefined && response.conversation_id === conversationRef.current.id) {
+        conversationRef.current.version = response.conversation_version;
+      }
+      
       if (response.content !== undefined) {
         if (response.error) {
           addMessageToChat('system', response.content);
@@ -351,15 +387,40 @@ export const ChatProvider = ({ children }) => {
     addMessageToChat('user', image_base64 ? { text, image_base64 } : text);
     
     try {
-      console.log('📤 Enviando historial al backend:', JSON.stringify(conversationHistory.current, null, 2));
-      
-      await axios.post('/user_input', {
-        content: conversationHistory.current,
+      const conversation = conversationRef.current;
+      if (!conversation.id) {
+        conversation.id = `conv_${Date.now()}_${Math.random().toString(36).substr(2, 9)}`;
+        conversation.version = null;
+        // Unirse a la sala antes de enviar: el stream de la respuesta se emite ahí
+        await new Promise((resolve) => {
+          if (!socketRef.current) {
+            resolve();
+            return;
+          }
+          socketRef.current.emit('join_conversation', { conversation_id: conversation.id }, () => resolve());
+        });
+      }
+      const postInput = (full) => axios.post('/user_input', {
+        // Primer envío o resincronización: historial completo; después solo el mensaje nuevo
+        content: full ? conversationHistory.current : conversationHistory.current[conversationHistory.current.length - 1],
+        version: full ? undefined : conversation.version,
+        conversation_id: conversation.id,
         tools,
-        rag
+        rag,
+        sid: socketRef.current?.id
       });
       
-
+      try {
+        console.log('📤 Enviando mensaje al backend (conversación', conversation.id, 'v' + conversation.version + ')');
+        await postInput(conversation.version === null);
+      } catch (error) {
+        // 409: el servidor no tiene esta versión de la conversación, se envía el historial completo
+        if (error.response?.status !== 409) {
+          throw error;
+        }
+        console.log('🔄 Conversación desincronizada, reenviando historial completo');
+        await postInput(true);
+      }
       
     } catch (error) {
       console.error('Error al enviar mensaje:', error);
@@ -368,6 +429,16 @@ export const ChatProvider = ({ children }) => {
     }
   }, [tools, rag, hideError, showError, addMessageToChat]);
 
+  // Olvidar la conversación del servidor: el próximo envío crea otra con el historial completo
+  const resetConversation = useCallback(() => {
+    const { id } = conversationRef.current;
+    if (id) {
+      socketRef.current?.emit('leave_conversation', { conversation_id: id });
+      axios.delete(`/api/conversations/${id}`).catch(() => {});
+    }
+    conversationRef.current = { id: null, version: null };
+  }, []);
+
   // Función para cargar un chat específico
   const loadChat = useCallback(async (chatName) => {
     try {
@@ -376,6 +447,7 @@ export const ChatProvider = ({ children }) => {
       if (response.data && Array.isArray(response.data)) {
         setMessages(response.data);
         conversationHistory.current = response.data;
+        resetConversation();
         setChatId(chatName);
         setTokensCount(0);
       }
@@ -383,15 +455,16 @@ export const ChatProvider = ({ children }) => {
       console.error('Error al cargar el chat:', error);
       showError(error);
     }
-  }, [showError]);
+  }, [showError, resetConversation]);
 
   // Función para crear un nuevo chat
   const newChat = useCallback(() => {
     setMessages([]);
     conversationHistory.current = [{ role: 'system', content: modelConfig.systemMessage }];
+    resetConversation();
     setChatId(''); // Importante: resetear el chatId para que se cree uno nuevo
     setTokensCount(0);
-  }, [modelConfig.systemMessage]);
+  }, [modelConfig.systemMessage, resetConversation]);
 
   // Función para eliminar un chat
   const deleteChat = useCallback(async (chatName) => {
@@ -412,9 +485,10 @@ export const ChatProvider = ({ children }) => {
     setTokensCount(0);
     setChatId(''); //resetear el chatId
     conversationHistory.current = [{ role: 'system', content: modelConfig.systemMessage }];
+    resetConversation();
     setIsLoading(false);
     console.log('Chat limpiado 🗑️');
-  }, [modelConfig.systemMessage]);
+  }, [modelConfig.systemMessage, resetConversation]);
 
   // Función para cargar modelos y formatos
   const fetchModelsAndFormats = useCallback(async () => {
@@ -486,7 +560,14 @@ export const ChatProvider = ({ children }) => {
   // Función para detener respuesta
   const stopResponse = useCallback(async () => {
     try {
-      const response = await axios.post('/stop_response');
+      const socket = socketRef.current;
+      // Por el socket el servidor identifica la sesión por su sid (no se envía ningún id)
+      const response = socket?.connected
+        ? await new Promise((resolve) => socket.emit('stop_response', {}, (ack) => resolve({ data: ack })))
+        : await axios.post('/stop_response', {
+            sid: socket?.id,
+            session_id: streamCursorRef.current.sessionId || undefined
+          });
       setCurrentResponse('');
       setIsLoading(false);
       addMessageToChat('system', 'Respuesta detenida ⏹️');